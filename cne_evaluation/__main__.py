@@ -0,0 +1,7 @@
+"""
+python -m cne_evaluation (see cli).
+"""
+import sys
+from .cli import main
+
+sys.exit(main())
@@ -0,0 +1,299 @@
+"""
+Aggregate.
+
+Totalización de votos a partir de los QR decodificados, por estado,
+municipio y parroquia (la jerarquía de directorios de las actas).
+
+Payloads are parsed once into a NumPy table (one row per mesa, one
+column per candidate) with the estado/municipio/parroquia of every mesa
+dictionary-encoded as integer codes. Totals per level are kept up to
+date on every decoded acta (the row is added to the totals of its
+groups: O(candidates)), a full vectorized group-by rebuilds them.
+
+Usage:
+    cne totals results.db --level estado
+"""
+from typing import Union
+from collections.abc import Iterable
+import json
+from pathlib import PurePath
+import numpy as np
+from .results import load_results
+
+
+LEVELS = ('estado', 'municipio', 'parroquia')
+
+
+def parse_payload(data: str) -> tuple[str, np.ndarray]:
+    """parse_payload.
+
+    Mesa code and votes per candidate of a QR payload
+    (``mesa!v1,v2,...,vN!n!n``).
+    """
+    parts = data.strip().split('!')
+    if len(parts) < 2 or not parts[0]:
+        raise ValueError(f"Invalid payload: {data!r}")
+    try:
+        votes = np.array(
+            [int(v) for v in parts[1].split(',') if v.strip()],
+            dtype=np.int32
+        )
+    except ValueError as exc:
+        raise ValueError(f"Invalid votes on payload: {data!r}") from exc
+    if (votes < 0).any():
+        raise ValueError(f"Negative votes on payload: {data!r}")
+    return parts[0], votes
+
+
+class VoteTable:
+    """VoteTable.
+
+    Votes per mesa and candidate, with incremental totals per estado,
+    municipio and parroquia (and national).
+
+    A mesa is counted once: decoding the same acta again replaces its
+    row, another acta of the same mesa with different votes is recorded
+    as a conflict (the first one is kept).
+    """
+    def __init__(self, candidates: int = 0, capacity: int = 1024) -> None:
+        self.candidates = candidates
+        self._size = 0
+        self._votes = np.zeros((capacity, candidates), dtype=np.int32)
+        # group code of every mesa, one column per level
+        self._codes = np.zeros((capacity, len(LEVELS)), dtype=np.int32)
+        self._rows: dict[str, int] = {}
+        self._mesas: list[str] = []
+        self._paths: list[str] = []
+        # dictionary encoding of the groups of every level
+        self._groups: list[dict[tuple, int]] = [{} for _ in LEVELS]
+        self._names: list[list[tuple]] = [[] for _ in LEVELS]
+        self._totals = [
+            np.zeros((0, candidates), dtype=np.int64) for _ in LEVELS
+        ]
+        self.national = np.zeros(candidates, dtype=np.int64)
+        # mesa -> {path: votes} of the scans with other votes
+        self.conflicts: dict[str, dict] = {}
+        self.errors: int = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def votes(self) -> np.ndarray:
+        """votes.
+
+        (mesas, candidates) view of the votes.
+        """
+        return self._votes[:self._size]
+
+    def _widen(self, candidates: int) -> None:
+        # a payload with more candidates: pad every array
+        extra = candidates - self.candidates
+        self._votes = np.pad(self._votes, ((0, 0), (0, extra)))
+        self._totals = [np.pad(t, ((0, 0), (0, extra))) for t in self._totals]
+        self.national = np.pad(self.national, (0, extra))
+        self.candidates = candidates
+
+    def _grow(self) -> None:
+        capacity = len(self._votes) * 2
+        votes = np.zeros((capacity, self.candidates), dtype=np.int32)
+        votes[:self._size] = self._votes[:self._size]
+        codes = np.zeros((capacity, len(LEVELS)), dtype=np.int32)
+        codes[:self._size] = self._codes[:self._size]
+        self._votes, self._codes = votes, codes
+
+    def _code(self, level: int, key: tuple) -> int:
+        code = self._groups[level].get(key)
+        if code is None:
+            code = len(self._names[level])
+            self._groups[level][key] = code
+            self._names[level].append(key)
+            self._totals[level] = np.concatenate([
+                self._totals[level],
+                np.zeros((1, self.candidates), dtype=np.int64)
+            ])
+        return code
+
+    def _apply(self, row: int, sign: int) -> None:
+        votes = self._votes[row].astype(np.int64) * sign
+        self.national += votes
+        for level, code in enumerate(self._codes[row]):
+            self._totals[level][code] += votes
+
+    def add(
+        self,
+        relative_path: Union[str, PurePath],
+        data: str,
+        filename: str = None
+    ) -> bool:
+        """add.
+
+        Add (or replace) the votes of a decoded acta, relative_path gives
+        its estado/municipio/parroquia. Returns False if the payload is
+        invalid or the mesa was already counted from another acta.
+        """
+        try:
+            mesa, votes = parse_payload(data)
+        except ValueError:
+            self.errors += 1
+            return False
+        path = PurePath(relative_path)
+        if filename is not None:
+            path = path.joinpath(filename)
+        path = path.as_posix()
+        if len(votes) > self.candidates:
+            self._widen(len(votes))
+        row = self._rows.get(mesa)
+        if row is not None:
+            if self._paths[row] != path:
+                if not np.array_equal(self._votes[row][:len(votes)], votes):
+                    self.conflicts.setdefault(
+                        mesa, {self._paths[row]: self._votes[row].tolist()}
+                    )[path] = votes.tolist()
+                return False
+            # the same acta decoded again
+            self._apply(row, -1)
+        else:
+            if self._size == len(self._votes):
+                self._grow()
+            row = self._size
+            self._size += 1
+            self._rows[mesa] = row
+            self._mesas.append(mesa)
+            self._paths.append(path)
+            parts = (list(PurePath(relative_path).parts[:3]) + [''] * 3)[:3]
+            for level in range(len(LEVELS)):
+                self._codes[row, level] = self._code(
+                    level, tuple(parts[:level + 1])
+                )
+        self._votes[row] = 0
+        self._votes[row, :len(votes)] = votes
+        self._apply(row, 1)
+        return True
+
+    def load(self, records: Iterable[dict]) -> int:
+        """load.
+
+        Add result records (see results.make_record), in bulk.
+        """
+        count = 0
+        for record in records:
+            if not record.get('data'):
+                continue
+            # record paths are "estado/municipio/parroquia/filename"
+            path = PurePath(record['path'])
+            count += self.add(path.parent, record['data'], path.name)
+        return count
+
+    def groupby(self, level: str) -> np.ndarray:
+        """groupby.
+
+        Votes per group of level (groups x candidates), computed from the
+        whole table (vectorized).
+        """
+        index = LEVELS.index(level)
+        groups = len(self._names[index])
+        # one bincount over (group, candidate) cells
+        cells = (
+            self._codes[:self._size, index, None].astype(np.int64)
+            * self.candidates + np.arange(self.candidates)
+        )
+        totals = np.bincount(
+            cells.ravel(),
+            weights=self.votes.ravel(),
+            minlength=groups * self.candidates
+        )
+        return totals.round().astype(np.int64).reshape(groups, self.candidates)
+
+    def rebuild(self) -> None:
+        """rebuild.
+
+        Recompute the incremental totals from the table.
+        """
+        for index, level in enumerate(LEVELS):
+            self._totals[index] = self.groupby(level)
+        self.national = self.votes.sum(axis=0, dtype=np.int64)
+
+    def totals(self, level: str = None) -> dict[str, list[int]]:
+        """totals.
+
+        Current votes per candidate of every group of level (national if
+        level is None), the keys are "estado/municipio/parroquia" paths.
+        """
+        if level is None:
+            return {'': self.national.tolist()}
+        index = LEVELS.index(level)
+        return {
+            '/'.join(name): votes.tolist()
+            for name, votes in zip(self._names[index], self._totals[index])
+        }
+
+    def mesas(self, level: str) -> dict[str, int]:
+        """mesas.
+
+        Number of mesas counted on every group of level.
+        """
+        index = LEVELS.index(level)
+        counts = np.bincount(
+            self._codes[:self._size, index],
+            minlength=len(self._names[index])
+        )
+        return {
+            '/'.join(name): int(count)
+            for name, count in zip(self._names[index], counts)
+        }
+
+    def summary(self) -> dict:
+        """summary.
+
+        National and per level totals (JSON-serializable).
+        """
+        summary = {
+            'mesas': self._size,
+            'candidates': self.candidates,
+            'national': self.national.tolist(),
+            'conflicts': len(self.conflicts),
+            'errors': self.errors,
+        }
+        for level in LEVELS:
+            mesas = self.mesas(level)
+            summary[level] = {
+                key: {'mesas': mesas[key], 'votes': votes}
+                for key, votes in self.totals(level).items()
+            }
+        return summary
+
+    def save(self, filename: Union[str, PurePath]) -> None:
+        with open(filename, 'w', encoding='utf-8') as fp:
+            json.dump(self.summary(), fp, ensure_ascii=False)
+
+    @classmethod
+    def from_results(cls, filename: Union[str, PurePath]) -> 'VoteTable':
+        """from_results.
+
+        Table of a results file (.db, .jsonl or .parquet).
+        """
+        table = cls()
+        table.load(load_results(filename))
+        return table
+
+
+def run(options) -> int:
+    """run.
+
+    Print the totals of a results file (cne totals): national, or per
+    level, and save the JSON summary.
+    """
+    table = VoteTable.from_results(options.results)
+    print(
+        f"{len(table)} mesas, {table.candidates} candidates, "
+        f"{len(table.conflicts)} conflicts, {table.errors} invalid payloads"
+    )
+    if options.level:
+        mesas = table.mesas(options.level)
+        for key, votes in sorted(table.totals(options.level).items()):
+            print(f"{key}\t{mesas[key]}\t{','.join(map(str, votes))}")
+    print(f"national\t{len(table)}\t{','.join(map(str, table.national))}")
+    if options.output:
+        table.save(options.output)
+    return 0
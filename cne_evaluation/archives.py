@@ -0,0 +1,362 @@
+"""
+Archives.
+
+Iterar sobre las actas contenidas en archivos .zip/.tar(.gz) sin
+extraerlas al disco.
+
+ArchiveIterator follows the DirectoryIterator contract: it yields
+``(relative_path, destination_path, image)`` items, where image is an
+ArchiveMember (the member bytes, decoded with cv2.imdecode by the
+ImageProcessor) and relative_path keeps the estado/municipio/parroquia
+hierarchy of the member path.
+"""
+from typing import Union, Optional
+from collections import deque
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+import os
+import zlib
+import asyncio
+import calendar
+import tarfile
+import zipfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path, PurePath, PurePosixPath
+from .logs import getLogger
+from .manifest import Manifest
+
+
+ARCHIVE_SUFFIXES = (
+    '.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz'
+)
+
+# errors of a corrupt or truncated archive (or member)
+READ_ERRORS = (
+    OSError, EOFError, zlib.error, zipfile.BadZipFile, tarfile.TarError
+)
+
+
+def is_archive(path: Union[str, PurePath]) -> bool:
+    """is_archive.
+
+    True if path is a .zip or .tar(.gz, .bz2, .xz) file.
+    """
+    return str(path).lower().endswith(ARCHIVE_SUFFIXES) and Path(path).is_file()
+
+
+@dataclass
+class ArchiveMember:
+    """ArchiveMember.
+
+    An acta read from an archive (kept in memory).
+    archive: archive file.
+    member: path of the member inside the archive.
+    data: content of the member (encoded image), None until loaded.
+    reader: reads the content from the archive (see load).
+    """
+    archive: PurePath
+    member: str
+    data: bytes
+    size: int = 0
+    mtime: float = 0.0
+    reader: Callable = field(default=None, repr=False, compare=False)
+
+    @property
+    def name(self) -> str:
+        return PurePosixPath(self.member).name
+
+    @property
+    def suffix(self) -> str:
+        return PurePosixPath(self.member).suffix
+
+    def stat(self):
+        # size/mtime of the member, as used by the Manifest
+        return SimpleNamespace(
+            st_size=self.size,
+            st_mtime_ns=int(self.mtime * 1e9)
+        )
+
+    def load(self) -> bytes:
+        """load.
+
+        Content of the member, read from the archive on first use (the
+        reader is dropped: a loaded member can be sent to a worker).
+        """
+        if self.data is None and self.reader is not None:
+            self.data, self.reader = self.reader(), None
+        return self.data
+
+    def __str__(self) -> str:
+        return f"{self.archive}:{self.member}"
+
+
+@dataclass
+class MemoryFile(ArchiveMember):
+    """MemoryFile.
+
+    An acta file already read (ex: to fingerprint it), the ImageProcessor
+    decodes its bytes instead of reading the file again.
+    """
+    @classmethod
+    def read(cls, filename: Union[str, PurePath]) -> 'MemoryFile':
+        path = Path(filename)
+        with open(path, 'rb') as fp:
+            stat = os.fstat(fp.fileno())
+            data = fp.read()
+        return cls(path, path.name, data, stat.st_size, stat.st_mtime)
+
+    def __str__(self) -> str:
+        return str(self.archive)
+
+
+def _zip_members(archive: PurePath) -> Iterator[tuple]:
+    with zipfile.ZipFile(archive) as zf:
+        # read in the physical order of the archive (sequential I/O)
+        infos = sorted(zf.infolist(), key=lambda info: info.header_offset)
+        for info in infos:
+            if info.is_dir():
+                continue
+            # zip times have no timezone: read as UTC, the same on any host
+            mtime = calendar.timegm(info.date_time + (0, 0, 0))
+            yield info.filename, info.file_size, mtime, lambda i=info: zf.read(i)
+
+
+def _tar_members(archive: PurePath) -> Iterator[tuple]:
+    # streaming mode: members are read once, sequentially
+    with tarfile.open(archive, mode='r|*') as tf:
+        for info in tf:
+            if not info.isfile():
+                continue
+            yield (
+                info.name, info.size, info.mtime,
+                lambda i=info: tf.extractfile(i).read()
+            )
+
+
+def archive_members(archive: Union[str, PurePath]) -> Iterator[tuple]:
+    """archive_members.
+
+    (name, size, mtime, read) of every regular member, in archive order;
+    read() must be called before advancing the iterator.
+    """
+    if zipfile.is_zipfile(archive):
+        return _zip_members(archive)
+    return _tar_members(archive)
+
+
+class ArchiveIterator:
+    """ArchiveIterator.
+
+    Async iterator over the actas of one or more .zip/.tar(.gz) archives.
+
+    Members are read sequentially by a single thread (tar streams can not
+    be read out of order) and prefetched in batches, the number of
+    batches in memory is bounded by prefetch.
+    """
+    def __init__(
+        self,
+        archives: Union[str, PurePath, list],
+        destination: Union[str, PurePath],
+        extensions: list = None,
+        manifest: Manifest = None,
+        strip_components: int = 0,
+        batch_size: int = 16,
+        prefetch: int = 4
+    ) -> None:
+        if isinstance(archives, (str, PurePath)):
+            archives = [archives]
+        self.archives = [Path(archive) for archive in archives]
+        if isinstance(destination, str):
+            self._destination = Path(destination).resolve()
+        else:
+            self._destination = destination
+        if extensions is None:
+            extensions = ('.jpg', '.jpeg', '.png')
+        self.ext = tuple(e.lower() for e in extensions)
+        # leading directories removed from the member paths (as tar does)
+        self.strip_components = strip_components
+        self.manifest = manifest
+        self.skipped: int = 0
+        # unreadable archives and members (logged and skipped)
+        self.errors: int = 0
+        self.total: int = None
+        self.batch_size = batch_size
+        self.prefetch = prefetch
+        self._current = None
+        self._batch: deque = deque()
+        self._queue: asyncio.Queue = None
+        self._reader: asyncio.Task = None
+        self._exhausted: bool = False
+        self._stop = threading.Event()
+        self.logger = getLogger(
+            "CNE.ArchiveIterator"
+        )
+        self.logger.notice(
+            f"Start Iteration over archives {', '.join(map(str, self.archives))}"
+        )
+
+    def current(self) -> Optional[ArchiveMember]:
+        """current.
+
+        Return current Image (archive member).
+        """
+        return self._current
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._batch:
+            if self._exhausted:
+                raise StopAsyncIteration
+            batch = await self._next_batch()
+            if batch is None:
+                self._exhausted = True
+            else:
+                self._batch.extend(batch)
+        self._current = self._batch.popleft()
+        return self._current
+
+    async def count(self) -> int:
+        """count.
+
+        Number of actas on the archives (only the member headers are
+        read: cheap for zip, a tar.gz is decompressed once).
+        """
+        if self.total is None:
+            loop = asyncio.get_running_loop()
+            self.total = await loop.run_in_executor(None, self._count)
+        return self.total
+
+    def _count(self) -> int:
+        total = 0
+        for archive in self.archives:
+            try:
+                if zipfile.is_zipfile(archive):
+                    with zipfile.ZipFile(archive) as zf:
+                        names = [
+                            i.filename for i in zf.infolist() if not i.is_dir()
+                        ]
+                else:
+                    with tarfile.open(archive, mode='r|*') as tf:
+                        names = [i.name for i in tf if i.isfile()]
+            except READ_ERRORS as exc:
+                self.logger.error(f"Unable to read archive {archive}: {exc}")
+                continue
+            total += sum(1 for name in names if self.relative(name) is not None)
+        return total
+
+    def close(self):
+        """close.
+
+        Stop reading the archives (if the iteration is abandoned).
+        """
+        self._stop.set()
+        if self._reader is not None and not self._reader.done():
+            self._reader.cancel()
+        self._exhausted = True
+
+    def relative(self, member: str) -> Optional[PurePosixPath]:
+        """relative.
+
+        Member path relative to the actas root (None if the member is
+        not an acta or its path is unsafe).
+        """
+        path = PurePosixPath(member)
+        if path.is_absolute() or '..' in path.parts:
+            # never write outside the destination directory
+            self.logger.warning(f"Skipping unsafe archive member: {member}")
+            return None
+        if not path.name.lower().endswith(self.ext):
+            return None
+        parts = path.parts[self.strip_components:]
+        if not parts:
+            return None
+        return PurePosixPath(*parts)
+
+    async def _next_batch(self):
+        if self._reader is None:
+            self._queue = asyncio.Queue(maxsize=self.prefetch)
+            self._reader = asyncio.ensure_future(self._read())
+        return await self._queue.get()
+
+    async def _read(self):
+        loop = asyncio.get_running_loop()
+        pool = ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix='cne_archive'
+        )
+        try:
+            for archive in self.archives:
+                # a corrupt archive never stops the next ones
+                try:
+                    members = self._members(archive)
+                    while True:
+                        batch = await loop.run_in_executor(
+                            pool, self._read_batch, members
+                        )
+                        if batch:
+                            await self._queue.put(batch)
+                        if len(batch) < self.batch_size:
+                            break
+                except Exception as exc:  # pylint: disable=W0718
+                    self.errors += 1
+                    self.logger.error(
+                        f"Unable to read archive {archive}: {exc}"
+                    )
+        finally:
+            self._stop.set()
+            pool.shutdown(wait=False)
+        # end of iteration (not reached when cancelled):
+        await self._queue.put(None)
+
+    def _members(self, archive: Path) -> Iterator[tuple]:
+        destination = Path(self._destination)
+        for name, size, mtime, read in archive_members(archive):
+            if self._stop.is_set():
+                return
+            relative = self.relative(name)
+            if relative is None:
+                continue
+            relative_path = Path(*relative.parent.parts)
+            # the member is only read if not skipped (or to hash it)
+            acta = ArchiveMember(
+                archive=archive,
+                member=name,
+                data=None,
+                size=size,
+                mtime=mtime,
+                reader=read
+            )
+            try:
+                if self.manifest is not None and self.manifest.is_processed(
+                    Manifest.key(relative_path, acta.name),
+                    acta,
+                    stat=acta.stat()
+                ):
+                    self.skipped += 1
+                    continue
+                acta.load()
+            except (zlib.error, zipfile.BadZipFile) as exc:
+                # a corrupt zip member (tar streams can not go on)
+                self.errors += 1
+                self.logger.error(f"Unable to read {acta}: {exc}")
+                continue
+            self.logger.debug(
+                f"Extracting Image {acta}"
+            )
+            yield (
+                relative_path,
+                destination.joinpath(relative_path, acta.name),
+                acta
+            )
+
+    def _read_batch(self, members: Iterator[tuple]) -> list:
+        batch = []
+        for item in members:
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                break
+        return batch
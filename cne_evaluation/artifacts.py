@@ -0,0 +1,302 @@
+"""
+Artifacts.
+
+Política de salida de cada acta (qué archivos se escriben y cuándo) y
+parámetros de codificación por archivo.
+
+Artifacts of an acta:
+    image: the full enhanced acta (<stem><suffix>).
+    bottom: the QR search area (<stem>_bottom<suffix>).
+    qr_code: the QR crop (<stem>_qr_code<suffix>), only when decoded.
+    data: the decoded payload (<stem>.txt).
+
+A policy says when each one is written (always, success, failure or
+never), ex: "image=failure, bottom=never, qr_code=always, data=always".
+Encoders override the format of every image artifact, ex:
+"image=jpg:85, bottom=webp:80, qr_code=png:bilevel"; the source suffix
+(with OpenCV defaults) is kept otherwise.
+"""
+from typing import Union, Optional
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor, Future
+from pathlib import PurePath, Path
+import time
+import threading
+import cv2
+import numpy as np
+from .logs import getLogger
+from .metrics import Metrics
+
+
+ARTIFACTS = ('image', 'bottom', 'qr_code', 'data')
+
+ALWAYS = 'always'
+SUCCESS = 'success'
+FAILURE = 'failure'
+NEVER = 'never'
+WHEN = (ALWAYS, SUCCESS, FAILURE, NEVER)
+
+POLICIES = {
+    # the historical output: everything
+    'all': 'image=always, bottom=always, qr_code=always, data=always',
+    # QR crop and payload, the full acta only to review the failures
+    'failures': 'image=failure, bottom=failure, qr_code=always, data=always',
+    'minimal': 'image=never, bottom=never, qr_code=always, data=always',
+}
+
+SUFFIXES = {
+    'image': '',
+    'bottom': '_bottom',
+    'qr_code': '_qr_code',
+}
+
+
+def _parse(spec: str, allowed: Callable = None) -> dict[str, str]:
+    values = {}
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        artifact, _, value = item.partition('=')
+        artifact = artifact.strip()
+        if artifact not in ARTIFACTS:
+            raise ValueError(f"Unknown artifact: {artifact}")
+        value = value.strip()
+        if allowed is not None and not allowed(value):
+            raise ValueError(f"Invalid value for artifact {artifact}: {value}")
+        values[artifact] = value
+    return values
+
+
+@dataclass
+class Encoder:
+    """Encoder.
+
+    Format (suffix) and OpenCV imwrite parameters of an image artifact.
+    bilevel: binarize (Otsu) before writing, lossless 1-bit PNG or a
+    deflate TIFF (OpenCV can not write 1-bit TIFF/CCITT).
+    """
+    suffix: str = None
+    params: list = field(default_factory=list)
+    bilevel: bool = False
+
+    @classmethod
+    def from_spec(cls, spec: str) -> 'Encoder':
+        """from_spec.
+
+        "jpg:85", "webp:80", "webp:lossless", "png:3", "png:bilevel",
+        "tiff:lzw", "tiff:bilevel" or "source".
+        """
+        fmt, _, option = spec.strip().lower().partition(':')
+        fmt = fmt.lstrip('.')
+        if fmt in ('', 'source'):
+            return cls()
+        if fmt in ('jpg', 'jpeg'):
+            quality = int(option or 95)
+            return cls('.jpg', [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if fmt == 'webp':
+            quality = 101 if option == 'lossless' else int(option or 90)
+            return cls('.webp', [cv2.IMWRITE_WEBP_QUALITY, quality])
+        if fmt == 'png':
+            if option == 'bilevel':
+                return cls(
+                    '.png',
+                    [cv2.IMWRITE_PNG_BILEVEL, 1, cv2.IMWRITE_PNG_COMPRESSION, 9],
+                    bilevel=True
+                )
+            return cls('.png', [cv2.IMWRITE_PNG_COMPRESSION, int(option or 3)])
+        if fmt in ('tif', 'tiff'):
+            compression = {
+                '': cv2.IMWRITE_TIFF_COMPRESSION_LZW,
+                'lzw': cv2.IMWRITE_TIFF_COMPRESSION_LZW,
+                'deflate': cv2.IMWRITE_TIFF_COMPRESSION_ADOBE_DEFLATE,
+                'bilevel': cv2.IMWRITE_TIFF_COMPRESSION_ADOBE_DEFLATE,
+                'none': cv2.IMWRITE_TIFF_COMPRESSION_NONE,
+            }
+            if option not in compression:
+                raise ValueError(f"Unknown TIFF compression: {option}")
+            return cls(
+                '.tif',
+                [cv2.IMWRITE_TIFF_COMPRESSION, compression[option]],
+                bilevel=option == 'bilevel'
+            )
+        raise ValueError(f"Unknown artifact format: {spec}")
+
+    def prepare(self, image: np.ndarray) -> np.ndarray:
+        if not self.bilevel:
+            return image
+        if len(image.shape) == 3 and image.shape[2] > 1:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        return cv2.threshold(
+            image, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU
+        )[1]
+
+    def write(self, filename: PurePath, image: np.ndarray) -> None:
+        if not cv2.imwrite(str(filename), self.prepare(image), self.params):
+            raise OSError(f"Unable to write {filename}")
+
+
+class ArtifactWriter:
+    """ArtifactWriter.
+
+    Encodes and writes artifacts on background threads (OpenCV releases
+    the GIL while encoding), at most max_pending writes are queued: the
+    caller blocks beyond that (backpressure, bounded memory).
+    """
+    def __init__(self, max_workers: int = 2, max_pending: int = 8) -> None:
+        self.max_workers = max_workers
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix='cne_artifacts'
+        )
+        self._pending: set[Future] = set()
+        self._lock = threading.Lock()
+        self.metrics = Metrics()
+        self.logger = getLogger(
+            "CNE.ArtifactWriter"
+        )
+
+    def submit(
+        self,
+        filename: PurePath,
+        image: np.ndarray,
+        encoder: Encoder
+    ) -> Future:
+        self._slots.acquire()
+        future = self._executor.submit(self._write, filename, image, encoder)
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._done)
+        return future
+
+    def _write(self, filename, image, encoder: Encoder) -> None:
+        started = time.perf_counter()
+        try:
+            encoder.write(filename, image)
+        except Exception as exc:  # pylint: disable=W0718
+            self.logger.error(f"Unable to write artifact {filename}: {exc}")
+            with self._lock:
+                self.metrics.failure('write_error')
+        # under the lock: collect() may swap the collector meanwhile
+        with self._lock:
+            self.metrics.observe(
+                'encode', time.perf_counter() - started, image.nbytes
+            )
+
+    def _done(self, future: Future) -> None:
+        with self._lock:
+            self._pending.discard(future)
+        self._slots.release()
+
+    def flush(self) -> None:
+        """flush.
+
+        Wait until every queued artifact is written.
+        """
+        with self._lock:
+            pending = list(self._pending)
+        for future in pending:
+            future.result()
+
+    def collect(self) -> dict:
+        """collect.
+
+        Snapshot of the encode metrics since the last collect (merged on
+        the metrics of an acta, see process_acta).
+        """
+        with self._lock:
+            metrics, self.metrics = self.metrics, Metrics()
+        return metrics.snapshot()
+
+
+_WRITER: Optional[ArtifactWriter] = None
+_WRITER_LOCK = threading.Lock()
+
+
+def get_writer() -> ArtifactWriter:
+    """get_writer.
+
+    ArtifactWriter of the current process (created on first use).
+    """
+    global _WRITER  # pylint: disable=W0603
+    if _WRITER is None:
+        with _WRITER_LOCK:
+            if _WRITER is None:
+                _WRITER = ArtifactWriter()
+    return _WRITER
+
+
+class ArtifactPolicy:
+    """ArtifactPolicy.
+
+    Which artifacts of an acta are written, when, and how they are
+    encoded. With background=True images are encoded off the critical
+    path (see ArtifactWriter).
+    """
+    def __init__(
+        self,
+        policy: str = 'all',
+        encoders: Union[str, dict] = None,
+        background: bool = False
+    ) -> None:
+        spec = POLICIES.get(policy, policy)
+        self.policy = policy
+        self.when = {artifact: ALWAYS for artifact in ARTIFACTS}
+        self.when.update(_parse(spec, lambda value: value in WHEN))
+        if isinstance(encoders, str):
+            encoders = {
+                artifact: Encoder.from_spec(value)
+                for artifact, value in _parse(encoders).items()
+            }
+        self.encoders: dict[str, Encoder] = encoders or {}
+        self.background = background
+
+    def emits(self, artifact: str, ok: Optional[bool] = None) -> bool:
+        """emits.
+
+        The artifact is written for an acta decoded (ok=True), not
+        decoded (ok=False) or with an unknown outcome yet (ok=None).
+        """
+        when = self.when[artifact]
+        if when == ALWAYS:
+            return True
+        if when == NEVER or ok is None:
+            return False
+        return ok if when == SUCCESS else not ok
+
+    def deferred(self, artifact: str) -> bool:
+        # depends on the QR decoding outcome
+        return self.when[artifact] in (SUCCESS, FAILURE)
+
+    def encoder(self, artifact: str) -> Encoder:
+        return self.encoders.get(artifact) or Encoder()
+
+    def filename(self, destination: PurePath, artifact: str) -> PurePath:
+        destination = Path(destination)
+        if artifact == 'data':
+            return destination.with_name(f"{destination.stem}.txt")
+        suffix = self.encoder(artifact).suffix or destination.suffix
+        return destination.with_name(
+            f"{destination.stem}{SUFFIXES[artifact]}{suffix}"
+        )
+
+    def write(
+        self,
+        filename: PurePath,
+        image: np.ndarray,
+        artifact: str,
+        copy: bool = False
+    ) -> None:
+        """write.
+
+        Encode an image artifact (in background, if enabled). copy: the
+        image is a reusable buffer (it changes after the acta).
+        """
+        encoder = self.encoder(artifact)
+        if not self.background:
+            encoder.write(filename, image)
+            return
+        if copy:
+            image = image.copy()
+        get_writer().submit(filename, image, encoder)
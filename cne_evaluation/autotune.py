@@ -0,0 +1,387 @@
+"""
+Autotune.
+
+Ajuste automático de los parámetros del pipeline (tolerancia de rotación,
+área del QR, estimador de inclinación, perfil de mejora y cascada de
+decodificación) sobre una muestra de actas de un lote de escáner.
+
+Every trial runs the in-memory pipeline over the sample (labeled
+synthetic actas: the payload must match; any other actas: the QR must be
+decoded). The search is a coordinate descent from the current settings:
+every parameter is tried with each of its candidate values keeping the
+others fixed, the best one is kept, until a round brings no improvement.
+The objective is decoded actas per millisecond, configurations that
+decode fewer actas than the starting point (minus max_drop) are
+rejected.
+
+The tuned profile is a JSON file loaded with load_tuned (see the
+TUNED_PROFILE setting).
+
+Usage:
+    python -m cne_evaluation.autotune /actas/lote1 --sample 40 --output lote1.json
+"""
+from typing import Union, Optional
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+from collections.abc import Iterable
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from functools import lru_cache
+from pathlib import PurePath, Path
+from .logs import getLogger
+from .version import __version__
+from .synthetic import load_specs
+from .deskew import DeskewEstimator, PRESETS, get_estimator
+from .qr_cascade import DecodeCascade, DEFAULT_CASCADE
+from .artifacts import ArtifactPolicy
+from .pipeline import resolve_profile
+from .images import ImageProcessor
+
+
+# nothing is written during the trials
+NO_ARTIFACTS = 'image=never, bottom=never, qr_code=never, data=never'
+
+# candidate values of every parameter
+SEARCH_SPACE = {
+    'tolerance': [0.2, 0.4, 0.8, 1.5],
+    'area': [0.12, 0.15, 0.2, 0.25],
+    'deskew': [
+        {'method': 'hough', 'max_side': 600},
+        {'method': 'hough', 'max_side': 800},
+        {'method': 'hough', 'max_side': 1000},
+        {'method': 'hough', 'max_side': 1000, 'canny_low': 30, 'canny_high': 90},
+        {'method': 'hough', 'max_side': 1000, 'canny_low': 80, 'canny_high': 200},
+        {'method': 'hough', 'max_side': 1000, 'threshold': 0.3},
+        {'method': 'hough_p', 'max_side': 1000},
+        {'method': 'projection', 'max_side': 1600, 'fine_step': 0.05},
+    ],
+    'enhance': [
+        'crop',
+        'sharpen(amount=0.5), crop',
+        'sharpen, crop',
+        'sharpen(amount=1.5), crop',
+        'grayscale, sharpen, crop',
+        'grayscale, contrast, adaptive_sharpen(sigma=3), crop',
+        'grayscale, denoise(h=5), morph(size=3), sharpen, crop',
+        'sharpen, crop, clean_dots(size=2)',
+    ],
+}
+
+TUNED = ('tolerance', 'area', 'deskew', 'enhance', 'cascade')
+
+
+def deskew_spec(deskew: Union[str, dict]) -> dict:
+    """deskew_spec.
+
+    Estimator options of a preset (or estimator name).
+    """
+    if isinstance(deskew, dict):
+        return dict(deskew)
+    if deskew in PRESETS:
+        method, options = PRESETS[deskew]
+        return {'method': method, **options}
+    return {'method': deskew}
+
+
+def build_estimator(spec: dict) -> DeskewEstimator:
+    options = dict(spec)
+    return get_estimator(options.pop('method'), **options)
+
+
+def cascades(strategies: Iterable[str]) -> list[str]:
+    """cascades.
+
+    Candidate cascades: the strategies, and the strategies without each
+    one of them (never empty).
+    """
+    strategies = list(strategies)
+    candidates = [','.join(strategies)]
+    if len(strategies) > 1:
+        for strategy in strategies:
+            candidates.append(
+                ','.join(s for s in strategies if s != strategy)
+            )
+    return candidates
+
+
+@lru_cache(maxsize=16)
+def _cascade(spec: str) -> DecodeCascade:
+    # one cascade (and QR detector) per worker and configuration
+    return DecodeCascade(spec)
+
+
+def _trial_acta(
+    source: str,
+    payload: Optional[str],
+    tmp: str,
+    config: dict
+) -> tuple[bool, float]:
+    """_trial_acta.
+
+    Run the pipeline over an acta with config: (success, seconds).
+    """
+    started = time.perf_counter()
+    try:
+        processor = ImageProcessor(
+            source,
+            Path(tmp).joinpath(PurePath(source).name),
+            logdir=Path(tmp).joinpath('Log'),
+            in_memory=True,
+            enhance=config['enhance'],
+            artifacts=ArtifactPolicy(NO_ARTIFACTS)
+        )
+        processor.process_image(
+            tolerance=config['tolerance'],
+            deskew=build_estimator(config['deskew'])
+        )
+        data, _ = processor.decode_qr(
+            area=config['area'],
+            cascade=_cascade(config['cascade']),
+            save_data=False
+        )
+    except Exception:  # pylint: disable=W0703
+        data = None
+    elapsed = time.perf_counter() - started
+    if payload is not None:
+        return data == payload, elapsed
+    return bool(data), elapsed
+
+
+@dataclass
+class Trial:
+    """Trial.
+
+    A configuration and its outcome over the sample.
+    """
+    config: dict
+    decoded: int = 0
+    count: int = 0
+    seconds: float = 0.0
+
+    @property
+    def decode_rate(self) -> float:
+        return self.decoded / self.count if self.count else 0.0
+
+    @property
+    def mean_ms(self) -> float:
+        return self.seconds * 1000 / self.count if self.count else 0.0
+
+    @property
+    def score(self) -> float:
+        # decoded actas per millisecond of processing
+        return self.decoded / (self.seconds * 1000) if self.seconds else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            'config': self.config,
+            'decode_rate': self.decode_rate,
+            'mean_ms': self.mean_ms,
+            'score': self.score
+        }
+
+
+def sample_actas(
+    directory: Union[str, PurePath],
+    sample: int = 40,
+    extensions: Iterable[str] = ('.jpg', '.jpeg'),
+    seed: int = 0
+) -> list[tuple[str, Optional[str]]]:
+    """sample_actas.
+
+    (acta, payload) pairs: the ground truth of synthetic actas, otherwise
+    a random sample (payload None) of the actas under directory.
+    """
+    directory = Path(directory)
+    specs = load_specs(directory)
+    if specs:
+        actas = [
+            (str(directory.joinpath(spec.filename)), spec.payload)
+            for spec in specs
+        ]
+    else:
+        extensions = tuple(e.lower() for e in extensions)
+        actas = [
+            (str(path), None) for path in sorted(directory.rglob('*'))
+            if path.suffix.lower() in extensions and path.is_file()
+        ]
+    if sample and len(actas) > sample:
+        actas = random.Random(seed).sample(actas, sample)
+    return actas
+
+
+@dataclass
+class Autotuner:
+    """Autotuner.
+
+    Coordinate descent over the search space (see module docstring).
+    """
+    actas: list
+    workers: int = None
+    max_drop: float = 0.0
+    rounds: int = 3
+    max_trials: int = 100
+    space: dict = field(default_factory=lambda: dict(SEARCH_SPACE))
+    trials: list = field(default_factory=list)
+
+    def __post_init__(self):
+        self.logger = getLogger("CNE.Autotuner")
+        self._cache: dict[str, Trial] = {}
+
+    def evaluate(self, config: dict, executor, tmp: str) -> Trial:
+        key = json.dumps(config, sort_keys=True)
+        if key in self._cache:
+            return self._cache[key]
+        trial = Trial(config, count=len(self.actas))
+        outcomes = executor.map(
+            _trial_acta,
+            [source for source, _ in self.actas],
+            [payload for _, payload in self.actas],
+            [tmp] * len(self.actas),
+            [config] * len(self.actas)
+        )
+        for ok, seconds in outcomes:
+            trial.decoded += int(ok)
+            trial.seconds += seconds
+        self._cache[key] = trial
+        self.trials.append(trial)
+        self.logger.info(
+            f"Trial {len(self.trials)}: {trial.decode_rate:.1%} decoded, "
+            f"{trial.mean_ms:.1f}ms/acta ({json.dumps(config)})"
+        )
+        return trial
+
+    def better(self, trial: Trial, best: Trial, floor: float) -> bool:
+        return trial.decode_rate >= floor and trial.score > best.score
+
+    def tune(self, start: dict) -> tuple[Trial, Trial]:
+        """tune.
+
+        Returns the trials of the starting and of the tuned configuration.
+        """
+        space = dict(self.space)
+        space.setdefault('cascade', cascades(start['cascade'].split(',')))
+        with tempfile.TemporaryDirectory(prefix='cne_tune_') as tmp, \
+                ProcessPoolExecutor(max_workers=self.workers) as executor:
+            baseline = best = self.evaluate(start, executor, tmp)
+            floor = baseline.decode_rate - self.max_drop
+            for _ in range(self.rounds):
+                improved = False
+                for name, values in space.items():
+                    for value in values:
+                        if len(self.trials) >= self.max_trials:
+                            return baseline, best
+                        if value == best.config[name]:
+                            continue
+                        trial = self.evaluate(
+                            {**best.config, name: value}, executor, tmp
+                        )
+                        if self.better(trial, best, floor):
+                            best, improved = trial, True
+                            # decodes gained are not given back later
+                            floor = max(floor, best.decode_rate - self.max_drop)
+                if not improved:
+                    break
+        return baseline, best
+
+
+def tuned_profile(
+    baseline: Trial,
+    best: Trial,
+    tuner: Autotuner,
+    source: Union[str, PurePath]
+) -> dict:
+    return {
+        'version': __version__,
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'source': str(source),
+        'sample': len(tuner.actas),
+        'labeled': any(payload is not None for _, payload in tuner.actas),
+        'params': best.config,
+        'baseline': baseline.to_dict(),
+        'tuned': best.to_dict(),
+        'trials': [trial.to_dict() for trial in tuner.trials]
+    }
+
+
+def load_tuned(filename: Union[str, PurePath]) -> dict:
+    """load_tuned.
+
+    BatchProcessor options (tolerance, area, deskew, enhance, cascade)
+    of a tuned profile.
+    """
+    with open(filename, 'r', encoding='utf-8') as fp:
+        params = json.load(fp)['params']
+    options = {name: params[name] for name in TUNED if name in params}
+    if 'deskew' in options:
+        options['deskew'] = build_estimator(deskew_spec(options['deskew']))
+    return options
+
+
+def main(args: list = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='cne_evaluation.autotune',
+        description='Tune the pipeline parameters over a sample of actas.'
+    )
+    parser.add_argument('directory', help='actas (or synthetic actas)')
+    parser.add_argument('--output', default='tuned.json')
+    parser.add_argument('--sample', type=int, default=40)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--extensions', default='.jpg,.jpeg')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--max-trials', type=int, default=100)
+    parser.add_argument(
+        '--max-drop', type=float, default=0.0,
+        help='decode rate that can be lost for speed (ex: 0.01)'
+    )
+    parser.add_argument('--tolerance', type=float, default=0.4)
+    parser.add_argument('--area', type=float, default=0.15)
+    parser.add_argument('--deskew', default='balanced')
+    parser.add_argument('--enhance', default='default')
+    parser.add_argument('--cascade', default=','.join(DEFAULT_CASCADE))
+    options = parser.parse_args(args)
+    actas = sample_actas(
+        options.directory,
+        options.sample,
+        options.extensions.split(','),
+        options.seed
+    )
+    if not actas:
+        print(f"No actas found on {options.directory}")
+        return 1
+    tuner = Autotuner(
+        actas,
+        workers=options.workers,
+        max_drop=options.max_drop,
+        rounds=options.rounds,
+        max_trials=options.max_trials
+    )
+    baseline, best = tuner.tune({
+        'tolerance': options.tolerance,
+        'area': options.area,
+        'deskew': deskew_spec(options.deskew),
+        'enhance': resolve_profile(options.enhance),
+        'cascade': options.cascade
+    })
+    profile = tuned_profile(baseline, best, tuner, options.directory)
+    with open(options.output, 'w', encoding='utf-8') as fp:
+        json.dump(profile, fp, indent=2)
+    print(
+        f"{len(tuner.trials)} trials over {len(actas)} actas\n"
+        f"  baseline: {baseline.decode_rate:.1%} decoded, "
+        f"{baseline.mean_ms:.1f}ms/acta\n"
+        f"  tuned:    {best.decode_rate:.1%} decoded, "
+        f"{best.mean_ms:.1f}ms/acta\n"
+        f"  params:   {json.dumps(best.config)}\n"
+        f"Tuned profile written to {options.output}"
+    )
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,742 @@
+"""
+Batch Engine.
+
+Ejecuta el pipeline de actas (process_image + extract_qr) sobre un pool
+de procesos o de hilos.
+"""
+from typing import Union, Any, Optional
+from collections import deque, Counter
+from collections.abc import AsyncIterator, Iterable
+import os
+import time
+import asyncio
+from functools import partial
+from dataclasses import dataclass
+from concurrent.futures import (
+    BrokenExecutor,
+    Executor,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor
+)
+from pathlib import PurePath, Path
+from .logs import getLogger
+from .images import ImageProcessor
+from .archives import ArchiveMember, MemoryFile
+from .manifest import Manifest
+from .qr_region import QRRegionPrior
+from .qr_cascade import DecodeCascade
+from .results import ResultSink, make_record
+from .metrics import Metrics
+from .pipeline import EnhancementPipeline, get_pipeline
+from .artifacts import ArtifactPolicy, get_writer
+from .dedup import DedupIndex, Fingerprint, fingerprint
+from .triage import TriagePolicy
+from .memory import MemoryBudget, footprint
+from .failures import (
+    FailureQueue, MESSAGES, QR_NOT_FOUND, TIMEOUT, ERROR, classify
+)
+
+
+def source_name(source) -> str:
+    # file name of a path or of an archive member
+    if isinstance(source, str):
+        return PurePath(source).name
+    return source.name
+
+
+@dataclass
+class BatchResult:
+    """BatchResult.
+
+    Result of processing a single acta.
+    """
+    relative_path: PurePath
+    destination: PurePath
+    source: PurePath
+    data: str = None
+    qr_path: PurePath = None
+    angle: float = None
+    qr_box: tuple = None
+    strategy: str = None
+    timings: dict = None
+    error: str = None
+    timed_out: bool = False
+    elapsed: float = 0.0
+    # exact copy of another acta, see DedupIndex
+    duplicate_of: str = None
+    # content and perceptual hash (before the pipeline), see DedupIndex
+    fingerprint: Fingerprint = None
+    # processing tier (fast, standard, heavy), see TriagePolicy
+    tier: str = None
+    # failure reason (read_error, qr_not_found, ...), see failures.REASONS
+    reason: str = None
+
+    @property
+    def ok(self) -> bool:
+        return bool(self.data) and self.error is None
+
+    def to_record(self) -> dict:
+        return make_record(
+            self.relative_path,
+            source_name(self.source),
+            data=self.data,
+            qr_box=self.qr_box,
+            angle=self.angle,
+            strategy=self.strategy,
+            elapsed=self.elapsed,
+            error=self.error,
+            timings=self.timings
+        )
+
+
+def process_acta(
+    image_path: Union[str, PurePath, ArchiveMember],
+    destination_path: Union[str, PurePath],
+    logdir: Union[None, PurePath] = None,
+    tolerance: float = 0.4,
+    area: float = 0.15,
+    in_memory: bool = False,
+    deskew: str = 'balanced',
+    prior: QRRegionPrior = None,
+    cascade: DecodeCascade = None,
+    save_data: bool = True,
+    enhance: EnhancementPipeline = None,
+    buffers: bool = False,
+    artifacts: ArtifactPolicy = None,
+    triage: TriagePolicy = None,
+    reduced_analysis: bool = False
+) -> dict:
+    """process_acta.
+
+    Worker entry point: runs process_image + decode_qr for a single acta.
+    Must be a module-level function so it can be pickled by a process pool.
+    """
+    started = time.monotonic()
+    # per-acta metrics, merged by the parent (works for both pool types)
+    metrics = Metrics()
+    processor = ImageProcessor(
+        image_path,
+        destination_path,
+        logdir=logdir,
+        in_memory=in_memory,
+        metrics=metrics,
+        enhance=enhance,
+        buffers=buffers,
+        artifacts=artifacts,
+        triage=triage,
+        reduced_analysis=reduced_analysis
+    )
+    processor.process_image(tolerance=tolerance, deskew=deskew)
+    data, qr_path = processor.decode_qr(
+        area=area, prior=prior, cascade=cascade, save_data=save_data
+    )
+    if artifacts is not None and artifacts.background:
+        # encode time of the artifacts written (so far) by this worker
+        metrics.merge(get_writer().collect())
+    return {
+        "data": data,
+        "qr_path": qr_path,
+        "qr_box": processor.qr_box,
+        "strategy": processor.qr_strategy,
+        "page_size": processor.page_size,
+        "angle": processor.skew.angle,
+        "tier": processor.tier.name if processor.tier else None,
+        "reason": processor.reason,
+        "timings": processor.timings,
+        "metrics": metrics.snapshot(),
+        "elapsed": time.monotonic() - started
+    }
+
+
+def read_fingerprint(source) -> tuple:
+    """read_fingerprint.
+
+    Read an acta once: the acta in memory (decoded by the worker without
+    reading the file again) and its fingerprint (None if undecodable).
+    """
+    if not isinstance(source, ArchiveMember):
+        source = MemoryFile.read(source)
+    try:
+        return source, fingerprint(source)
+    except ValueError:
+        # undecodable: the pipeline reports the error
+        return source, None
+
+
+class BatchProcessor:
+    """BatchProcessor.
+
+    Runs the acta pipeline over a process pool or a thread pool
+    (OpenCV releases the GIL, so threads also scale with cores).
+
+    Work is admitted with backpressure: at most ``max_pending`` actas are
+    in-flight at any moment, the source iterator is only consumed when a
+    slot is free. With a memory budget an acta is also admitted only
+    when its estimated footprint fits (see memory.MemoryBudget).
+    """
+    def __init__(
+        self,
+        executor: str = 'process',
+        max_workers: int = None,
+        max_pending: int = None,
+        timeout: float = None,
+        ordered: bool = False,
+        logdir: Union[None, PurePath] = None,
+        tolerance: float = 0.4,
+        area: float = 0.15,
+        in_memory: bool = False,
+        deskew: str = 'balanced',
+        manifest: Manifest = None,
+        prior: QRRegionPrior = None,
+        cascade: Union[str, DecodeCascade] = None,
+        sink: ResultSink = None,
+        metrics: Metrics = None,
+        enhance: Union[str, EnhancementPipeline] = 'default',
+        profiles: dict = None,
+        buffers: bool = False,
+        artifacts: ArtifactPolicy = None,
+        dedup: DedupIndex = None,
+        triage: Union[str, TriagePolicy] = None,
+        memory_budget: Union[str, int, MemoryBudget] = None,
+        reduced_analysis: bool = False,
+        failures: FailureQueue = None
+    ) -> None:
+        if executor not in ('process', 'thread'):
+            raise ValueError(
+                f"executor must be 'process' or 'thread', not {executor!r}"
+            )
+        self._executor_type = executor
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.max_workers * 2
+        self.timeout = timeout
+        self.ordered = ordered
+        self.tolerance = tolerance
+        self.area = area
+        self.in_memory = in_memory
+        self.deskew = deskew
+        self.manifest = manifest
+        # learned QR location, shared by threads; with a process pool each
+        # task gets a snapshot and the parent learns from the results.
+        self.prior = prior
+        if isinstance(cascade, str):
+            cascade = DecodeCascade(cascade)
+        self.cascade = cascade or DecodeCascade()
+        # enhancement profile, compiled here and once per worker process
+        self.enhance = get_pipeline(enhance, profiles)
+        # quality triage: profile and deskew preset of every acta
+        if isinstance(triage, str):
+            triage = TriagePolicy.from_spec(triage)
+        self.triage = triage.compile(profiles) if triage else None
+        # peak memory of the actas in-flight (ex: "8G", "70%")
+        if memory_budget and not isinstance(memory_budget, MemoryBudget):
+            memory_budget = MemoryBudget(memory_budget)
+        self.memory = memory_budget or None
+        self.reduced_analysis = reduced_analysis
+        # every worker reuses its scratch buffers across actas
+        self.buffers = buffers
+        # outputs of every acta and their encoding
+        self.artifacts = artifacts
+        # bulk result storage (replaces the per-acta .txt files)
+        self.sink = sink
+        # duplicate actas and payload conflicts
+        self.dedup = dedup
+        # content hash -> (acta, result) of the originals in-flight, their
+        # exact copies wait for them instead of being processed
+        self._inflight: dict[str, tuple[str, asyncio.Future]] = {}
+        # failed actas and their reason (retried later)
+        self.failures = failures
+        # decode strategy hits (and misses) over the whole batch
+        self.stats: Counter = Counter()
+        # stage timings and failures of every acta
+        self.metrics = metrics or Metrics()
+        self._logdir = logdir
+        self._executor: Optional[Executor] = None
+        # manifest and failure queue writes (and content hashes), off the
+        # event loop and in order
+        self._bookkeeper: Optional[ThreadPoolExecutor] = None
+        self._recording: asyncio.Lock = None
+        self._log_handler = None
+        self.logger = getLogger(
+            "CNE.BatchProcessor"
+        )
+
+    async def __aenter__(self):
+        self.start()
+        logdir = self._logdir
+        if logdir is None:
+            from navconfig import BASE_DIR  # pylint: disable=C0415
+            logdir = BASE_DIR.joinpath('Log')
+        logdir = Path(logdir)
+        if logdir.exists() is False:
+            logdir.mkdir(parents=True, exist_ok=True)
+        import aiofiles  # pylint: disable=C0415
+        self._log_handler = await aiofiles.open(
+            logdir.joinpath('non_processed.log'), mode='a'
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self._log_handler is not None:
+            await self._log_handler.close()
+        if self.sink is not None and self.manifest is not None:
+            # written before the manifest commits (see _record)
+            await self.sink.sync()
+        if self.manifest is not None:
+            self.manifest.commit()
+        if self.prior is not None:
+            self.prior.save()
+        if self.dedup is not None:
+            self.dedup.commit()
+        if self.failures is not None:
+            self.failures.commit()
+        self.shutdown()
+
+    def start(self) -> Executor:
+        """start.
+
+        Create the worker pool (if not already created).
+        """
+        if self._executor is None:
+            if self._executor_type == 'process':
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix='cne_batch'
+                )
+            self.logger.debug(
+                f"Started {self._executor_type} pool "
+                f"with {self.max_workers} workers"
+            )
+        return self._executor
+
+    def warm(self) -> None:
+        """warm.
+
+        Start every worker of the pool now, not on the first actas (ex:
+        a daemon waiting for actas to arrive).
+        """
+        executor = self.start()
+        futures = [
+            executor.submit(_warm_worker) for _ in range(self.max_workers)
+        ]
+        for future in futures:
+            future.result()
+
+    def shutdown(self, wait: bool = True):
+        if self._executor is not None:
+            # worker processes finish their background writes on exit
+            self._executor.shutdown(wait=wait, cancel_futures=not wait)
+            self._executor = None
+        if self._bookkeeper is not None:
+            self._bookkeeper.shutdown(wait=wait)
+            self._bookkeeper = None
+        if wait and self.artifacts is not None and self.artifacts.background:
+            writer = get_writer()
+            writer.flush()
+            self.metrics.merge(writer.collect())
+
+    def submit(self, image_path, destination_path):
+        """submit.
+
+        Submit a single acta to the pool, returns a concurrent Future.
+        """
+        return self.start().submit(
+            process_acta,
+            image_path,
+            destination_path,
+            self._logdir,
+            self.tolerance,
+            self.area,
+            self.in_memory,
+            self.deskew,
+            self.prior,
+            self.cascade,
+            self.sink is None,
+            self.enhance,
+            self.buffers,
+            self.artifacts,
+            self.triage,
+            self.reduced_analysis
+        )
+
+    async def _bookkeep(self, fn, *args, **kwargs):
+        # SQLite writes (and a commit every commit_every) on a single
+        # thread, the event loop keeps admitting and collecting actas
+        if self._bookkeeper is None:
+            self._bookkeeper = ThreadPoolExecutor(
+                max_workers=1,
+                thread_name_prefix='cne_bookkeeper'
+            )
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._bookkeeper, partial(fn, *args, **kwargs)
+        )
+
+    async def _record(self, key: str, result: BatchResult) -> None:
+        """_record.
+
+        Record an acta on the manifest and the failure queue.
+        """
+        if self.manifest is not None:
+            fp = result.fingerprint
+            async with self._recording:
+                # one at a time: no other record commits the manifest
+                # between the check and this record
+                while (
+                    self.sink is not None and self.manifest.due()
+                    and not self.sink.synced
+                ):
+                    # results first: the manifest never skips an acta
+                    # whose result was not written (ex: after a crash);
+                    # other actas may add results meanwhile
+                    await self.sink.sync()
+                await self._bookkeep(
+                    self.manifest.record,
+                    key,
+                    result.source,
+                    data=result.data,
+                    error=result.error,
+                    digest=fp.sha if fp is not None else None
+                )
+        if self.failures is not None:
+            if result.ok:
+                await self._bookkeep(self.failures.resolve, key)
+            else:
+                await self._bookkeep(
+                    self.failures.add,
+                    key,
+                    result.source,
+                    result.relative_path,
+                    result.destination,
+                    result.reason or ERROR,
+                    result.error
+                )
+
+    def _restart(self) -> None:
+        # a worker died (ex: crashed on a corrupt acta), the pool is broken:
+        # the next actas go to a new one
+        self.logger.error("Worker pool broken, starting a new one")
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+        self.start()
+
+    def _failed(self, result: BatchResult, exc: Exception, started: float):
+        result.reason = classify(exc)
+        result.error = f"{type(exc).__name__}: {exc}"
+        result.elapsed = time.monotonic() - started
+        self.metrics.failure(
+            type(exc).__name__ if result.reason == ERROR else result.reason
+        )
+
+    async def _process(
+        self,
+        result: BatchResult,
+        slots: asyncio.Semaphore,
+        acta: ArchiveMember = None
+    ):
+        """_process.
+
+        Run the pipeline over an acta (or its bytes, if already read) on
+        the pool, any error is recorded on the result (an acta never
+        stops the batch).
+        """
+        source = result.source if acta is None else acta
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        taken = 0
+        try:
+            if self.memory is not None:
+                # header only, the acta is not decoded here
+                nbytes = await loop.run_in_executor(
+                    None, footprint, source, self.in_memory
+                )
+                waits = self.memory.waits
+                taken = await self.memory.acquire(nbytes)
+                if self.memory.waits > waits:
+                    self.metrics.incr('memory_waits')
+            try:
+                future = self.submit(source, result.destination)
+            except BrokenExecutor:
+                self._restart()
+                future = self.submit(source, result.destination)
+        except Exception as exc:  # pylint: disable=W0718
+            slots.release()
+            if taken:
+                self.memory.release(taken)
+            self._failed(result, exc, started)
+            return
+        # the slot (and the memory) is released when the worker is really
+        # free, not when the caller stops waiting (a timed-out task keeps
+        # running).
+        future.add_done_callback(
+            lambda _: loop.call_soon_threadsafe(slots.release)
+        )
+        if taken:
+            future.add_done_callback(
+                lambda _: loop.call_soon_threadsafe(self.memory.release, taken)
+            )
+        started = time.monotonic()
+        try:
+            response = await asyncio.wait_for(
+                asyncio.wrap_future(future),
+                timeout=self.timeout
+            )
+            result.data = response['data']
+            result.qr_path = response['qr_path']
+            result.angle = response['angle']
+            result.qr_box = response['qr_box']
+            result.strategy = response['strategy']
+            result.tier = response['tier']
+            result.timings = response['timings']
+            if not result.data:
+                result.reason = response['reason'] or QR_NOT_FOUND
+                result.error = MESSAGES[result.reason]
+            self.metrics.merge(response['metrics'])
+            self.stats[result.strategy or 'misses'] += 1
+            if (
+                self.prior is not None and self._executor_type == 'process'
+                and result.qr_box is not None
+            ):
+                self.prior.update(*response['page_size'], result.qr_box)
+            result.elapsed = response['elapsed']
+        except asyncio.TimeoutError:
+            future.cancel()
+            result.timed_out = True
+            result.reason = TIMEOUT
+            result.error = f"Timeout after {self.timeout} seconds"
+            result.elapsed = time.monotonic() - started
+            self.metrics.failure(TIMEOUT)
+        except Exception as exc:  # pylint: disable=W0718
+            self._failed(result, exc, started)
+
+    async def _fingerprint(self, result: BatchResult) -> ArchiveMember:
+        """_fingerprint.
+
+        Read and fingerprint an acta on a thread (before the pipeline),
+        returns the acta in memory (None if it can not be read).
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            acta, result.fingerprint = await loop.run_in_executor(
+                None, read_fingerprint, result.source
+            )
+        except OSError:
+            # unreadable: the pipeline reports the error
+            return None
+        return acta
+
+    async def _duplicate(
+        self,
+        key: str,
+        result: BatchResult,
+        slots: asyncio.Semaphore
+    ) -> bool:
+        """_duplicate.
+
+        An exact copy of an acta decoded before (or in-flight) takes the
+        payload (or the failure) of the original and is never processed,
+        False if the acta must go through the pipeline.
+        """
+        fp = result.fingerprint
+        inflight = self._inflight.get(fp.sha)
+        if inflight is not None and inflight[0] != key:
+            original, done = inflight
+            # the copy never takes a worker
+            slots.release()
+            processed = await asyncio.shield(done)
+            data = processed.data if processed.ok else None
+            result.reason, result.error = processed.reason, processed.error
+        else:
+            original = self.dedup.exact(key, fp)
+            data = self.dedup.payload(original) if original else None
+            if not data:
+                # the original was never decoded (ex: a retry run with
+                # other settings): the copy is processed
+                return False
+            slots.release()
+        result.duplicate_of = original
+        if data:
+            result.data = data
+            result.strategy = 'duplicate'
+            result.error = result.reason = None
+        self.dedup.add(key, fp, duplicate_of=original)
+        self.stats['duplicate'] += 1
+        self.metrics.incr('duplicates')
+        return True
+
+    def _deduplicate(self, key: str, result: BatchResult) -> None:
+        """_deduplicate.
+
+        Index the fingerprint of a processed acta: the payload of an
+        original is recorded (and confirms its near duplicates), a copy
+        of an acta not decoded before is reported.
+        """
+        fp = result.fingerprint
+        if fp is None:
+            # unreadable: the pipeline reported the error
+            return
+        original = self.dedup.exact(key, fp)
+        if original is not None:
+            self.dedup.add(key, fp, duplicate_of=original)
+            result.duplicate_of = original
+            self.stats['duplicate'] += 1
+            self.metrics.incr('duplicates')
+            return
+        near = self.dedup.add(key, fp)
+        if near:
+            self.logger.debug(f"{key}: near duplicate of {', '.join(near)}")
+        conflict = self.dedup.resolve(key, result.data if result.ok else None)
+        if key in self.dedup.confirmed:
+            self.metrics.incr('near_duplicates')
+        if conflict is not None:
+            self.metrics.incr('payload_conflicts')
+            self.logger.warning(
+                f"Payload conflict on mesa {conflict['mesa']}: "
+                f"{conflict['payloads']}"
+            )
+
+    async def _original(
+        self,
+        key: str,
+        result: BatchResult,
+        slots: asyncio.Semaphore,
+        acta: ArchiveMember = None
+    ) -> None:
+        # exact copies arriving meanwhile wait for this result
+        fp = result.fingerprint
+        done = None
+        if fp is not None and fp.sha not in self._inflight:
+            done = asyncio.get_running_loop().create_future()
+            self._inflight[fp.sha] = (key, done)
+        try:
+            await self._process(result, slots, acta)
+            self._deduplicate(key, result)
+        finally:
+            if done is not None:
+                del self._inflight[fp.sha]
+                done.set_result(result)
+
+    async def _execute(self, item: tuple, slots: asyncio.Semaphore):
+        relative_path, destination_path, image_path = item
+        key = Manifest.key(relative_path, source_name(image_path))
+        result = BatchResult(
+            relative_path=relative_path,
+            destination=destination_path,
+            source=image_path
+        )
+        if self.dedup is None:
+            await self._process(result, slots)
+        else:
+            started = time.monotonic()
+            acta = await self._fingerprint(result)
+            if result.fingerprint is not None and await self._duplicate(
+                key, result, slots
+            ):
+                result.elapsed = time.monotonic() - started
+            else:
+                await self._original(key, result, slots, acta)
+        self.metrics.incr('actas')
+        if result.ok:
+            self.metrics.incr('decoded')
+        if not result.ok and self._log_handler is not None:
+            await self._log_handler.write(f"{destination_path}\n")
+            await self._log_handler.flush()
+        if self.sink is not None:
+            await self.sink.add(result.to_record())
+        await self._record(key, result)
+        return result
+
+    async def run(
+        self,
+        source: Union[AsyncIterator, Iterable]
+    ) -> AsyncIterator[BatchResult]:
+        """run.
+
+        Process every ``(relative_path, destination_path, image_path)``
+        item of source (ex: a DirectoryIterator), yielding BatchResult
+        objects in submission order (ordered=True) or as soon as they
+        complete.
+        """
+        if hasattr(source, '__aiter__'):
+            iterator = source.__aiter__()
+        else:
+            iterator = _aiter(source)
+        slots = asyncio.Semaphore(self.max_pending)
+        self._recording = asyncio.Lock()
+        pending: set[asyncio.Task] = set()
+        queue: deque = deque()
+        # next item of the source, a slow source (ex: actas arriving on
+        # a watched directory) never holds back completed results
+        fetch: asyncio.Task = None
+        exhausted = False
+        try:
+            while True:
+                # fill the pipeline while there are free slots
+                # (and the re-order buffer is not full):
+                while not exhausted and (
+                    not pending or (
+                        not slots.locked() and len(queue) < self.max_pending * 2
+                    )
+                ):
+                    if fetch is None:
+                        await slots.acquire()
+                        fetch = asyncio.ensure_future(iterator.__anext__())
+                    if not fetch.done():
+                        if pending:
+                            break
+                        await asyncio.wait({fetch})
+                    item, fetch = fetch, None
+                    try:
+                        item = item.result()
+                    except StopAsyncIteration:
+                        slots.release()
+                        exhausted = True
+                        break
+                    task = asyncio.ensure_future(
+                        self._execute(item, slots)
+                    )
+                    pending.add(task)
+                    if self.ordered:
+                        queue.append(task)
+                if not pending:
+                    break
+                waiting = {queue[0]} if self.ordered else set(pending)
+                if fetch is not None:
+                    waiting.add(fetch)
+                done, _ = await asyncio.wait(
+                    waiting,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if self.ordered:
+                    while queue and queue[0].done():
+                        task = queue.popleft()
+                        pending.discard(task)
+                        yield task.result()
+                else:
+                    for task in done:
+                        if task is fetch:
+                            continue
+                        pending.discard(task)
+                        yield task.result()
+        finally:
+            if fetch is not None:
+                fetch.cancel()
+            for task in pending:
+                task.cancel()
+
+
+def _warm_worker() -> int:
+    # loads the pipeline (inherited by a forked worker, imported by a
+    # spawned one) and keeps the worker busy a moment, so every worker
+    # gets one
+    from . import images  # noqa: F401  pylint: disable=C0415,W0611
+    time.sleep(0.05)
+    return os.getpid()
+
+
+async def _aiter(iterable: Iterable) -> AsyncIterator[Any]:
+    for item in iterable:
+        yield item
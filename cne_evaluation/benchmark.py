@@ -0,0 +1,414 @@
+"""
+Benchmark.
+
+Mide latencia por etapa, throughput (actas/s), memoria pico y tasa de
+decodificación del QR sobre actas sintéticas (ver synthetic.py).
+
+Usage:
+    python -m cne_evaluation.benchmark generate /tmp/actas --count 50
+    python -m cne_evaluation.benchmark run /tmp/actas --output run.json
+    python -m cne_evaluation.benchmark run /tmp/actas --baseline run.json
+    python -m cne_evaluation.benchmark startup --output startup.json
+"""
+from typing import Union
+import sys
+import json
+import time
+import resource
+import argparse
+import tempfile
+import statistics
+import subprocess
+import tracemalloc
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import PurePath, Path
+import numpy as np
+from .version import __version__
+from .synthetic import generate_actas, load_specs
+from .images import ImageProcessor
+from .qr_cascade import DecodeCascade
+from .qr_region import QRRegionPrior
+from .metrics import Metrics
+from .pipeline import get_pipeline
+from .buffers import get_pool
+from .artifacts import ArtifactPolicy, get_writer
+from .triage import TriagePolicy, DEFAULT_TIERS
+from .results import STAGES
+
+
+def bench_acta(
+    source: PurePath,
+    destination: PurePath,
+    logdir: PurePath,
+    deskew: str = 'balanced',
+    tolerance: float = 0.4,
+    area: float = 0.15,
+    cascade: DecodeCascade = None,
+    prior: QRRegionPrior = None,
+    metrics: Metrics = None,
+    enhance: str = 'default',
+    buffers: bool = False,
+    artifacts: ArtifactPolicy = None,
+    triage: TriagePolicy = None
+) -> dict:
+    """bench_acta.
+
+    Run the in-memory pipeline over one acta, timings of every stage
+    come from the ImageProcessor stage hooks.
+    """
+    processor = ImageProcessor(
+        source, destination, logdir=logdir, in_memory=True, metrics=metrics,
+        enhance=enhance, buffers=buffers, artifacts=artifacts, triage=triage
+    )
+    processor.process_image(tolerance=tolerance, deskew=deskew)
+    data, _ = processor.decode_qr(
+        area=area, prior=prior, cascade=cascade, save_data=False
+    )
+    return {
+        'data': data,
+        'angle': processor.skew.angle,
+        'strategy': processor.qr_strategy,
+        'tier': processor.tier.name if processor.tier else None,
+        'timings': processor.timings
+    }
+
+
+def _summary(values: list) -> dict:
+    values = np.asarray(values, dtype=np.float64) * 1000
+    return {
+        'mean_ms': float(values.mean()),
+        'p50_ms': float(np.percentile(values, 50)),
+        'p95_ms': float(np.percentile(values, 95)),
+        'total_ms': float(values.sum()),
+    }
+
+
+def run_benchmark(
+    directory: Union[str, PurePath],
+    deskew: str = 'balanced',
+    cascade: str = None,
+    use_prior: bool = True,
+    output: Union[str, PurePath] = None,
+    enhance: str = 'default',
+    buffers: bool = False,
+    artifacts: ArtifactPolicy = None,
+    triage: str = None
+) -> dict:
+    """run_benchmark.
+
+    Benchmark the pipeline over the synthetic actas of directory.
+    """
+    directory = Path(directory)
+    specs = load_specs(directory)
+    if not specs:
+        raise FileNotFoundError(
+            f"No synthetic actas (manifest.json) on {directory}"
+        )
+    cascade = DecodeCascade(cascade) if cascade else DecodeCascade()
+    prior = QRRegionPrior() if use_prior else None
+    enhance = get_pipeline(enhance)
+    policy = TriagePolicy.from_spec(triage).compile() if triage else None
+    tiers = Counter()
+    metrics = Metrics()
+    timings = {stage: [] for stage in STAGES}
+    decoded = correct = 0
+    angle_errors = []
+    tracemalloc.start()
+    with tempfile.TemporaryDirectory(prefix='cne_bench_') as tmp:
+        tmp = Path(tmp)
+        started = time.perf_counter()
+        for spec in specs:
+            result = bench_acta(
+                directory.joinpath(spec.filename),
+                tmp.joinpath(spec.filename),
+                tmp.joinpath('Log'),
+                deskew=deskew,
+                cascade=cascade,
+                prior=prior,
+                metrics=metrics,
+                enhance=enhance,
+                buffers=buffers,
+                artifacts=artifacts,
+                triage=policy
+            )
+            tiers[result['tier']] += 1
+            for stage in STAGES:
+                timings[stage].append(result['timings'].get(stage, 0.0))
+            if result['data']:
+                decoded += 1
+                correct += int(result['data'] == spec.payload)
+            # the estimated correction must cancel the synthetic skew
+            angle_errors.append(abs(result['angle'] + spec.skew))
+        if artifacts is not None and artifacts.background:
+            # pending artifacts are part of the run
+            get_writer().flush()
+            metrics.merge(get_writer().collect())
+        wall = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    count = len(specs)
+    report = {
+        'version': __version__,
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'directory': str(directory),
+        'config': {
+            'deskew': deskew,
+            'cascade': list(cascade.strategies),
+            'enhance': enhance.spec,
+            'buffers': buffers,
+            'artifacts': artifacts.when if artifacts else None,
+            'prior': use_prior,
+            'triage': triage
+        },
+        'count': count,
+        'wall_s': wall,
+        'throughput': count / wall if wall else 0.0,
+        'decode_rate': decoded / count,
+        'correct_rate': correct / count,
+        'angle_error_mean': float(np.mean(angle_errors)),
+        'angle_error_max': float(np.max(angle_errors)),
+        'peak_traced_mb': peak / 2**20,
+        # ru_maxrss is KiB on Linux
+        'max_rss_mb': usage.ru_maxrss / 1024,
+        # page faults: allocator churn (see the buffer pool)
+        'minor_faults': usage.ru_minflt,
+        'buffer_pool': get_pool().stats() if buffers else None,
+        'strategies': dict(cascade.stats),
+        'tiers': dict(tiers) if policy else None,
+        'failures': dict(metrics.failures),
+        'encode': metrics.summary()['stages'].get('encode'),
+        'stages': {
+            stage: _summary(values) for stage, values in timings.items()
+        }
+    }
+    if output is not None:
+        with open(output, 'w', encoding='utf-8') as fp:
+            json.dump(report, fp, indent=2)
+    return report
+
+
+def compare(
+    baseline: dict,
+    current: dict,
+    threshold: float = 0.10
+) -> list[str]:
+    """compare.
+
+    Regressions of current against baseline: stages slower (or throughput
+    lower) by more than threshold, or a lower decode rate.
+    """
+    regressions = []
+    for stage, summary in current['stages'].items():
+        before = baseline.get('stages', {}).get(stage)
+        if not before or not before['mean_ms']:
+            continue
+        change = summary['mean_ms'] / before['mean_ms'] - 1
+        if change > threshold:
+            regressions.append(
+                f"{stage}: {before['mean_ms']:.1f}ms -> "
+                f"{summary['mean_ms']:.1f}ms (+{change:.0%})"
+            )
+    if current['throughput'] < baseline['throughput'] * (1 - threshold):
+        regressions.append(
+            f"throughput: {baseline['throughput']:.2f} -> "
+            f"{current['throughput']:.2f} actas/s"
+        )
+    for key in ('decode_rate', 'correct_rate'):
+        if current[key] < baseline[key]:
+            regressions.append(
+                f"{key}: {baseline[key]:.1%} -> {current[key]:.1%}"
+            )
+    return regressions
+
+
+# startup of the command line (wall time of a new interpreter)
+STARTUP_COMMANDS = {
+    'interpreter': ['-c', 'pass'],
+    'cli_help': ['-m', 'cne_evaluation', '--help'],
+    'stats': ['-m', 'cne_evaluation', 'stats', '--logdir', '{tmp}'],
+    'scan': [
+        '-m', 'cne_evaluation', 'scan', '{tmp}', '--extensions', '.jpg',
+        '--logdir', '{tmp}'
+    ],
+    'import_pipeline': ['-c', 'import cne_evaluation.batch'],
+    'import_settings': ['-c', 'import navconfig.conf'],
+}
+
+
+def bench_startup(repeat: int = 5, workers: int = 2) -> dict:
+    """bench_startup.
+
+    Median wall time (ms) of every STARTUP_COMMANDS entry (None if the
+    command fails, ex: settings without an environment) and the time to
+    start a process pool of workers.
+    """
+    from .batch import BatchProcessor  # pylint: disable=C0415
+    report = {'startup_ms': {}, 'repeat': repeat}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, arguments in STARTUP_COMMANDS.items():
+            command = [sys.executable] + [a.format(tmp=tmp) for a in arguments]
+            elapsed = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                process = subprocess.run(
+                    command, capture_output=True, check=False
+                )
+                elapsed.append((time.perf_counter() - started) * 1000)
+                if process.returncode != 0:
+                    elapsed = None
+                    break
+            report['startup_ms'][name] = (
+                round(statistics.median(elapsed), 1) if elapsed else None
+            )
+    batch = BatchProcessor(executor='process', max_workers=workers)
+    started = time.perf_counter()
+    batch.warm()
+    report['pool_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    report['workers'] = workers
+    batch.shutdown()
+    return report
+
+
+def compare_startup(
+    baseline: dict,
+    current: dict,
+    threshold: float = 0.10
+) -> list[str]:
+    """compare_startup.
+
+    Commands (and pool start) slower than baseline by more than
+    threshold.
+    """
+    regressions = []
+    before = dict(baseline['startup_ms'], pool=baseline['pool_ms'])
+    after = dict(current['startup_ms'], pool=current['pool_ms'])
+    for name, value in after.items():
+        if not value or not before.get(name):
+            continue
+        change = value / before[name] - 1
+        if change > threshold:
+            regressions.append(
+                f"{name}: {before[name]:.1f}ms -> {value:.1f}ms (+{change:.0%})"
+            )
+    return regressions
+
+
+def print_report(report: dict) -> None:
+    print(
+        f"{report['count']} actas, {report['throughput']:.2f} actas/s, "
+        f"decoded: {report['decode_rate']:.1%} "
+        f"(correct: {report['correct_rate']:.1%}), "
+        f"angle error: {report['angle_error_mean']:.2f}, "
+        f"peak traced: {report['peak_traced_mb']:.1f}MB, "
+        f"max RSS: {report['max_rss_mb']:.1f}MB"
+    )
+    for stage, summary in report['stages'].items():
+        print(
+            f"  {stage:<14} mean {summary['mean_ms']:8.1f}ms  "
+            f"p95 {summary['p95_ms']:8.1f}ms"
+        )
+    print(f"  strategies: {report['strategies']}")
+    if report.get('tiers'):
+        print(f"  tiers: {report['tiers']}")
+
+
+def main(args: list = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='cne_evaluation.benchmark',
+        description='Synthetic actas and pipeline benchmarks.'
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+    gen = commands.add_parser('generate', help='generate synthetic actas')
+    gen.add_argument('directory')
+    gen.add_argument('--count', type=int, default=20)
+    gen.add_argument('--seed', type=int, default=0)
+    gen.add_argument('--dpi', type=int, nargs='+', default=[150])
+    gen.add_argument('--max-skew', type=float, default=3.0)
+    gen.add_argument('--blue-ink', type=int, default=3)
+    gen.add_argument('--speckle', type=float, default=0.001)
+    gen.add_argument('--border', type=float, default=0.1)
+    run = commands.add_parser('run', help='benchmark the pipeline')
+    run.add_argument('directory')
+    run.add_argument('--deskew', default='balanced')
+    run.add_argument('--cascade', default=None)
+    run.add_argument('--no-prior', action='store_true')
+    run.add_argument('--enhance', default='default')
+    run.add_argument('--buffers', action='store_true')
+    run.add_argument('--artifacts', default=None, help='artifact policy')
+    run.add_argument('--encoders', default=None)
+    run.add_argument('--background', action='store_true')
+    run.add_argument(
+        '--triage', nargs='?', const=DEFAULT_TIERS,
+        default=None, help='quality triage tiers'
+    )
+    run.add_argument('--output', default=None)
+    run.add_argument('--baseline', default=None)
+    run.add_argument('--threshold', type=float, default=0.10)
+    startup = commands.add_parser(
+        'startup', help='command line and worker pool startup'
+    )
+    startup.add_argument('--repeat', type=int, default=5)
+    startup.add_argument('--workers', type=int, default=2)
+    startup.add_argument('--output', default=None)
+    startup.add_argument('--baseline', default=None)
+    startup.add_argument('--threshold', type=float, default=0.10)
+    options = parser.parse_args(args)
+    if options.command == 'startup':
+        report = bench_startup(options.repeat, options.workers)
+        for name, value in report['startup_ms'].items():
+            print(f"  {name:<16} {value if value is not None else '-':>8}ms")
+        print(f"  {'pool':<16} {report['pool_ms']:>8}ms ({report['workers']} workers)")
+        if options.output:
+            with open(options.output, 'w', encoding='utf-8') as fp:
+                json.dump(report, fp, indent=2)
+        if options.baseline:
+            with open(options.baseline, 'r', encoding='utf-8') as fp:
+                regressions = compare_startup(
+                    json.load(fp), report, options.threshold
+                )
+            for regression in regressions:
+                print(f"REGRESSION {regression}")
+            return 1 if regressions else 0
+        return 0
+    if options.command == 'generate':
+        specs = generate_actas(
+            options.directory,
+            count=options.count,
+            seed=options.seed,
+            dpi=tuple(options.dpi),
+            max_skew=options.max_skew,
+            blue_ink=options.blue_ink,
+            speckle=options.speckle,
+            border=options.border
+        )
+        print(f"{len(specs)} synthetic actas written to {options.directory}")
+        return 0
+    report = run_benchmark(
+        options.directory,
+        deskew=options.deskew,
+        cascade=options.cascade,
+        use_prior=not options.no_prior,
+        output=options.output,
+        enhance=options.enhance,
+        buffers=options.buffers,
+        artifacts=ArtifactPolicy(
+            options.artifacts or 'all',
+            options.encoders,
+            background=options.background
+        ),
+        triage=options.triage
+    )
+    print_report(report)
+    if options.baseline:
+        with open(options.baseline, 'r', encoding='utf-8') as fp:
+            regressions = compare(json.load(fp), report, options.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""
+Buffer Pool.
+
+Arreglos de trabajo reutilizables entre actas (del mismo tamaño), para
+evitar reservar memoria en cada etapa del pipeline.
+
+OpenCV writes into a preallocated ``dst`` when its shape and type match,
+so the hot path (grayscale, HSV, masks, thresholds, filters, morphology,
+rotation) can run without allocating once the first acta of a given size
+was processed.
+"""
+from typing import Optional
+import threading
+import numpy as np
+
+
+class BufferPool:
+    """BufferPool.
+
+    Reusable scratch arrays, one set per thread (a worker processes a
+    single acta at a time, so its buffers are reused by the next acta).
+    Every buffer name keeps a grow-only backing store: any shape that fits
+    is served as a contiguous view of it, so actas of slightly different
+    sizes (ex: the canvas of a rotated page) do not allocate again.
+
+    Arrays returned by the pool are only valid until the same buffer is
+    requested again: results that outlive the acta must be copied.
+    """
+    def __init__(self, headroom: float = 0.0625) -> None:
+        # extra capacity reserved when a buffer grows
+        self.headroom = headroom
+        self._local = threading.local()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    @property
+    def buffers(self) -> dict:
+        buffers = getattr(self._local, 'buffers', None)
+        if buffers is None:
+            buffers = {}
+            self._local.buffers = buffers
+            self._local.allocations = 0
+            self._local.reuses = 0
+        return buffers
+
+    def get(
+        self,
+        name: str,
+        shape: tuple,
+        dtype: np.dtype = np.uint8
+    ) -> np.ndarray:
+        """get.
+
+        Scratch array (uninitialized) for name with the given shape.
+        """
+        dtype = np.dtype(dtype)
+        size = int(np.prod(shape))
+        key = (name, dtype.str)
+        store = self.buffers.get(key)
+        if store is None or store.size < size:
+            store = np.empty(int(size * (1 + self.headroom)), dtype=dtype)
+            self.buffers[key] = store
+            self._local.allocations += 1
+        else:
+            self._local.reuses += 1
+        return store[:size].reshape(shape)
+
+    def like(self, name: str, image: np.ndarray, channels: int = None):
+        """like.
+
+        Scratch array with the size (and type) of image; channels=1
+        returns a single-channel buffer.
+        """
+        shape = image.shape
+        if channels == 1:
+            shape = image.shape[:2]
+        elif channels is not None:
+            shape = (*image.shape[:2], channels)
+        return self.get(name, shape, image.dtype)
+
+    @property
+    def nbytes(self) -> int:
+        """nbytes.
+
+        Memory held by the buffers of the current thread.
+        """
+        return sum(store.nbytes for store in self.buffers.values())
+
+    def stats(self) -> dict:
+        self.buffers  # pylint: disable=W0104
+        return {
+            'allocations': self._local.allocations,
+            'reuses': self._local.reuses,
+            'nbytes': self.nbytes
+        }
+
+    def clear(self) -> None:
+        self.buffers.clear()
+
+
+_POOL: Optional[BufferPool] = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_pool() -> BufferPool:
+    """get_pool.
+
+    BufferPool of the current process (created on first use), shared by
+    every ImageProcessor of a worker.
+    """
+    global _POOL  # pylint: disable=W0603
+    if _POOL is None:
+        with _POOL_LOCK:
+            if _POOL is None:
+                _POOL = BufferPool()
+    return _POOL
@@ -0,0 +1,534 @@
+"""
+CLI.
+
+Línea de comandos de la evaluación: contar actas pendientes, procesarlas,
+reintentar las fallidas y ver el estado de una corrida.
+
+    cne scan [directory]      actas to process (per estado)
+    cne process [directory] [destination]
+    cne retry [--reason qr_undecodable]
+    cne stats [--logdir Log]  manifest, failures and vote totals
+    cne queue {coordinator,worker,local,status} queue.db ...
+    cne failures failures.db {stats,list,retry}
+    cne totals results.db [--level estado]
+
+Heavy libraries (OpenCV, NumPy, Wand) and the settings (navconfig) are
+only imported by the commands that need them: scan and stats with
+explicit paths (or --logdir) never load them. process and retry read the
+settings (as examples/usage.py) and start the worker pool while the tree
+is being scanned.
+"""
+from typing import Optional
+from collections import Counter
+import sys
+import json
+import argparse
+from pathlib import Path, PurePath
+from .version import __version__
+
+
+# files of a run, inside DIRECTORIO_LOG (see settings)
+LOG_FILES = {
+    'manifest': 'manifest.db',
+    'failures': 'failures.db',
+    'totals': 'totals.json',
+}
+
+
+def _settings():
+    # navconfig reads the environment and settings/settings.py (slow)
+    from navconfig import conf  # pylint: disable=C0415
+    return conf
+
+
+def _paths(options, names: tuple = tuple(LOG_FILES)) -> dict:
+    """_paths.
+
+    Manifest, failures and totals files: from the options, --logdir or
+    the settings (only loaded if a path is missing).
+    """
+    paths = {}
+    for name in names:
+        filename = LOG_FILES[name]
+        value = getattr(options, name, None)
+        if value is None and options.logdir:
+            value = Path(options.logdir).joinpath(filename)
+        paths[name] = value
+    if None in paths.values():
+        settings = _settings()
+        defaults = {
+            'manifest': settings.MANIFEST_FILE,
+            'failures': settings.FAILURES_FILE,
+            'totals': settings.TOTALS_FILE,
+        }
+        for name, value in paths.items():
+            if value is None:
+                paths[name] = defaults[name]
+    return {name: Path(value) for name, value in paths.items()}
+
+
+def batch_options(settings, options) -> dict:
+    """batch_options.
+
+    BatchProcessor options from the settings (and the tuned profile),
+    the command line overrides executor and workers.
+    """
+    from .autotune import load_tuned  # pylint: disable=C0415
+    from .artifacts import ArtifactPolicy  # pylint: disable=C0415
+    from .qr_region import QRRegionPrior  # pylint: disable=C0415
+    from .triage import TriagePolicy  # pylint: disable=C0415
+    from .dedup import DedupIndex  # pylint: disable=C0415
+    tuned = load_tuned(settings.TUNED_PROFILE) if settings.TUNED_PROFILE else {}
+    return {
+        'executor': options.executor or settings.BATCH_EXECUTOR,
+        'max_workers': options.workers or settings.BATCH_WORKERS,
+        'max_pending': settings.BATCH_MAX_PENDING,
+        'timeout': settings.BATCH_TIMEOUT,
+        'in_memory': settings.PROCESS_IN_MEMORY,
+        'buffers': settings.PROCESS_BUFFER_POOL,
+        'memory_budget': settings.MEMORY_BUDGET,
+        'reduced_analysis': settings.PROCESS_REDUCED_ANALYSIS,
+        'deskew': tuned.get('deskew', settings.DESKEW_PRESET),
+        'enhance': tuned.get('enhance', settings.ENHANCE_PROFILE),
+        'tolerance': tuned.get('tolerance', 0.4),
+        'area': tuned.get('area', 0.15),
+        'cascade': tuned.get('cascade', settings.QR_CASCADE),
+        'profiles': settings.ENHANCE_PROFILES,
+        'triage': TriagePolicy.from_spec(
+            settings.TRIAGE_TIERS, settings.TRIAGE_THRESHOLDS
+        ) if settings.TRIAGE_ACTAS else None,
+        'prior': QRRegionPrior(settings.QR_REGION_FILE),
+        'artifacts': ArtifactPolicy(
+            settings.ARTIFACT_POLICY,
+            settings.ARTIFACT_ENCODERS,
+            background=settings.ARTIFACT_BACKGROUND
+        ),
+        'dedup': DedupIndex(
+            settings.DEDUP_FILE, settings.DEDUP_DISTANCE
+        ) if settings.DEDUP_ACTAS else None,
+        'logdir': Path(settings.DIRECTORIO_LOG),
+    }
+
+
+def _iterator(
+    directory, destination, extensions, manifest, strip_components: int = 0
+):
+    from .archives import ArchiveIterator, is_archive  # pylint: disable=C0415
+    from .directories import DirectoryIterator  # pylint: disable=C0415
+    if is_archive(directory):
+        # actas read directly from the .zip/.tar(.gz)
+        return ArchiveIterator(
+            directory, destination, extensions, manifest=manifest,
+            strip_components=strip_components
+        )
+    return DirectoryIterator(
+        directory, destination, extensions, manifest=manifest
+    )
+
+
+async def scan(options) -> int:
+    """scan.
+
+    Count the actas of a tree still to process (per estado), without
+    decoding them.
+    """
+    from .manifest import Manifest  # pylint: disable=C0415
+    from .archives import is_archive  # pylint: disable=C0415
+    directory = options.directory
+    extensions = options.extensions.split(',') if options.extensions else None
+    strip_components = options.strip_components
+    if directory is None or extensions is None or (
+        strip_components is None and is_archive(directory)
+    ):
+        settings = _settings()
+        directory = directory or settings.DIRECTORIO_ACTAS
+        extensions = extensions or settings.EXTENSION_ACTAS
+        if strip_components is None:
+            strip_components = settings.ARCHIVO_STRIP_COMPONENTS
+    manifest = None
+    if not options.all:
+        filename = _paths(options, ('manifest',))['manifest']
+        if filename.exists():
+            manifest = Manifest(filename)
+    try:
+        iterator = _iterator(
+            directory, directory, extensions, manifest, strip_components or 0
+        )
+        total = await iterator.count()
+        estados: Counter = Counter()
+        if not is_archive(directory):
+            # the items of the walk are kept by count()
+            async for relative_path, _, _ in iterator:
+                parts = PurePath(relative_path).parts
+                estados[parts[0] if parts else '.'] += 1
+        iterator.close()
+    finally:
+        _close(manifest)
+    for estado, count in sorted(estados.items()):
+        print(f"{estado}\t{count}")
+    print(f"pending\t{total}")
+    print(f"skipped\t{iterator.skipped}")
+    return 0
+
+
+async def process(options) -> int:
+    """process.
+
+    Process the pending actas of a tree (the settings give the pipeline
+    options), the worker pool is started while the walk begins. The tree
+    is not counted first: progress is reported every --progress actas.
+    """
+    import asyncio  # pylint: disable=C0415
+    from .batch import BatchProcessor  # pylint: disable=C0415
+    from .manifest import Manifest  # pylint: disable=C0415
+    from .failures import FailureQueue  # pylint: disable=C0415
+    from .results import get_sink  # pylint: disable=C0415
+    from .aggregate import VoteTable  # pylint: disable=C0415
+    settings = _settings()
+    directory = options.directory or settings.DIRECTORIO_ACTAS
+    destination = options.destination or settings.DIRECTORIO_ACTAS_PROCESADAS
+    manifest = Manifest(
+        settings.MANIFEST_FILE, use_hash=settings.MANIFEST_USE_HASH
+    )
+    failures = dedup = iterator = None
+    decoded = failed = 0
+    try:
+        failures = FailureQueue(settings.FAILURES_FILE)
+        params = batch_options(settings, options)
+        dedup = params['dedup']
+        iterator = _iterator(
+            directory, destination, settings.EXTENSION_ACTAS, manifest,
+            settings.ARCHIVO_STRIP_COMPONENTS
+        )
+        batch = BatchProcessor(manifest=manifest, failures=failures, **params)
+        loop = asyncio.get_running_loop()
+        # fork the workers while the walk finds the first actas
+        warm = loop.run_in_executor(None, batch.warm)
+        first = asyncio.ensure_future(_first(iterator))
+        await warm
+        async with get_sink(settings.RESULTS_FILE) as sink:
+            batch.sink = sink
+            async with batch:
+                async for result in batch.run(_chain(await first, iterator)):
+                    if result.ok:
+                        decoded += 1
+                    else:
+                        failed += 1
+                        print(
+                            f"{result.source}: {result.reason} ({result.error})"
+                        )
+                    done = decoded + failed
+                    if options.progress and not done % options.progress:
+                        print(
+                            f"Procesadas: {done} (omitidas: {iterator.skipped})"
+                        )
+        VoteTable.from_results(settings.RESULTS_FILE).save(settings.TOTALS_FILE)
+        batch.metrics.to_json(settings.METRICS_JSON)
+        batch.metrics.to_prometheus(settings.METRICS_PROMETHEUS)
+        print(
+            f"Decodificadas: {decoded}, fallidas: {failed}, "
+            f"omitidas: {iterator.skipped}"
+        )
+        print(f"Fallidas por causa: {failures.stats()}")
+        _dedup_report(dedup, settings.DEDUP_REPORT)
+    finally:
+        if iterator is not None:
+            iterator.close()
+        _close(dedup, failures, manifest)
+    return 0 if not failed else 1
+
+
+async def _first(iterator) -> list:
+    try:
+        return [await iterator.__anext__()]
+    except StopAsyncIteration:
+        return []
+
+
+async def _chain(items: list, iterator):
+    for item in items:
+        yield item
+    async for item in iterator:
+        yield item
+
+
+def _close(*stores) -> None:
+    # manifest, failures and dedup stores (commit the pending rows)
+    for store in stores:
+        if store is not None:
+            store.close()
+
+
+def _dedup_report(dedup, filename) -> None:
+    if dedup is None:
+        return
+    report = dedup.report(filename)
+    print(
+        f"Duplicadas: {len(report['exact_duplicates'])}, "
+        f"similares: {len(report['near_duplicates'])}, "
+        f"mesas en conflicto: {len(report['conflicts'])}"
+    )
+
+
+async def retry(options) -> int:
+    """retry.
+
+    Process again the failed actas (FAILURES_FILE) with the retry
+    settings (RETRY_PROFILE, or the heavy defaults).
+    """
+    from .batch import BatchProcessor  # pylint: disable=C0415
+    from .manifest import Manifest  # pylint: disable=C0415
+    from .failures import (  # pylint: disable=C0415
+        FailureQueue, retry_options
+    )
+    from .results import get_sink  # pylint: disable=C0415
+    from .aggregate import VoteTable  # pylint: disable=C0415
+    settings = _settings()
+    manifest = Manifest(
+        settings.MANIFEST_FILE, use_hash=settings.MANIFEST_USE_HASH
+    )
+    failures = dedup = None
+    decoded = failed = 0
+    try:
+        failures = FailureQueue(settings.FAILURES_FILE)
+        params = batch_options(settings, options)
+        dedup = params['dedup']
+        params.update(retry_options(options.profile or settings.RETRY_PROFILE))
+        if params['timeout']:
+            params['timeout'] *= 2
+        items = failures.items(
+            options.reason or settings.RETRY_REASONS,
+            options.max_attempts or settings.RETRY_MAX_ATTEMPTS
+        )
+        async with get_sink(settings.RESULTS_FILE) as sink, BatchProcessor(
+            manifest=manifest,
+            failures=failures,
+            sink=sink,
+            **params
+        ) as batch:
+            async for result in batch.run(items):
+                if result.ok:
+                    decoded += 1
+                else:
+                    failed += 1
+                    print(f"{result.source}: {result.reason} ({result.error})")
+        VoteTable.from_results(settings.RESULTS_FILE).save(settings.TOTALS_FILE)
+        print(f"Recuperadas: {decoded}, siguen fallando: {failed}")
+        print(f"Fallidas por causa: {failures.stats()}")
+        _dedup_report(dedup, settings.DEDUP_REPORT)
+    finally:
+        _close(dedup, failures, manifest)
+    return 0 if not failed else 1
+
+
+def stats(options) -> int:
+    """stats.
+
+    Status of the run: actas per manifest status, failed actas per
+    reason and the vote totals (files are only read).
+    """
+    paths = _paths(options)
+    report = {}
+    if paths['manifest'].exists():
+        from .manifest import Manifest  # pylint: disable=C0415
+        with Manifest(paths['manifest']) as manifest:
+            report['manifest'] = manifest.stats()
+    if paths['failures'].exists():
+        from .failures import FailureQueue  # pylint: disable=C0415
+        with FailureQueue(paths['failures']) as failures:
+            report['failures'] = failures.stats()
+    if paths['totals'].exists():
+        with open(paths['totals'], 'r', encoding='utf-8') as fp:
+            totals = json.load(fp)
+        report['totals'] = {
+            name: totals.get(name)
+            for name in ('mesas', 'national', 'conflicts', 'errors')
+        }
+    if options.json:
+        print(json.dumps(report))
+        return 0
+    for name, values in report.items():
+        print(f"{name}: {values}")
+    if not report:
+        print(f"No run found ({', '.join(str(p) for p in paths.values())})")
+    return 0
+
+
+def queue(options) -> int:
+    """queue.
+
+    Sharded processing of a tree on several workers or hosts (see
+    workqueue).
+    """
+    from .workqueue import run  # pylint: disable=C0415
+    return run(options)
+
+
+def failed_actas(options) -> int:
+    """failed_actas.
+
+    Failed actas of a failures file: stats, list or retry them with the
+    command line options (see failures).
+    """
+    from .failures import run  # pylint: disable=C0415
+    return run(options)
+
+
+def vote_totals(options) -> int:
+    """vote_totals.
+
+    Vote totals of a results file (see aggregate).
+    """
+    from .aggregate import run  # pylint: disable=C0415
+    return run(options)
+
+
+def _queue_parser(commands) -> None:
+    parser = commands.add_parser(
+        'queue', help='sharded processing (several workers or hosts)'
+    )
+    actions = parser.add_subparsers(dest='action', required=True)
+    coordinator = actions.add_parser('coordinator', help='enqueue and watch')
+    worker = actions.add_parser('worker', help='process shards')
+    local = actions.add_parser(
+        'local', help='coordinator and N worker processes on this host'
+    )
+    status = actions.add_parser('status', help='queue status')
+    for command in (coordinator, worker, local, status):
+        command.add_argument('queue')
+        command.add_argument('--lease', type=float, default=300.0)
+    for command in (coordinator, worker, local):
+        command.add_argument('directory')
+        command.add_argument(
+            '--extensions', default=None, help='default: .jpg,.jpeg,.png'
+        )
+    for command in (worker, local):
+        command.add_argument('destination')
+        command.add_argument('--executor', default='process')
+        command.add_argument('--max-workers', type=int, default=None)
+        command.add_argument('--in-memory', action='store_true')
+        command.add_argument('--enhance', default='default')
+        command.add_argument(
+            '--manifest', default=None, help='skip the actas decoded before'
+        )
+        command.add_argument('--use-hash', action='store_true')
+        command.add_argument(
+            '--failures', default=None, help='failed actas and their reason'
+        )
+        command.add_argument(
+            '--artifacts', default=None, help='artifact policy (ex: failures)'
+        )
+        command.add_argument('--encoders', default=None)
+        command.add_argument(
+            '--logdir', default=None, help='non processed actas log'
+        )
+    for command in (coordinator, local):
+        command.add_argument('--depth', type=int, default=2)
+        command.add_argument('--results', default=None)
+        command.add_argument('--interval', type=float, default=10.0)
+    local.add_argument('--nodes', type=int, default=2)
+
+
+def _failures_parser(commands) -> None:
+    from .failures import REASONS  # pylint: disable=C0415
+    parser = commands.add_parser(
+        'failures', help='failed actas of a failures file'
+    )
+    parser.add_argument('queue', help='failures file (.db)')
+    actions = parser.add_subparsers(dest='action', required=True)
+    actions.add_parser('stats', help='failed actas by reason')
+    listing = actions.add_parser('list', help='failed actas')
+    run = actions.add_parser('retry', help='process the failed actas again')
+    for command in (listing, run):
+        command.add_argument(
+            '--reason', action='append', choices=REASONS, default=None
+        )
+        command.add_argument('--max-attempts', type=int, default=None)
+    run.add_argument(
+        '--profile', default=None,
+        help='tuned profile (JSON) instead of the heavy defaults'
+    )
+    run.add_argument(
+        '--same', action='store_true',
+        help='retry with the default settings (ex: after an I/O error)'
+    )
+    run.add_argument('--executor', default='process')
+    run.add_argument('--max-workers', type=int, default=None)
+    run.add_argument('--timeout', type=float, default=None)
+    run.add_argument('--in-memory', action='store_true')
+    run.add_argument('--results', default=None, help='results file')
+    run.add_argument('--logdir', default=None)
+
+
+def _totals_parser(commands) -> None:
+    parser = commands.add_parser(
+        'totals', help='vote totals of a results file'
+    )
+    parser.add_argument('results', help='results file (.db, .jsonl, .parquet)')
+    # aggregate.LEVELS (without importing NumPy)
+    parser.add_argument(
+        '--level', choices=('estado', 'municipio', 'parroquia'), default=None
+    )
+    parser.add_argument('--output', default=None, help='JSON summary')
+
+
+def main(args: list = None) -> Optional[int]:
+    parser = argparse.ArgumentParser(
+        prog='cne',
+        description='Evaluación CNE: decode the QR of the actas.'
+    )
+    parser.add_argument(
+        '--version', action='version', version=f"%(prog)s {__version__}"
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+    scanner = commands.add_parser('scan', help='actas to process')
+    scanner.add_argument('directory', nargs='?', default=None)
+    scanner.add_argument('--extensions', default=None)
+    scanner.add_argument(
+        '--strip-components', type=int, default=None,
+        help='leading directories of the archive members to drop'
+    )
+    scanner.add_argument(
+        '--all', action='store_true', help='ignore the manifest'
+    )
+    processor = commands.add_parser('process', help='process the actas')
+    processor.add_argument('directory', nargs='?', default=None)
+    processor.add_argument('destination', nargs='?', default=None)
+    processor.add_argument(
+        '--progress', type=int, default=1000,
+        help='report every N actas (0: only the summary)'
+    )
+    retrier = commands.add_parser('retry', help='retry the failed actas')
+    retrier.add_argument('--reason', action='append', default=None)
+    retrier.add_argument('--max-attempts', type=int, default=None)
+    retrier.add_argument('--profile', default=None, help='tuned profile')
+    for command in (processor, retrier):
+        command.add_argument('--executor', choices=('process', 'thread'))
+        command.add_argument('--workers', type=int, default=None)
+    status = commands.add_parser('stats', help='status of the run')
+    status.add_argument('--json', action='store_true')
+    for command in (scanner, status):
+        command.add_argument('--logdir', default=None)
+        command.add_argument('--manifest', default=None)
+    status.add_argument('--failures', default=None)
+    status.add_argument('--totals', default=None)
+    _queue_parser(commands)
+    _failures_parser(commands)
+    _totals_parser(commands)
+    options = parser.parse_args(args)
+    # commands that start their own event loop (if any)
+    synchronous = {
+        'stats': stats,
+        'queue': queue,
+        'failures': failed_actas,
+        'totals': vote_totals,
+    }
+    if options.command in synchronous:
+        return synchronous[options.command](options)
+    import asyncio  # pylint: disable=C0415
+    command = {'scan': scan, 'process': process, 'retry': retry}
+    return asyncio.run(command[options.command](options))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
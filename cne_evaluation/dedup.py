@@ -0,0 +1,353 @@
+"""
+Dedup.
+
+Detección de actas duplicadas (la misma acta descargada varias veces con
+otro nombre o en otra carpeta) e inconsistencias entre escaneos de una
+misma mesa.
+
+Every acta gets a fingerprint before the expensive stages, computed by
+the BatchProcessor from the bytes the worker then decodes (an acta is
+read once): a content hash of the file and a perceptual hash (dHash) of
+a grayscale thumbnail (JPEG decoded at 1/8 of its size).
+- exact duplicates (same bytes) are never processed: they take the
+  payload of the original (decoded before, or in-flight) and are
+  reported as its copies.
+- near duplicates (perceptual hashes within ``distance`` bits, ex: the
+  same scan recompressed) are linked to their candidates and confirmed
+  once decoded (same QR payload). They are never skipped: actas of the
+  same form only differ on the QR and the handwritten numbers, which a
+  thumbnail can not tell apart.
+- decoded payloads are indexed by mesa (the code before the first "!"),
+  two scans of a mesa with different payloads are a conflict.
+"""
+from typing import Union, Optional
+from collections import defaultdict
+from dataclasses import dataclass
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from pathlib import PurePath, Path
+import cv2
+import numpy as np
+from .logs import getLogger
+
+
+HASH_SIZE = 8
+
+
+@dataclass
+class Fingerprint:
+    """Fingerprint.
+
+    sha: content hash of the file.
+    phash: 64-bit difference hash of the thumbnail.
+    """
+    sha: str
+    phash: int
+
+
+def dhash(gray: np.ndarray, size: int = HASH_SIZE) -> int:
+    """dhash.
+
+    Difference hash: sign of the horizontal gradient on a (size+1, size)
+    thumbnail, as a size*size bits integer.
+    """
+    thumb = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    bits = (thumb[:, 1:] > thumb[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def fingerprint(source) -> Fingerprint:
+    """fingerprint.
+
+    Fingerprint of an acta file (or archive member, or MemoryFile), the
+    file is read once and only decoded at 1/8 of its size.
+    """
+    data = getattr(source, 'data', None)
+    if data is None:
+        with open(source, 'rb') as fp:
+            data = fp.read()
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    gray = cv2.imdecode(buffer, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if gray is None:
+        raise ValueError(f"Unable to decode {source}")
+    return Fingerprint(
+        sha=hashlib.blake2b(data, digest_size=16).hexdigest(),
+        phash=dhash(gray)
+    )
+
+
+def mesa_code(data: str) -> Optional[str]:
+    """mesa_code.
+
+    Mesa of a QR payload (the code before the first "!").
+    """
+    if not data:
+        return None
+    return data.split('!', 1)[0]
+
+
+def _popcount(values: np.ndarray) -> np.ndarray:
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    bits = np.unpackbits(values.view(np.uint8)).reshape(len(values), -1)
+    return bits.sum(axis=1)
+
+
+class DedupIndex:
+    """DedupIndex.
+
+    Fingerprints and payloads of the actas, kept in memory (lookups) and
+    on a SQLite file (a later run also skips the copies of actas decoded
+    before). Used from the event loop of the BatchProcessor.
+    """
+    def __init__(
+        self,
+        filename: Union[str, PurePath] = None,
+        distance: int = 4,
+        commit_every: int = 100
+    ) -> None:
+        # max. Hamming distance (bits) of near duplicates
+        self.distance = distance
+        self._commit_every = commit_every
+        self._uncommitted = 0
+        self.filename = Path(filename) if filename else None
+        self._lock = threading.Lock()
+        self.logger = getLogger(
+            "CNE.DedupIndex"
+        )
+        # content hash -> first acta with it
+        self._originals: dict[str, str] = {}
+        # content hash of every acta
+        self._shas: dict[str, str] = {}
+        # perceptual hashes (grow-only array) and their actas
+        self._phashes = np.empty(1024, dtype=np.uint64)
+        self._paths: list[str] = []
+        self._positions: dict[str, int] = {}
+        # mesa -> payload -> actas
+        self._mesas: dict[str, dict[str, list]] = defaultdict(
+            lambda: defaultdict(list)
+        )
+        self._payloads: dict[str, str] = {}
+        self._near: dict[str, list] = {}
+        self.duplicates: dict[str, str] = {}
+        self.confirmed: dict[str, str] = {}
+        self._conn = None
+        if self.filename is not None:
+            self._open()
+
+    def _open(self) -> None:
+        if self.filename.parent.exists() is False:
+            self.filename.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.filename), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS fingerprints (
+                path TEXT PRIMARY KEY,
+                sha TEXT,
+                phash INTEGER,
+                duplicate_of TEXT,
+                data TEXT,
+                updated_at REAL
+            )"""
+        )
+        self._conn.commit()
+        rows = self._conn.execute(
+            "SELECT path, sha, phash, duplicate_of, data FROM fingerprints"
+        ).fetchall()
+        for path, sha, phash, duplicate_of, data in rows:
+            self._index(path, Fingerprint(sha, phash & (2**64 - 1)), duplicate_of)
+            if data:
+                self._payload(path, data)
+
+    def commit(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.commit()
+                self._uncommitted = 0
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.commit()
+                self._conn.close()
+                self._conn = None
+
+    def _index(
+        self,
+        path: str,
+        fp: Fingerprint,
+        duplicate_of: str = None
+    ) -> None:
+        previous = self._shas.get(path)
+        if previous != fp.sha and self._originals.get(previous) == path:
+            # the content of the acta changed since it was indexed
+            del self._originals[previous]
+        self._shas[path] = fp.sha
+        position = self._positions.get(path)
+        if duplicate_of is not None:
+            self.duplicates[path] = duplicate_of
+            if position is not None:
+                self._phashes[position] = fp.phash
+            return
+        self.duplicates.pop(path, None)
+        self._originals.setdefault(fp.sha, path)
+        if position is None:
+            # new acta (an acta processed again keeps its position)
+            position = len(self._paths)
+            if position == len(self._phashes):
+                self._phashes = np.concatenate(
+                    [self._phashes, np.empty_like(self._phashes)]
+                )
+            self._paths.append(path)
+            self._positions[path] = position
+        self._phashes[position] = fp.phash
+
+    def _payload(self, path: str, data: str) -> None:
+        previous = self._payloads.get(path)
+        if previous is not None and previous != data:
+            # decoded again with another payload
+            payloads = self._mesas[mesa_code(previous)]
+            payloads[previous].remove(path)
+            if not payloads[previous]:
+                del payloads[previous]
+        self._payloads[path] = data
+        paths = self._mesas[mesa_code(data)][data]
+        if path not in paths:
+            paths.append(path)
+
+    def exact(self, path: str, fp: Fingerprint) -> Optional[str]:
+        """exact.
+
+        Another acta with the same content (None if fp is new).
+        """
+        original = self._originals.get(fp.sha)
+        return None if original == path else original
+
+    def near(self, fp: Fingerprint) -> list[str]:
+        """near.
+
+        Actas whose perceptual hash is within distance bits of fp.
+        """
+        count = len(self._paths)
+        if not count:
+            return []
+        distances = _popcount(
+            np.bitwise_xor(self._phashes[:count], np.uint64(fp.phash))
+        )
+        return [
+            self._paths[i] for i in np.flatnonzero(distances <= self.distance)
+        ]
+
+    def add(
+        self,
+        path: str,
+        fp: Fingerprint,
+        duplicate_of: str = None
+    ) -> list[str]:
+        """add.
+
+        Index an acta (an original, or an exact duplicate of another),
+        returns the near duplicates of an original.
+        """
+        near = [] if duplicate_of else [
+            other for other in self.near(fp) if other != path
+        ]
+        self._index(path, fp, duplicate_of)
+        if near:
+            self._near[path] = near
+        self._save(path, fp=fp, duplicate_of=duplicate_of)
+        return near
+
+    def payload(self, path: str) -> Optional[str]:
+        """payload.
+
+        Decoded payload of an acta (of this run or a previous one).
+        """
+        return self._payloads.get(path)
+
+    def resolve(self, path: str, data: Optional[str]) -> Optional[dict]:
+        """resolve.
+
+        Record the decoded payload of an acta: near duplicates with the
+        same payload are confirmed, returns the conflict (other payloads
+        of the same mesa) if any.
+        """
+        self._save(path, data=data)
+        if not data:
+            return None
+        self._payload(path, data)
+        for candidate in self._near.get(path, ()):
+            if self.confirmed.get(candidate) == path:
+                # already linked the other way
+                continue
+            if self._payloads.get(candidate) == data:
+                self.confirmed[path] = candidate
+                break
+        payloads = self._mesas[mesa_code(data)]
+        if len(payloads) > 1:
+            return {'mesa': mesa_code(data), 'payloads': dict(payloads)}
+        return None
+
+    def conflicts(self) -> dict[str, dict]:
+        """conflicts.
+
+        Mesas decoded with different payloads (payload -> actas).
+        """
+        return {
+            mesa: {data: list(paths) for data, paths in payloads.items()}
+            for mesa, payloads in self._mesas.items()
+            if len(payloads) > 1
+        }
+
+    def report(self, filename: Union[str, PurePath] = None) -> dict:
+        """report.
+
+        Duplicates (exact, near confirmed) and payload conflicts, saved
+        as JSON if filename is given.
+        """
+        report = {
+            'exact_duplicates': dict(self.duplicates),
+            'near_duplicates': dict(self.confirmed),
+            'conflicts': self.conflicts()
+        }
+        if filename is not None:
+            with open(filename, 'w', encoding='utf-8') as fp:
+                json.dump(report, fp, indent=2, ensure_ascii=False)
+        return report
+
+    def _save(
+        self,
+        path: str,
+        fp: Fingerprint = None,
+        duplicate_of: str = None,
+        data: str = None
+    ) -> None:
+        if self._conn is None:
+            return
+        with self._lock:
+            if fp is not None:
+                # SQLite integers are signed 64-bit
+                phash = fp.phash - 2**64 if fp.phash >= 2**63 else fp.phash
+                self._conn.execute(
+                    "INSERT INTO fingerprints "
+                    "(path, sha, phash, duplicate_of, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?) ON CONFLICT(path) DO UPDATE SET "
+                    "sha = excluded.sha, phash = excluded.phash, "
+                    "duplicate_of = excluded.duplicate_of, "
+                    "updated_at = excluded.updated_at",
+                    (path, fp.sha, phash, duplicate_of, time.time())
+                )
+            else:
+                self._conn.execute(
+                    "UPDATE fingerprints SET data = ?, updated_at = ? "
+                    "WHERE path = ?",
+                    (data, time.time(), path)
+                )
+            self._uncommitted += 1
+            if self._uncommitted >= self._commit_every:
+                self._conn.commit()
+                self._uncommitted = 0
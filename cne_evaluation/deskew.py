@@ -0,0 +1,269 @@
+"""
+Deskew.
+
+Estimadores del ángulo de inclinación de las actas.
+
+All the estimators work over a downscaled (pyramid) level of the grayscale
+scan, so their cost does not grow with the scan DPI. The returned angle is
+the correction to apply (clockwise degrees, as used by ImageMagick and
+ImageProcessor.rotate_image).
+"""
+from typing import Union
+from dataclasses import dataclass
+import cv2
+import numpy as np
+
+
+@dataclass
+class SkewEstimate:
+    """SkewEstimate.
+
+    angle: correction angle (degrees, clockwise).
+    confidence: 0.0 (no evidence) to 1.0 (every measure agrees).
+    """
+    angle: float = 0.0
+    confidence: float = 0.0
+    method: str = None
+
+
+def pyramid_level(gray: np.ndarray, max_side: int) -> np.ndarray:
+    """pyramid_level.
+
+    Halve the image (cv2.pyrDown) until its largest side fits on max_side.
+    """
+    image = gray
+    while max(image.shape[:2]) > max_side:
+        image = cv2.pyrDown(image)
+    return image
+
+
+def weighted_median(values: np.ndarray, weights: np.ndarray) -> float:
+    order = np.argsort(values)
+    values, weights = values[order], weights[order]
+    cumulative = np.cumsum(weights)
+    return float(values[np.searchsorted(cumulative, cumulative[-1] / 2.0)])
+
+
+class DeskewEstimator:
+    """DeskewEstimator.
+
+    Base class for skew estimators.
+    """
+    name: str = None
+
+    def __init__(
+        self,
+        max_side: int = 1200,
+        max_angle: float = 10.0,
+        agreement: float = 0.5
+    ) -> None:
+        self.max_side = max_side
+        self.max_angle = max_angle
+        # tolerance (degrees) used to decide if a measure agrees with the result
+        self.agreement = agreement
+
+    def __call__(self, gray: np.ndarray) -> SkewEstimate:
+        return self.estimate(gray)
+
+    def estimate(self, gray: np.ndarray) -> SkewEstimate:
+        raise NotImplementedError()
+
+    def consensus(
+        self,
+        angles: np.ndarray,
+        weights: np.ndarray = None
+    ) -> SkewEstimate:
+        """consensus.
+
+        Robust consensus of skew measures: weighted median, the confidence
+        is the weight fraction that agrees with it.
+        """
+        if angles is None or len(angles) == 0:
+            return SkewEstimate(0.0, 0.0, self.name)
+        if weights is None:
+            weights = np.ones_like(angles)
+        skew = weighted_median(angles, weights)
+        agree = np.abs(angles - skew) <= self.agreement
+        confidence = float(weights[agree].sum() / weights.sum())
+        # skew is the tilt of the lines, correction is the opposite
+        return SkewEstimate(-skew, confidence, self.name)
+
+
+class HoughDeskew(DeskewEstimator):
+    """HoughDeskew.
+
+    Standard Hough transform over the edges of the downscaled image,
+    vote-weighted consensus over the strongest near-horizontal lines
+    (not only the first one).
+    """
+    name: str = 'hough'
+
+    def __init__(
+        self,
+        threshold: float = 0.4,
+        max_lines: int = 25,
+        canny_low: int = 50,
+        canny_high: int = 150,
+        **kwargs
+    ) -> None:
+        super().__init__(**kwargs)
+        # accumulator threshold, relative to the width of the level
+        self.threshold = threshold
+        self.max_lines = max_lines
+        # hysteresis thresholds of the edge detector
+        self.canny = (canny_low, canny_high)
+
+    def estimate(self, gray: np.ndarray) -> SkewEstimate:
+        small = pyramid_level(gray, self.max_side)
+        edges = cv2.Canny(small, *self.canny, apertureSize=3)
+        lines = cv2.HoughLinesWithAccumulator(
+            edges,
+            1,
+            np.pi / 1800,
+            max(int(small.shape[1] * self.threshold), 10),
+            min_theta=np.radians(90 - self.max_angle),
+            max_theta=np.radians(90 + self.max_angle)
+        )
+        if lines is None:
+            return SkewEstimate(0.0, 0.0, self.name)
+        # lines are sorted by votes: (rho, theta, votes)
+        lines = lines.reshape(len(lines), -1)[:self.max_lines]
+        angles = np.degrees(lines[:, 1]) - 90
+        return self.consensus(angles, lines[:, 2].astype(np.float64))
+
+
+class ProbabilisticHoughDeskew(DeskewEstimator):
+    """ProbabilisticHoughDeskew.
+
+    HoughLinesP over the downscaled image, measures weighted by the
+    length of the longest segments.
+    """
+    name: str = 'hough_p'
+
+    def __init__(
+        self,
+        min_length: float = 0.3,
+        max_lines: int = 50,
+        canny_low: int = 50,
+        canny_high: int = 150,
+        **kwargs
+    ) -> None:
+        super().__init__(**kwargs)
+        # minimum segment length, relative to the width of the level
+        self.min_length = min_length
+        self.max_lines = max_lines
+        self.canny = (canny_low, canny_high)
+
+    def estimate(self, gray: np.ndarray) -> SkewEstimate:
+        small = pyramid_level(gray, self.max_side)
+        edges = cv2.Canny(small, *self.canny, apertureSize=3)
+        min_length = max(int(small.shape[1] * self.min_length), 10)
+        segments = cv2.HoughLinesP(
+            edges,
+            1,
+            np.pi / 1800,
+            threshold=min_length // 2,
+            minLineLength=min_length,
+            maxLineGap=max(min_length // 20, 2)
+        )
+        if segments is None:
+            return SkewEstimate(0.0, 0.0, self.name)
+        x1, y1, x2, y2 = segments.reshape(-1, 4).T.astype(np.float64)
+        angles = np.degrees(np.arctan2(y2 - y1, x2 - x1))
+        lengths = np.hypot(x2 - x1, y2 - y1)
+        horizontal = np.abs(angles) <= self.max_angle
+        angles, lengths = angles[horizontal], lengths[horizontal]
+        longest = np.argsort(lengths)[::-1][:self.max_lines]
+        return self.consensus(angles[longest], lengths[longest])
+
+
+class ProjectionProfileDeskew(DeskewEstimator):
+    """ProjectionProfileDeskew.
+
+    Rotates the binarized level and keeps the angle that maximizes the
+    sharpness of the horizontal projection profile (coarse to fine search).
+    """
+    name: str = 'projection'
+
+    def __init__(
+        self,
+        coarse_step: float = 1.0,
+        fine_step: float = 0.1,
+        **kwargs
+    ) -> None:
+        super().__init__(**kwargs)
+        self.coarse_step = coarse_step
+        self.fine_step = fine_step
+
+    def _score(self, binary: np.ndarray, angle: float) -> float:
+        height, width = binary.shape[:2]
+        matrix = cv2.getRotationMatrix2D((width / 2, height / 2), -angle, 1.0)
+        rotated = cv2.warpAffine(
+            binary, matrix, (width, height), flags=cv2.INTER_NEAREST
+        )
+        profile = rotated.sum(axis=1, dtype=np.float64)
+        return float(np.sum(np.diff(profile) ** 2))
+
+    def estimate(self, gray: np.ndarray) -> SkewEstimate:
+        small = pyramid_level(gray, self.max_side)
+        _, binary = cv2.threshold(
+            small, 0, 1, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU
+        )
+        if not binary.any():
+            return SkewEstimate(0.0, 0.0, self.name)
+        coarse = np.arange(
+            -self.max_angle, self.max_angle + self.coarse_step, self.coarse_step
+        )
+        scores = np.array([self._score(binary, a) for a in coarse])
+        best = float(coarse[int(np.argmax(scores))])
+        fine = np.arange(
+            best - self.coarse_step,
+            best + self.coarse_step + self.fine_step,
+            self.fine_step
+        )
+        fine_scores = np.array([self._score(binary, a) for a in fine])
+        angle = float(fine[int(np.argmax(fine_scores))])
+        peak = float(fine_scores.max())
+        confidence = 0.0
+        if peak > 0:
+            confidence = float(
+                np.clip((peak - np.median(scores)) / peak, 0.0, 1.0)
+            )
+        # the search already returns the correction angle
+        return SkewEstimate(round(angle, 2), confidence, self.name)
+
+
+ESTIMATORS = {
+    'hough': HoughDeskew,
+    'hough_p': ProbabilisticHoughDeskew,
+    'projection': ProjectionProfileDeskew,
+}
+
+# speed/accuracy presets:
+PRESETS = {
+    'fast': ('hough', {'max_side': 600}),
+    'balanced': ('hough', {'max_side': 1000}),
+    'accurate': ('projection', {'max_side': 1600, 'fine_step': 0.05}),
+}
+
+
+def get_estimator(
+    method: Union[str, DeskewEstimator] = 'balanced',
+    **kwargs
+) -> DeskewEstimator:
+    """get_estimator.
+
+    Return a DeskewEstimator from a preset name (fast, balanced, accurate)
+    or an estimator name (hough, hough_p, projection).
+    """
+    if isinstance(method, DeskewEstimator):
+        return method
+    if method in PRESETS:
+        method, options = PRESETS[method]
+        kwargs = {**options, **kwargs}
+    try:
+        return ESTIMATORS[method](**kwargs)
+    except KeyError as exc:
+        raise ValueError(
+            f"Unknown deskew method or preset: {method}"
+        ) from exc
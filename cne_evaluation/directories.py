@@ -1,23 +1,35 @@
 """This module contains the DirectoryIterator class.
 """
 from typing import Union
+from collections import deque
+import os
 import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path, PurePath
-from navconfig.conf import EXTENSION_ACTAS as extensions
-from navconfig.logging import logging
+from .logs import getLogger
+from .manifest import Manifest
 
 
 class DirectoryIterator:
     """DirectoryIterator.
 
     This class is a simple iterator that iterates over the files
-    in a directory with subdirectories
+    in a directory with subdirectories.
+
+    Directories are listed with os.scandir (file types come from the
+    cached DirEntry, no extra stat per file), subdirectories are walked
+    in parallel and work items are prefetched in batches.
     """
     def __init__(
         self,
         directory: Union[str, PurePath],
         destination: Union[str, PurePath],
-        extensions: list = extensions
+        extensions: list = None,
+        manifest: Manifest = None,
+        walkers: int = 8,
+        batch_size: int = 256,
+        prefetch: int = 8
     ) -> None:
         if isinstance(directory, str):
             self.directory = Path(directory).resolve()
@@ -35,11 +47,26 @@ class DirectoryIterator:
             self._destination = Path(destination).resolve()
         else:
             self._destination = destination
-        # getting current files on directory
-        self.files = self.directory.rglob('*')
-        self.ext = extensions
+        if extensions is None:
+            # the settings are only loaded when no extensions are given
+            from navconfig.conf import EXTENSION_ACTAS  # pylint: disable=C0415
+            extensions = EXTENSION_ACTAS
+        self.ext = tuple(e.lower() for e in extensions)
         self._current = None
-        self.logger = logging.getLogger(
+        # skip actas already processed (see Manifest)
+        self.manifest = manifest
+        self.skipped: int = 0
+        self._lock = threading.Lock()
+        # parallel walk and batched prefetch:
+        self.walkers = walkers
+        self.batch_size = batch_size
+        self.prefetch = prefetch
+        self.total: int = None
+        self._batch: deque = deque()
+        self._queue: asyncio.Queue = None
+        self._walker: asyncio.Task = None
+        self._exhausted: bool = False
+        self.logger = getLogger(
             "CNE.DirectoryIterator"
         )
         self.logger.notice(
@@ -59,27 +86,116 @@ class DirectoryIterator:
         return self
 
     async def __anext__(self):
-        loop = asyncio.get_event_loop()
-        self._current = await loop.run_in_executor(
-            None,
-            self._next_file
-        )
-        if self._current is None:
-            raise StopAsyncIteration
+        while not self._batch:
+            if self._exhausted:
+                raise StopAsyncIteration
+            batch = await self._next_batch()
+            if batch is None:
+                self._exhausted = True
+            else:
+                self._batch.extend(batch)
+        self._current = self._batch.popleft()
         return self._current
 
-    def _next_file(self):
-        for image_path in self.files:
-            if image_path.is_file() and image_path.suffix.lower() in self.ext:
-                self.logger.notice(
-                    f"Extracting Image {image_path.name}"
+    async def count(self) -> int:
+        """count.
+
+        Walk the whole tree (in parallel) and return the number of actas
+        to process, the items are kept for the iteration.
+        """
+        if self.total is None:
+            while not self._exhausted:
+                batch = await self._next_batch()
+                if batch is None:
+                    self._exhausted = True
+                else:
+                    self._batch.extend(batch)
+            self.total = len(self._batch)
+        return self.total
+
+    def close(self):
+        """close.
+
+        Stop the directory walk (if the iteration is abandoned).
+        """
+        if self._walker is not None and not self._walker.done():
+            self._walker.cancel()
+        self._exhausted = True
+
+    async def _next_batch(self):
+        if self._walker is None:
+            self._queue = asyncio.Queue(maxsize=self.prefetch)
+            self._walker = asyncio.ensure_future(self._walk())
+        return await self._queue.get()
+
+    async def _walk(self):
+        loop = asyncio.get_running_loop()
+        pool = ThreadPoolExecutor(
+            max_workers=self.walkers,
+            thread_name_prefix='cne_walk'
+        )
+        pending = {
+            loop.run_in_executor(pool, self._scan_directory, str(self.directory))
+        }
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending,
+                    return_when=asyncio.FIRST_COMPLETED
                 )
-                relative_path = image_path.parent.relative_to(self.directory)
-                destination_path = Path(self._destination).joinpath(
-                    relative_path
-                ).joinpath(image_path.name)
-                return relative_path, destination_path, image_path
-        return None
+                for future in done:
+                    items, subdirs = future.result()
+                    for subdir in subdirs:
+                        pending.add(
+                            loop.run_in_executor(
+                                pool, self._scan_directory, subdir
+                            )
+                        )
+                    for idx in range(0, len(items), self.batch_size):
+                        await self._queue.put(items[idx:idx + self.batch_size])
+        except Exception as exc:  # pylint: disable=W0718
+            self.logger.error(
+                f"Directory walk over {self.directory} failed: {exc}"
+            )
+        finally:
+            for future in pending:
+                future.cancel()
+            pool.shutdown(wait=False)
+        # end of iteration (not reached when cancelled):
+        await self._queue.put(None)
+
+    def _scan_directory(self, path: str) -> tuple[list, list]:
+        files, subdirs = [], []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.name.lower().endswith(self.ext) and entry.is_file():
+                        files.append(entry)
+        except OSError as exc:
+            self.logger.warning(f"Unable to read directory {path}: {exc}")
+        files.sort(key=lambda e: e.name)
+        relative_path = Path(path).relative_to(self.directory)
+        destination = Path(self._destination).joinpath(relative_path)
+        items = []
+        for entry in files:
+            image_path = Path(entry.path)
+            if self.manifest is not None and self.manifest.is_processed(
+                Manifest.key(relative_path, entry.name),
+                image_path,
+                stat=entry.stat()
+            ):
+                with self._lock:
+                    self.skipped += 1
+                continue
+            self.logger.debug(
+                f"Extracting Image {entry.name}"
+            )
+            items.append(
+                (relative_path, destination.joinpath(entry.name), image_path)
+            )
+        return items, sorted(subdirs)
 
     def make_dir(self, filename):
         """Helper function to create the destination directory, if not exists.
@@ -0,0 +1,386 @@
+"""
+Failures.
+
+Cola persistente (SQLite) de las actas que fallaron, con la causa de cada
+falla, para reintentar sólo esas actas (opcionalmente con parámetros más
+costosos).
+
+Failure reasons:
+    read_error: the acta can not be read or decoded (missing, truncated).
+    no_lines: the QR was not found and the skew estimator found no lines
+    (the page may be rotated, retried with the accurate estimator).
+    qr_not_found: no QR was detected on the page.
+    qr_undecodable: a QR was detected but none of the strategies decoded
+    it (retried with the restoration profile and every strategy).
+    timeout: the acta took longer than the batch timeout.
+    error: any other exception (the message is kept).
+
+Usage:
+    cne failures failures.db stats
+    cne failures failures.db retry --reason qr_undecodable
+"""
+from typing import Union, Optional
+from collections.abc import Iterator
+import json
+import time
+import sqlite3
+import threading
+from pathlib import PurePath, Path
+from .logs import getLogger
+
+
+READ_ERROR = 'read_error'
+NO_LINES = 'no_lines'
+QR_NOT_FOUND = 'qr_not_found'
+QR_UNDECODABLE = 'qr_undecodable'
+TIMEOUT = 'timeout'
+ERROR = 'error'
+REASONS = (READ_ERROR, NO_LINES, QR_NOT_FOUND, QR_UNDECODABLE, TIMEOUT, ERROR)
+
+MESSAGES = {
+    READ_ERROR: 'Unable to read image (missing, truncated or corrupt)',
+    NO_LINES: 'QR code not found (no lines to estimate the skew)',
+    QR_NOT_FOUND: 'QR code not found',
+    QR_UNDECODABLE: 'QR code detected but not decoded',
+}
+
+# BatchProcessor options of a retry run: accurate skew, restoration
+# profile, a larger QR area and every decode strategy
+HEAVY = {
+    'tolerance': 0.2,
+    'area': 0.25,
+    'deskew': 'accurate',
+    'enhance': 'clean',
+    'cascade': 'gray,blue,binary,legacy,upscale,rotate,denoise',
+}
+
+
+class ActaError(ValueError):
+    """ActaError.
+
+    An acta that can not be processed, with its failure reason.
+    """
+    def __init__(self, message: str, reason: str = ERROR) -> None:
+        super().__init__(message)
+        self.reason = reason
+
+
+def classify(exc: BaseException) -> str:
+    """classify.
+
+    Failure reason of an exception raised by the pipeline.
+    """
+    import asyncio  # pylint: disable=C0415
+    if isinstance(exc, ActaError):
+        return exc.reason
+    if isinstance(exc, (asyncio.TimeoutError, TimeoutError)):
+        return TIMEOUT
+    if isinstance(exc, OSError):
+        return READ_ERROR
+    return ERROR
+
+
+def retry_options(profile: Union[str, PurePath, None] = None) -> dict:
+    """retry_options.
+
+    BatchProcessor options of a retry run: a tuned profile (see
+    autotune.load_tuned) or the heavy defaults.
+    """
+    if profile:
+        from .autotune import load_tuned
+        return load_tuned(profile)
+    return dict(HEAVY)
+
+
+class FailureQueue:
+    """FailureQueue.
+
+    Failed actas (keyed as the Manifest) with their reason, the source
+    and destination needed to process them again. An acta leaves the
+    queue once it is decoded.
+
+    A queue shared by workers on several hosts uses the rollback journal
+    (journal_mode "DELETE", WAL needs shared memory), its actas are not
+    cached: others may add them.
+    """
+    FIELDS = (
+        'path', 'source', 'archive', 'member', 'relative_path',
+        'destination', 'reason', 'error', 'attempts', 'updated_at'
+    )
+
+    def __init__(
+        self,
+        filename: Union[str, PurePath],
+        commit_every: int = 100,
+        journal_mode: str = 'WAL',
+        timeout: float = 5.0
+    ) -> None:
+        self.filename = Path(filename)
+        if self.filename.parent.exists() is False:
+            self.filename.parent.mkdir(parents=True, exist_ok=True)
+        self._commit_every = commit_every
+        self._uncommitted = 0
+        self._lock = threading.Lock()
+        self.logger = getLogger(
+            "CNE.FailureQueue"
+        )
+        self._conn = sqlite3.connect(
+            str(self.filename),
+            timeout=timeout,
+            check_same_thread=False
+        )
+        self._conn.execute(f"PRAGMA journal_mode={journal_mode}")
+        shared = journal_mode.upper() != 'WAL'
+        if not shared:
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS failures (
+                path TEXT PRIMARY KEY,
+                source TEXT,
+                archive TEXT,
+                member TEXT,
+                relative_path TEXT,
+                destination TEXT,
+                reason TEXT,
+                error TEXT,
+                attempts INTEGER DEFAULT 0,
+                updated_at REAL
+            )"""
+        )
+        self._conn.commit()
+        # actas on the queue (decoded actas are only deleted if queued),
+        # None if shared: decoded actas are always deleted
+        self._paths: Optional[set[str]] = None if shared else {
+            row[0] for row in self._conn.execute("SELECT path FROM failures")
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.commit()
+                self._conn.close()
+                self._conn = None
+
+    def commit(self):
+        with self._lock:
+            self._conn.commit()
+            self._uncommitted = 0
+
+    def _write(self, sql: str, params: tuple) -> None:
+        with self._lock:
+            self._conn.execute(sql, params)
+            self._uncommitted += 1
+            if self._uncommitted >= self._commit_every:
+                self._conn.commit()
+                self._uncommitted = 0
+
+    def add(
+        self,
+        key: str,
+        source,
+        relative_path: Union[str, PurePath],
+        destination: Union[str, PurePath],
+        reason: str,
+        error: str = None
+    ) -> None:
+        """add.
+
+        Record (or update) a failed acta, source is a file or an archive
+        member (see archives.ArchiveMember).
+        """
+        archive = getattr(source, 'archive', None)
+        if self._paths is not None:
+            self._paths.add(key)
+        self._write(
+            """INSERT INTO failures (
+                path, source, archive, member, relative_path, destination,
+                reason, error, attempts, updated_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1, ?)
+            ON CONFLICT(path) DO UPDATE SET
+                source=excluded.source,
+                archive=excluded.archive,
+                member=excluded.member,
+                relative_path=excluded.relative_path,
+                destination=excluded.destination,
+                reason=excluded.reason,
+                error=excluded.error,
+                attempts=failures.attempts + 1,
+                updated_at=excluded.updated_at
+            """,
+            (
+                key,
+                None if archive is not None else str(source),
+                None if archive is None else str(archive),
+                getattr(source, 'member', None),
+                PurePath(relative_path).as_posix(),
+                str(destination),
+                reason,
+                error,
+                time.time()
+            )
+        )
+
+    def resolve(self, key: str) -> None:
+        """resolve.
+
+        Remove an acta decoded (on a retry or a later run).
+        """
+        if self._paths is not None:
+            if key not in self._paths:
+                return
+            self._paths.discard(key)
+        self._write("DELETE FROM failures WHERE path = ?", (key,))
+
+    def pending(
+        self,
+        reasons: Optional[list] = None,
+        max_attempts: int = None
+    ) -> list[dict]:
+        """pending.
+
+        Failed actas (optionally of some reasons, tried less than
+        max_attempts times), oldest first.
+        """
+        sql = f"SELECT {', '.join(self.FIELDS)} FROM failures"
+        conditions, params = [], []
+        if reasons:
+            conditions.append(f"reason IN ({', '.join('?' * len(reasons))})")
+            params.extend(reasons)
+        if max_attempts:
+            conditions.append("attempts < ?")
+            params.append(max_attempts)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY updated_at"
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [dict(zip(self.FIELDS, row)) for row in rows]
+
+    def items(
+        self,
+        reasons: Optional[list] = None,
+        max_attempts: int = None
+    ) -> Iterator[tuple]:
+        """items.
+
+        ``(relative_path, destination_path, image)`` items of the failed
+        actas (the BatchProcessor.run contract); archive members are
+        read again, one pass per archive.
+        """
+        archives: dict[str, dict] = {}
+        for row in self.pending(reasons, max_attempts):
+            if row['archive'] is not None:
+                archives.setdefault(row['archive'], {})[row['member']] = row
+                continue
+            yield (
+                PurePath(row['relative_path']),
+                Path(row['destination']),
+                row['source']
+            )
+        for archive, rows in archives.items():
+            yield from self._archive_items(archive, rows)
+
+    def _archive_items(self, archive: str, rows: dict) -> Iterator[tuple]:
+        from .archives import ArchiveMember, archive_members
+        try:
+            for name, size, mtime, read in archive_members(archive):
+                row = rows.pop(name, None)
+                if row is None:
+                    continue
+                member = ArchiveMember(
+                    Path(archive), name, read(), size=size, mtime=mtime
+                )
+                yield (
+                    PurePath(row['relative_path']),
+                    Path(row['destination']),
+                    member
+                )
+                if not rows:
+                    break
+        except (OSError, EOFError) as exc:
+            self.logger.error(f"Unable to read archive {archive}: {exc}")
+        for name in rows:
+            self.logger.warning(f"{archive}:{name} no longer exists")
+
+    def stats(self) -> dict:
+        """stats.
+
+        Number of failed actas by reason.
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT reason, COUNT(*) FROM failures GROUP BY reason"
+            )
+            return dict(cursor.fetchall())
+
+
+async def retry(
+    queue: FailureQueue,
+    batch,
+    reasons: Optional[list] = None,
+    max_attempts: int = None
+) -> dict:
+    """retry.
+
+    Process again the failed actas on batch (a BatchProcessor created
+    with failures=queue, decoded actas leave the queue). Returns the
+    number of actas decoded and still failing.
+    """
+    counts = {'decoded': 0, 'failed': 0}
+    async for result in batch.run(queue.items(reasons, max_attempts)):
+        counts['decoded' if result.ok else 'failed'] += 1
+    return counts
+
+
+def run(options) -> int:
+    """run.
+
+    Failed actas of a queue (cne failures): stats, list or retry them.
+    """
+    queue = FailureQueue(options.queue)
+    try:
+        if options.action == 'stats':
+            print(json.dumps(queue.stats()))
+            return 0
+        if options.action == 'list':
+            for row in queue.pending(options.reason, options.max_attempts):
+                source = row['source'] or f"{row['archive']}:{row['member']}"
+                print(
+                    f"{row['path']}\t{row['reason']}\t{row['attempts']}\t"
+                    f"{source}\t{row['error'] or ''}"
+                )
+            return 0
+        import asyncio  # pylint: disable=C0415
+        counts = asyncio.run(_retry(queue, options))
+        print(f"{counts}, pending: {queue.stats()}")
+        return 0 if not counts['failed'] else 1
+    finally:
+        queue.close()
+
+
+async def _retry(queue: FailureQueue, options) -> dict:
+    from .batch import BatchProcessor
+    from .results import get_sink
+    settings = {} if options.same else retry_options(options.profile)
+    batch = BatchProcessor(
+        executor=options.executor,
+        max_workers=options.max_workers,
+        timeout=options.timeout,
+        in_memory=options.in_memory,
+        failures=queue,
+        logdir=Path(options.logdir) if options.logdir else None,
+        **settings
+    )
+    if options.results is None:
+        async with batch:
+            return await retry(queue, batch, options.reason, options.max_attempts)
+    async with get_sink(options.results) as sink:
+        batch.sink = sink
+        async with batch:
+            return await retry(queue, batch, options.reason, options.max_attempts)
@@ -5,15 +5,36 @@ Usado para post-procesar las actas electorales.
 """
 from typing import Union
 from collections.abc import Callable, Awaitable
+from contextlib import contextmanager
+import os
+import logging
+import time
 import asyncio
 from pathlib import PurePath, Path
-import aiofiles
 import cv2
-from wand.image import Image
-from wand.color import Color
 import numpy as np
-from navconfig import BASE_DIR
-from navconfig.logging import logging
+from .logs import getLogger
+from .deskew import DeskewEstimator, SkewEstimate, get_estimator
+from .qr_region import QRRegionPrior, qr_bounding_box
+from .qr_cascade import DecodeCascade, BLUE_LOWER, BLUE_UPPER
+from .metrics import Metrics
+from .buffers import BufferPool, get_pool
+from .artifacts import ArtifactPolicy
+from .archives import ArchiveMember
+from .triage import TriagePolicy, Tier, Quality
+from .memory import image_dimensions
+from .failures import (
+    ActaError, READ_ERROR, NO_LINES, QR_NOT_FOUND, QR_UNDECODABLE
+)
+from .pipeline import (
+    EnhancementPipeline,
+    get_pipeline,
+    morph_kernel,
+    SHARPEN_KERNEL
+)
+
+WHITE = (255, 255, 255, 0)
+
 
 class ImageProcessor:
     """ImageProcessor.
@@ -27,15 +48,25 @@ class ImageProcessor:
 
     def __init__(
         self,
-        image: Union[str, PurePath],
+        image: Union[str, PurePath, ArchiveMember, bytes],
         destination_image: Union[str, PurePath],
-        logdir: Union[None, PurePath] = None
+        logdir: Union[None, PurePath] = None,
+        in_memory: bool = False,
+        metrics: Metrics = None,
+        enhance: Union[str, EnhancementPipeline] = 'default',
+        buffers: Union[bool, BufferPool] = None,
+        artifacts: ArtifactPolicy = None,
+        triage: TriagePolicy = None,
+        reduced_analysis: bool = False
     ) -> None:
-        self.logger = logging.getLogger(
+        self.logger = getLogger(
             "CNE.ImageProcessor"
         )
         self.image_file = image
-        self.logger.debug(f"Processing Image: {image}")
+        if isinstance(image, (bytes, bytearray)):
+            self.logger.debug(f"Processing Image: <{len(image)} bytes>")
+        else:
+            self.logger.debug(f"Processing Image: {image}")
         if isinstance(self.image_file, str):
             self.image_file = Path(image)
         self._destination = destination_image
@@ -43,19 +74,110 @@ class ImageProcessor:
             self._destination = Path(self._destination)
         self._logdir = logdir
         if logdir is None:
+            from navconfig import BASE_DIR  # pylint: disable=C0415
             self._logdir = BASE_DIR.joinpath('Log')
         if self._logdir.exists() is False:
             self._logdir.mkdir(parents=True, exist_ok=True)
         self._log_handler = None
         self.log_file = self._logdir.joinpath('non_processed.log')
+        # in-memory mode: decode once, deskew with OpenCV, keep the buffer.
+        self._in_memory = in_memory
+        self._image = None
+        self.skew: SkewEstimate = None
+        # QR bounding box (x0, y0, x1, y1) on the page, once decoded
+        self.qr_box: tuple = None
+        self.page_size: tuple = None
+        # decode strategy that found the QR (see DecodeCascade)
+        self.qr_strategy: str = None
+        # instrumentation: seconds spent on every stage of this acta
+        self.metrics = metrics
+        self.timings: dict[str, float] = {}
+        # enhancement profile (compiled once, see pipeline.get_pipeline)
+        self.enhance = get_pipeline(enhance)
+        # buffer-pool mode: scratch arrays reused across actas (True uses
+        # the pool of the worker process, see buffers.get_pool)
+        if buffers is True:
+            buffers = get_pool()
+        self.buffers: BufferPool = buffers or None
+        # which outputs are written (and how), see ArtifactPolicy
+        self.artifacts = artifacts or ArtifactPolicy()
+        # intermediate file of the Wand rotation
+        self._rotated_file: PurePath = None
+        # quality triage: every acta goes to a fast, standard or heavy tier
+        self.triage = triage
+        self.tier: Tier = None
+        self.quality: Quality = None
+        # failure reason of the acta (see failures.REASONS)
+        self.reason: str = None
+        # triage and deskew on a reduced JPEG decode (no full-size
+        # grayscale copy, no full decode before a Wand rotation unless the
+        # triage needs it)
+        self.reduced_analysis = reduced_analysis
 
     async def __aenter__(self):
+        import aiofiles  # pylint: disable=C0415
         self._log_handler = await aiofiles.open(self.log_file, mode='a')
+        if self.pre_init is not None:
+            await self.pre_init()  # pylint: disable=E1102
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self.post_end is not None:
+            await self.post_end()  # pylint: disable=E1102
         await self._log_handler.close()
 
+    @contextmanager
+    def stage(self, name: str, nbytes: int = 0):
+        """stage.
+
+        Hook around every pipeline stage (read, deskew, rotate, enhance,
+        crop, write, qr_preprocess, decode): records its duration on
+        timings and, when configured, on the Metrics collector.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.timings[name] = self.timings.get(name, 0.0) + elapsed
+            if self.metrics is not None:
+                self.metrics.observe(name, elapsed, nbytes)
+
+    def buffer(self, name: str, shape: tuple, dtype=np.uint8):
+        """buffer.
+
+        Reusable scratch array (used as OpenCV dst), None when the buffer
+        pool is disabled (OpenCV allocates the output).
+        """
+        if self.buffers is None:
+            return None
+        return self.buffers.get(name, shape, dtype)
+
+    def failure(self, reason: str) -> None:
+        if self.metrics is not None:
+            self.metrics.failure(reason)
+
+    def imwrite(self, filename: PurePath, image, stage: str = 'write') -> None:
+        with self.stage(stage, image.nbytes):
+            cv2.imwrite(str(filename), image)
+
+    def save_artifact(
+        self, artifact: str, image, ok: bool = None
+    ) -> Union[PurePath, None]:
+        """save_artifact.
+
+        Write an image artifact (image, bottom, qr_code) if the policy
+        emits it for the outcome ok, returns its filename.
+        """
+        if not self.artifacts.emits(artifact, ok):
+            return None
+        filename = self.artifacts.filename(self._destination, artifact)
+        with self.stage('write', image.nbytes):
+            self.artifacts.write(
+                filename, image, artifact, copy=self.buffers is not None
+            )
+        return filename
+
     async def log_error(self, error_message):
         """log_error.
 
@@ -77,7 +199,7 @@ class ImageProcessor:
 
     def apply_morphological_cleaning(self, image):
         # Apply morphological operations to clean up the image
-        kernel = np.ones((3, 3), np.uint8)
+        kernel = morph_kernel(3)
         cleaned_image = cv2.morphologyEx(image, cv2.MORPH_OPEN, kernel)
         cleaned_image = cv2.morphologyEx(cleaned_image, cv2.MORPH_CLOSE, kernel)
         return cleaned_image
@@ -91,8 +213,7 @@ class ImageProcessor:
     def sharpen_image(self, image):
         # Apply mild sharpening
         # kernel = np.array([[0, -0.3, 0], [-0.3, 2, -0.3], [0, -0.3, 0]])
-        kernel = np.array([[0, -1, 0], [-1, 5, -1], [0, -1, 0]])
-        return cv2.filter2D(image, -1, kernel)
+        return cv2.filter2D(image, -1, SHARPEN_KERNEL)
 
     def unsharp_mask(self, image):
         # Apply unsharp masking
@@ -105,22 +226,32 @@ class ImageProcessor:
         if len(image.shape) == 2 or image.shape[2] == 1:
             gray = image
         else:
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            gray = cv2.cvtColor(
+                image, cv2.COLOR_BGR2GRAY,
+                dst=self.buffer('dots_gray', image.shape[:2])
+            )
 
         # Apply binary thresholding
-        _, binary_image = cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY_INV)
+        _, binary_image = cv2.threshold(
+            gray, 127, 255, cv2.THRESH_BINARY_INV,
+            dst=self.buffer('dots', gray.shape[:2])
+        )
 
         # Define a kernel for morphological operations
-        kernel = np.ones((2, 2), np.uint8)
+        kernel = morph_kernel(2)
 
         # Apply morphological opening to remove small black dots
-        cleaned_image = cv2.morphologyEx(binary_image, cv2.MORPH_OPEN, kernel)
+        cleaned_image = cv2.morphologyEx(
+            binary_image, cv2.MORPH_OPEN, kernel, dst=binary_image
+        )
 
         # Apply morphological closing to enhance characters
-        cleaned_image = cv2.morphologyEx(cleaned_image, cv2.MORPH_CLOSE, kernel)
+        cleaned_image = cv2.morphologyEx(
+            cleaned_image, cv2.MORPH_CLOSE, kernel, dst=cleaned_image
+        )
 
         # Invert the image back to original form
-        cleaned_image = cv2.bitwise_not(cleaned_image)
+        cleaned_image = cv2.bitwise_not(cleaned_image, dst=cleaned_image)
 
         return cleaned_image
 
@@ -128,11 +259,19 @@ class ImageProcessor:
         # Ensure the image is in color format before converting to grayscale
         if len(image.shape) == 2 or image.shape[2] == 1:
             gray = image
+            scratch = self.buffer('page_mask', gray.shape[:2])
         else:
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            gray = cv2.cvtColor(
+                image, cv2.COLOR_BGR2GRAY,
+                dst=self.buffer('page_gray', image.shape[:2])
+            )
+            # the grayscale copy is ours, threshold it in place
+            scratch = gray
 
         # Apply binary threshold
-        _, thresh = cv2.threshold(gray, 1, 255, cv2.THRESH_BINARY)
+        _, thresh = cv2.threshold(
+            gray, 1, 255, cv2.THRESH_BINARY, dst=scratch
+        )
 
         # Find contours of the thresholded image
         contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
@@ -149,8 +288,11 @@ class ImageProcessor:
 
         if significant_contour is not None:
             x, y, w, h = cv2.boundingRect(significant_contour)
-            print(f"Bounding box: x={x}, y={y}, w={w}, h={h}")
-            print(f"Image dimensions: width={image.shape[1]}, height={image.shape[0]}")
+            self.logger.debug(
+                f"Bounding box: x={x}, y={y}, w={w}, h={h}, "
+                f"Image dimensions: width={image.shape[1]}, "
+                f"height={image.shape[0]}"
+            )
 
             # Check if the bounding box is significantly smaller than the image size
             if w < image.shape[1] * 0.95 and h < image.shape[0] * 0.95:
@@ -177,95 +319,316 @@ class ImageProcessor:
         denoised = cv2.fastNlMeansDenoising(binary_image, None, 30, 7, 21)
 
         # Sharpen the image
-        kernel = np.array([[0, -1, 0], [-1, 5, -1], [0, -1, 0]])
-        sharpened = cv2.filter2D(denoised, -1, kernel)
+        sharpened = cv2.filter2D(denoised, -1, SHARPEN_KERNEL)
 
         return sharpened
 
     def enhance_image(self, image):
-        # Convert to grayscale
-        # gray = self.convert_to_grayscale(image)
-        # Reduce noise
-        # denoised = self.apply_noise_reduction(gray)
-        # Clean up using morphological operations
-        # cleaned_image = self.apply_morphological_cleaning(denoised)
-        # Sharpen image
-        sharpened = self.sharpen_image(image)
-        # removing black areas on borders:
-        final_image = self.crop_black_borders(sharpened)
-        # final_image = self.clean_black_dots(cropped)
-        return final_image
-
-    def process_image(self, tolerance: float = 0.4):
-        # 1. Read the image using OpenCV
-        image = cv2.imread(self.image_file)
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        edges = cv2.Canny(gray, 50, 150, apertureSize=3)
-        lines = cv2.HoughLines(edges, 1, np.pi / 180, 200)
-
-        # 2. Find the angle of the first horizontal line
-        angle_degrees = 0
-        for rho, theta in lines[:, 0]:
-            if np.sin(theta) > 0.9:
-                angle_degrees = np.degrees(theta) - 90
+        """enhance_image.
+
+        Run the enhancement profile (ex: sharpening and black borders
+        removal, see pipeline.PROFILES) over the image.
+        """
+        return self.enhance(image, self)
+
+    def rotate_image(self, image, angle: float):
+        """rotate_image.
+
+        Rotate (clockwise, like ImageMagick) an image in memory, expanding
+        the canvas and filling the borders with white.
+        """
+        height, width = image.shape[:2]
+        center = (width / 2, height / 2)
+        matrix = cv2.getRotationMatrix2D(center, -angle, 1.0)
+        cos, sin = abs(matrix[0, 0]), abs(matrix[0, 1])
+        new_width = int(height * sin + width * cos)
+        new_height = int(height * cos + width * sin)
+        matrix[0, 2] += new_width / 2 - center[0]
+        matrix[1, 2] += new_height / 2 - center[1]
+        return cv2.warpAffine(
+            image,
+            matrix,
+            (new_width, new_height),
+            dst=self.buffer(
+                'page_a', (new_height, new_width, *image.shape[2:])
+            ),
+            flags=cv2.INTER_LINEAR,
+            borderMode=cv2.BORDER_CONSTANT,
+            borderValue=(255, 255, 255)
+        )
+
+    def estimate_skew(
+        self,
+        gray,
+        deskew: Union[str, DeskewEstimator] = 'balanced'
+    ) -> SkewEstimate:
+        """estimate_skew.
+
+        Estimate the correction angle on a downscaled level of the image.
+        Args:
+            deskew: preset (fast, balanced, accurate), method name or
+            DeskewEstimator instance.
+        """
+        estimator = get_estimator(deskew)
+        return estimator.estimate(gray)
+
+    def read_image(self):
+        """read_image.
+
+        Decode the source acta: a file, or the encoded bytes of an
+        archive member (never extracted to disk).
+        """
+        data = self.image_file
+        if isinstance(data, ArchiveMember):
+            data = data.data
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            with self.stage('read', len(data)):
+                return cv2.imdecode(
+                    np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR
+                )
+        with self.stage('read', os.path.getsize(self.image_file)):
+            return cv2.imread(str(self.image_file))
+
+    def truncated(self) -> bool:
+        """truncated.
+
+        True if the source is a JPEG without its end marker (an interrupted
+        download: libjpeg decodes it partially, without an error).
+        """
+        data = self.image_file
+        if isinstance(data, ArchiveMember):
+            data = data.data
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            head, tail = bytes(data[:2]), bytes(data[-32:])
+        else:
+            try:
+                with open(data, 'rb') as fp:
+                    head = fp.read(2)
+                    fp.seek(max(os.path.getsize(data) - 32, 0))
+                    tail = fp.read()
+            except OSError:
+                return True
+        # the end marker may be followed by some padding
+        return head == b'\xff\xd8' and b'\xff\xd9' not in tail
+
+    def analysis_side(self, estimator: DeskewEstimator) -> int:
+        """analysis_side.
+
+        Largest side used by the deskew analysis: the one of estimator or,
+        with triage, of any tier preset (the tier is only known once the
+        reduced page is measured).
+        """
+        sides = [estimator.max_side]
+        if self.triage is not None:
+            sides.extend(
+                get_estimator(tier.deskew).max_side
+                for tier in self.triage.tiers.values() if tier.deskew
+            )
+        return max(sides)
+
+    def read_reduced(self, shape: tuple, max_side: int, color: bool = False):
+        """read_reduced.
+
+        Grayscale (or color) acta decoded at 1/4 or 1/8 of its size
+        (libjpeg DCT scaling, the largest reduction still over max_side),
+        None if not worth it (a 1/2 decode costs more than converting the
+        decoded page) or the source is not a JPEG.
+        """
+        for factor, color_flag, gray_flag in (
+            (8, cv2.IMREAD_REDUCED_COLOR_8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+            (4, cv2.IMREAD_REDUCED_COLOR_4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+        ):
+            if max(shape) // factor >= max_side:
+                flag = color_flag if color else gray_flag
                 break
+        else:
+            return None
+        data = self.image_file
+        if isinstance(data, ArchiveMember):
+            data = data.data
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            if bytes(data[:2]) != b'\xff\xd8':
+                return None
+            with self.stage('read', len(data)):
+                return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flag)
+        if PurePath(data).suffix.lower() not in ('.jpg', '.jpeg'):
+            return None
+        with self.stage('read', os.path.getsize(data)):
+            return cv2.imread(str(data), flag)
+
+    def open_wand(self):
+        """open_wand.
+
+        Wand (ImageMagick) image of the source; ImageMagick is only loaded
+        on this path (rotation without PROCESS_IN_MEMORY).
+        """
+        from wand.image import Image  # pylint: disable=C0415
+        if isinstance(self.image_file, ArchiveMember):
+            return Image(blob=self.image_file.data)
+        if isinstance(self.image_file, (bytes, bytearray)):
+            return Image(blob=bytes(self.image_file))
+        return Image(filename=self.image_file)
+
+    def process_image(
+        self,
+        tolerance: float = 0.4,
+        deskew: Union[str, DeskewEstimator] = 'balanced'
+    ):
+        estimator = get_estimator(deskew)
+        image = gray = reduced = None
+        if self.reduced_analysis:
+            # 1. Analysis (triage, deskew) on a reduced decode, the full
+            # page is only decoded if it is used (not for a Wand rotation)
+            try:
+                dimensions = image_dimensions(self.image_file)
+            except OSError:
+                dimensions = None
+            if dimensions is not None:
+                reduced = self.read_reduced(
+                    dimensions[1::-1],
+                    self.analysis_side(estimator),
+                    color=self.triage is not None
+                )
+        if reduced is None or self.triage is not None:
+            # 1. Read the image using OpenCV (the triage measures blur and
+            # noise on the full resolution QR strip)
+            image = self.read_image()
+            if image is None:
+                self.failure(READ_ERROR)
+                raise ActaError(
+                    f"Unable to read image {self.image_file}", READ_ERROR
+                )
 
-        # 3. Always invert the angle to correct the rotation direction
-        angle_degrees = -angle_degrees
+            # 1.1 Quality triage: the tier sets the profile and deskew preset
+            if self.triage is not None:
+                with self.stage('triage'):
+                    self.tier, self.quality = self.triage.route(
+                        image, reduced=reduced
+                    )
+                self.logger.debug(f"Triage: {self.tier.name} ({self.quality})")
+                if self.tier.enhance is not None:
+                    self.enhance = self.tier.enhance
+                if self.tier.deskew is not None:
+                    estimator = get_estimator(self.tier.deskew)
+                if self.metrics is not None:
+                    self.metrics.incr(f"tier_{self.tier.name}")
+
+        # 2. Estimate the correction angle (consensus of near-horizontal lines)
+        analyzed = image if reduced is None else reduced
+        with self.stage('deskew', analyzed.nbytes):
+            if reduced is not None:
+                gray = reduced if len(reduced.shape) == 2 else cv2.cvtColor(
+                    reduced, cv2.COLOR_BGR2GRAY
+                )
+            else:
+                gray = cv2.cvtColor(
+                    image, cv2.COLOR_BGR2GRAY,
+                    dst=self.buffer('page_gray', image.shape[:2])
+                )
+            self.skew = self.estimate_skew(gray, estimator)
+        angle_degrees = self.skew.angle
+        rotate = abs(angle_degrees) > tolerance
+        if image is None and (self._in_memory or not rotate):
+            image = self.read_image()
+            if image is None:
+                self.failure(READ_ERROR)
+                raise ActaError(
+                    f"Unable to read image {self.image_file}", READ_ERROR
+                )
+        if self._in_memory and self.enhance.grayscale:
+            # the profile starts with a grayscale conversion: go
+            # single-channel now (rotation and enhancement on 1/3 of data)
+            if gray.shape[:2] != image.shape[:2]:
+                gray = cv2.cvtColor(
+                    image, cv2.COLOR_BGR2GRAY,
+                    dst=self.buffer('page_gray', image.shape[:2])
+                )
+            image = gray
+        gray = None
+
+        if self._destination.parent.exists() is False:
+            # create the directory first:
+            self._destination.parent.mkdir(parents=True, exist_ok=True)
 
         # 3. Rotate the image using Wand (ImageMagick) if needed
-        print('Angle degrees: ', angle_degrees)
-        if abs(angle_degrees) > tolerance:  # Tolerance of 0.4 degrees
-            with Image(filename=self.image_file) as img:
-                img.background_color = Color('white')  # Set white background
-                img.rotate(angle_degrees, background=Color('white'))  # Rotate with white
-                img.save(filename=self._destination)
-                # Read the rotated image back into OpenCV
-                rotated_image = cv2.imread(self._destination)
+        self.logger.debug(
+            f'Angle degrees: {angle_degrees} '
+            f'(confidence: {self.skew.confidence:.2f}, {self.skew.method})'
+        )
+        if rotate and self._in_memory:
+            # Rotate the decoded buffer, no save/reload round-trip
+            with self.stage('rotate', image.nbytes):
+                rotated_image = self.rotate_image(image, angle_degrees)
+        elif rotate:  # Tolerance of 0.4 degrees
+            with self.stage('rotate'):
+                from wand.color import Color  # pylint: disable=C0415
+                with self.open_wand() as img:
+                    img.background_color = Color('white')  # Set white background
+                    img.rotate(angle_degrees, background=Color('white'))  # Rotate with white
+                    img.save(filename=self._destination)
+                    self._rotated_file = self._destination
+                    # Read the rotated image back into OpenCV
+                    rotated_image = cv2.imread(str(self._destination))
         else:
-            # Read the image with no rotation
-            rotated_image = cv2.imread(self.image_file)
+            # Use the image with no rotation
+            rotated_image = image
+        # release the decoded scan (if rotated)
+        image = None
 
         # 5. Enhance the image
         enhanced_image = self.enhance_image(rotated_image)
-
         # 6. Save the final image
-        print(f'Saving final Image {self._destination}')
-        if self._destination.parent.exists() is False:
-            # create the directory first:
-            self._destination.parent.mkdir(parents=True, exist_ok=True)
-        cv2.imwrite(self._destination, enhanced_image)
+        self.logger.debug(f'Saving final Image {self._destination}')
+        filename = self.save_artifact('image', enhanced_image)
+        if filename == self._destination:
+            self._rotated_file = None
+        if (
+            self._in_memory or filename != self._destination
+            or self.artifacts.background
+        ):
+            # decode_qr works on the buffer (the file is written later,
+            # with another format or depends on the decoding outcome)
+            self._image = enhanced_image
 
     def remove_blue_artifacts(self, image):
+        if len(image.shape) == 2 or image.shape[2] == 1:
+            # no color information (ex: a grayscale enhancement profile)
+            return image
         # Convert to HSV color space
-        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-
-        # Define the range for blue color in HSV
-        lower_blue = np.array([90, 50, 50])
-        upper_blue = np.array([130, 255, 255])
+        hsv = cv2.cvtColor(
+            image, cv2.COLOR_BGR2HSV, dst=self.buffer('hsv', image.shape)
+        )
 
-        # Create a mask for blue color
-        mask = cv2.inRange(hsv, lower_blue, upper_blue)
+        # Create a mask for blue color (range in HSV)
+        mask = cv2.inRange(
+            hsv, BLUE_LOWER, BLUE_UPPER,
+            dst=self.buffer('blue_mask', image.shape[:2])
+        )
 
         # Set the blue pixels to white
-        image[mask != 0] = [255, 255, 255]
+        cv2.bitwise_or(image, WHITE, dst=image, mask=mask)
 
         return image
 
-    async def extract_qr(self, area: float = 0.15):
-        # Read the image
-        directory = self._destination.parent
-        # open the optimized image
-        image = cv2.imread(self._destination)
-        height, width = image.shape[:2]
-
-        # Manually define the QR code region
-        qr_height = int(height * area)  # 15% of the height
-        qr_y_start = height - qr_height
+    async def extract_qr(
+        self,
+        area: float = 0.15,
+        prior: QRRegionPrior = None,
+        cascade: DecodeCascade = None,
+        save_data: bool = True
+    ):
+        decoded_info, output_path = self.decode_qr(
+            area, prior=prior, cascade=cascade, save_data=save_data
+        )
+        if not decoded_info:
+            await self.log_error(str(self._destination))
+        return decoded_info, output_path
 
-        # Extract the QR code region
-        qr_code_roi = image[qr_y_start:height, 0:width]
+    def preprocess_qr(self, qr_code_roi):
+        """preprocess_qr.
 
+        Chain applied to the QR region before detection.
+        """
         # Remove blue artifacts
         cleaned_image = self.remove_blue_artifacts(qr_code_roi)
 
@@ -275,46 +638,127 @@ class ImageProcessor:
         # gray = self.convert_to_grayscale(cleaned_image)
 
         # Apply a median blur to remove noise
-        denoised = cv2.medianBlur(no_dots, 5)
+        denoised = cv2.medianBlur(
+            no_dots, 5, dst=self.buffer('qr_median', no_dots.shape)
+        )
 
         # Sharpen the image:
-        sharpened = self.sharpen_image(denoised)
+        return cv2.filter2D(
+            denoised, -1, SHARPEN_KERNEL,
+            dst=self.buffer('qr_sharpen', denoised.shape)
+        )
 
-        # Initialize the QRCodeDetector
-        qr_detector = cv2.QRCodeDetector()
+    def decode_qr(
+        self,
+        area: float = 0.15,
+        prior: QRRegionPrior = None,
+        cascade: DecodeCascade = None,
+        save_data: bool = True
+    ):
+        """decode_qr.
+
+        Synchronous QR extraction, safe to run inside a worker pool.
+        Args:
+            area: height (fraction of the page) of the bottom strip.
+            prior: QRRegionPrior, if the QR location was already learned
+            only a small region around it is processed (the bottom strip
+            is the fallback).
+            cascade: DecodeCascade, preprocessing strategies tried (from
+            the cheapest) until the QR is decoded.
+            save_data: write the payload on a <stem>.txt file (disable it
+            when the results go to a ResultSink).
+        Returns:
+            tuple: decoded QR data (empty if not found) and the path of
+            the saved bottom area (or QR crop, None if the artifact
+            policy writes none of them).
+        """
+        output_path = None
+        # open the optimized image (or reuse the in-memory buffer)
+        if self._image is not None:
+            image = self._image
+        else:
+            with self.stage('read', os.path.getsize(self._destination)):
+                image = cv2.imread(str(self._destination))
+        height, width = image.shape[:2]
+        self.page_size = (width, height)
 
-        # Detect and decode the QR code
-        decoded_info, points, _ = qr_detector.detectAndDecode(sharpened)
+        # Manually define the QR code region
+        qr_height = int(height * area)  # 15% of the height
+        qr_y_start = height - qr_height
+        regions = []
+        if prior is not None:
+            regions = prior.regions(width, height)
+        regions.append((0, qr_y_start, width, height))
+
+        if cascade is None:
+            cascade = DecodeCascade()
+
+        detected = False
+        for x0, y0, x1, y1 in regions:
+            # Extract the QR code region
+            qr_code_roi = image[y0:y1, x0:x1]
+            # Detect and decode the QR code (cheapest strategy first)
+            result = cascade.decode(qr_code_roi, self)
+            detected = detected or result.detected
+            if result.data:
+                break
+        decoded_info = result.data
+        sharpened = result.image
+        self.qr_strategy = result.strategy
         if decoded_info:
-            print(f"QR code decoded information: {decoded_info}")
-            if points is not None:
+            self.logger.debug(
+                f"QR code decoded information: {decoded_info} "
+                f"(strategy: {result.strategy})"
+            )
+            if result.points is not None:
+                self.qr_box = qr_bounding_box(result.points, offset=(x0, y0))
+                if prior is not None:
+                    prior.update(width, height, self.qr_box)
                 # Extract the bounding box coordinates
-                points = points[0]
-                x1, y1 = points[0]
-                x2, y2 = points[2]
+                points = result.image_points.reshape(-1, 2)
+                x1, y1 = points.min(axis=0)
+                x2, y2 = points.max(axis=0)
 
                 # Convert coordinates to integer
-                x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
+                x1, y1, x2, y2 = max(int(x1), 0), max(int(y1), 0), int(x2), int(y2)
 
                 # Extract the QR code region
                 qr_code_roi = sharpened[y1:y2, x1:x2]
 
                 # Save the QR code region
-                output_path = Path(directory).joinpath(f"{self._destination.stem}_qr_code{self._destination.suffix}")
-                cv2.imwrite(output_path, qr_code_roi)
+                output_path = self.save_artifact('qr_code', qr_code_roi, True)
                 self.logger.debug(
                     f"QR code detected and saved to {output_path}"
                 )
         else:
-            self.logger.warning("No QR code detected")
-            await self.log_error(str(self._destination))
+            # why: located but unreadable, a truncated file or not located
+            # (on a page without lines the skew could not be corrected)
+            if detected:
+                self.reason = QR_UNDECODABLE
+            elif self.truncated():
+                self.reason = READ_ERROR
+            elif self.skew is not None and self.skew.confidence == 0:
+                self.reason = NO_LINES
+            else:
+                self.reason = QR_NOT_FOUND
+            self.logger.warning(f"No QR code decoded ({self.reason})")
+            self.failure(self.reason)
+        ok = bool(decoded_info)
         # Save the QR code region (bottom area:)
-        output_path = Path(directory).joinpath(f"{self._destination.stem}_bottom{self._destination.suffix}")
-        cv2.imwrite(output_path, sharpened)
+        output_path = self.save_artifact('bottom', sharpened, ok) or output_path
+        # the full acta, when it depends on the outcome:
+        if self.artifacts.deferred('image'):
+            if self.save_artifact('image', image, ok) == self._destination:
+                self._rotated_file = None
+        if self._rotated_file is not None:
+            # intermediate file of the rotation, not an artifact
+            Path(self._rotated_file).unlink(missing_ok=True)
+            self._rotated_file = None
         # saving data:
-        if decoded_info:
-            data_path = Path(directory).joinpath(f"{self._destination.stem}.txt")
-            with open(data_path, "w+") as fp:
-                fp.write(decoded_info)
-                fp.flush()
+        if ok and save_data and self.artifacts.emits('data', ok):
+            data_path = self.artifacts.filename(self._destination, 'data')
+            with self.stage('write', len(decoded_info)):
+                with open(data_path, "w+") as fp:
+                    fp.write(decoded_info)
+                    fp.flush()
         return decoded_info, output_path
@@ -0,0 +1,29 @@
+"""
+Logs.
+
+Loggers del paquete sin importar navconfig (los comandos cortos de la
+línea de comandos no lo cargan).
+
+navconfig.logging configures the handlers (colored console) and the
+logger class (with the NOTICE level) when it is imported, by the
+settings or by the image pipeline. A logger created before that is a
+standard one, it gets a notice method and its records go to the root
+handlers once navconfig configures them.
+"""
+import logging
+from functools import partial
+
+
+# navconfig.logging NOTICE level
+NOTICE = 12
+
+
+def getLogger(name: str) -> logging.Logger:  # pylint: disable=C0103
+    """getLogger.
+
+    Logger of name (navconfig's logger class if already loaded).
+    """
+    logger = logging.getLogger(name)
+    if not hasattr(logger, 'notice'):
+        logger.notice = partial(logger.log, NOTICE)
+    return logger
@@ -0,0 +1,228 @@
+"""
+Manifest.
+
+Índice persistente (SQLite) de las actas procesadas, permite reanudar
+una corrida interrumpida sin reprocesar las actas ya decodificadas.
+"""
+from typing import Union, Optional
+import time
+import hashlib
+import sqlite3
+import threading
+from pathlib import PurePath, Path
+from .logs import getLogger
+from .version import __version__
+
+
+class Manifest:
+    """Manifest.
+
+    Records, for every acta (keyed by its path relative to the actas
+    directory), the size/mtime (and optionally a content hash) of the
+    source, the processing status, the decoded QR payload and the
+    pipeline version used.
+
+    The write-ahead log (WAL) is used by default; a manifest shared by
+    workers on several hosts uses the rollback journal (journal_mode
+    "DELETE", WAL needs shared memory).
+    """
+    DONE: str = 'done'
+    FAILED: str = 'failed'
+
+    def __init__(
+        self,
+        filename: Union[str, PurePath],
+        version: str = __version__,
+        use_hash: bool = False,
+        commit_every: int = 100,
+        journal_mode: str = 'WAL',
+        timeout: float = 5.0
+    ) -> None:
+        self.filename = Path(filename)
+        if self.filename.parent.exists() is False:
+            self.filename.parent.mkdir(parents=True, exist_ok=True)
+        self.version = version
+        self.use_hash = use_hash
+        self._commit_every = commit_every
+        self._uncommitted = 0
+        self._lock = threading.Lock()
+        self.logger = getLogger(
+            "CNE.Manifest"
+        )
+        # used from the DirectoryIterator executor threads:
+        self._conn = sqlite3.connect(
+            str(self.filename),
+            timeout=timeout,
+            check_same_thread=False
+        )
+        self._conn.execute(f"PRAGMA journal_mode={journal_mode}")
+        if journal_mode.upper() == 'WAL':
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS actas (
+                path TEXT PRIMARY KEY,
+                size INTEGER,
+                mtime_ns INTEGER,
+                hash TEXT,
+                status TEXT,
+                data TEXT,
+                error TEXT,
+                version TEXT,
+                attempts INTEGER DEFAULT 0,
+                updated_at REAL
+            )"""
+        )
+        self._conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.commit()
+                self._conn.close()
+                self._conn = None
+
+    def commit(self):
+        with self._lock:
+            self._conn.commit()
+            self._uncommitted = 0
+
+    def due(self) -> bool:
+        """due.
+
+        True if the next record commits (the results of the actas
+        recorded so far must be written first, see BatchProcessor).
+        """
+        return self._uncommitted + 1 >= self._commit_every
+
+    @staticmethod
+    def key(relative_path: Union[str, PurePath], filename: str = None) -> str:
+        path = PurePath(relative_path)
+        if filename is not None:
+            path = path.joinpath(filename)
+        return path.as_posix()
+
+    @staticmethod
+    def content_hash(filename: PurePath) -> str:
+        digest = hashlib.blake2b(digest_size=16)
+        if hasattr(filename, 'load'):
+            # archive member, read from the archive if not loaded yet
+            # (see archives.ArchiveMember)
+            digest.update(filename.load())
+            return digest.hexdigest()
+        with open(filename, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def stat(filename: PurePath):
+        # archive members carry the size/mtime of the archive entry
+        if hasattr(filename, 'stat'):
+            return filename.stat()
+        return Path(filename).stat()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT path, size, mtime_ns, hash, status, data, error, "
+                "version, attempts, updated_at FROM actas WHERE path = ?",
+                (key,)
+            )
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip(
+            (
+                'path', 'size', 'mtime_ns', 'hash', 'status', 'data',
+                'error', 'version', 'attempts', 'updated_at'
+            ),
+            row
+        ))
+
+    def is_processed(self, key: str, filename: PurePath, stat=None) -> bool:
+        """is_processed.
+
+        True if the acta was already decoded by this pipeline version and
+        the source did not change since then.
+        """
+        row = self.get(key)
+        if row is None:
+            return False
+        if row['status'] != self.DONE or row['version'] != self.version:
+            return False
+        if stat is None:
+            stat = self.stat(filename)
+        if row['size'] == stat.st_size and row['mtime_ns'] == stat.st_mtime_ns:
+            return True
+        if self.use_hash and row['hash'] and row['size'] == stat.st_size:
+            # touched but not modified (ex: copied again from a download)
+            return row['hash'] == self.content_hash(filename)
+        return False
+
+    def record(
+        self,
+        key: str,
+        filename: PurePath,
+        data: str = None,
+        error: str = None,
+        digest: str = None
+    ) -> None:
+        """record.
+
+        Save the processing status of an acta; digest is its content hash
+        when already known (ex: the sha of its dedup fingerprint, same
+        blake2b digest), otherwise the source is read again (use_hash).
+        """
+        status = self.DONE if data and error is None else self.FAILED
+        try:
+            stat = self.stat(filename)
+            size, mtime_ns = stat.st_size, stat.st_mtime_ns
+        except OSError:
+            size, mtime_ns = None, None
+        if not self.use_hash or size is None:
+            digest = None
+        elif digest is None:
+            digest = self.content_hash(filename)
+        with self._lock:
+            self._conn.execute(
+                """INSERT INTO actas (
+                    path, size, mtime_ns, hash, status, data, error,
+                    version, attempts, updated_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1, ?)
+                ON CONFLICT(path) DO UPDATE SET
+                    size=excluded.size,
+                    mtime_ns=excluded.mtime_ns,
+                    hash=excluded.hash,
+                    status=excluded.status,
+                    data=excluded.data,
+                    error=excluded.error,
+                    version=excluded.version,
+                    attempts=actas.attempts + 1,
+                    updated_at=excluded.updated_at
+                """,
+                (
+                    key, size, mtime_ns, digest, status, data or None,
+                    error, self.version, time.time()
+                )
+            )
+            self._uncommitted += 1
+            if self._uncommitted >= self._commit_every:
+                self._conn.commit()
+                self._uncommitted = 0
+
+    def stats(self) -> dict:
+        """stats.
+
+        Number of actas by status.
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT status, COUNT(*) FROM actas GROUP BY status"
+            )
+            return dict(cursor.fetchall())
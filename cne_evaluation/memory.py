@@ -0,0 +1,271 @@
+"""
+Memory.
+
+Presupuesto de memoria del procesamiento: cada acta se admite según su
+huella estimada (a partir de las dimensiones de su cabecera, sin
+decodificarla) para no exceder la RAM del nodo.
+
+The footprint of an acta is width * height * bytes per pixel: the
+in-memory pipeline peaks at about 7.5 bytes per pixel (decoded page,
+rotated page and enhanced page, measured with tracemalloc), the Wand
+rotation adds the ImageMagick copy (8 bytes per pixel, Q16 RGBA).
+Dimensions come from the JPEG SOF, PNG IHDR, TIFF IFD or BMP header;
+other formats are estimated from their encoded size.
+"""
+from typing import Union, Optional
+from collections import deque
+import io
+import os
+import struct
+import asyncio
+
+
+# peak bytes per pixel of the pipeline (see module docstring)
+BYTES_PER_PIXEL = 8.0
+WAND_BYTES_PER_PIXEL = 8.0
+# unknown formats: footprint relative to the encoded size
+ENCODED_FACTOR = 40
+
+# JPEG start-of-frame markers (not DHT, JPG, DAC)
+_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+        0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _jpeg_size(fp) -> Optional[tuple[int, int, int]]:
+    fp.seek(2)
+    while True:
+        byte = fp.read(1)
+        while byte and byte != b'\xff':
+            byte = fp.read(1)
+        while byte == b'\xff':
+            byte = fp.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            # markers without a length
+            continue
+        if marker == 0xD9:
+            return None
+        header = fp.read(2)
+        if len(header) < 2:
+            return None
+        length = struct.unpack('>H', header)[0]
+        if marker in _SOF:
+            frame = fp.read(6)
+            if len(frame) < 6:
+                return None
+            _, height, width, channels = struct.unpack('>BHHB', frame)
+            return width, height, channels
+        fp.seek(length - 2, io.SEEK_CUR)
+
+
+def _png_size(fp) -> Optional[tuple[int, int, int]]:
+    fp.seek(16)
+    header = fp.read(10)
+    if len(header) < 10:
+        return None
+    width, height, _, color = struct.unpack('>IIBB', header)
+    channels = {0: 1, 2: 3, 3: 3, 4: 2, 6: 4}.get(color, 3)
+    return width, height, channels
+
+
+def _tiff_size(fp, order: str) -> Optional[tuple[int, int, int]]:
+    fp.seek(4)
+    offset = struct.unpack(order + 'I', fp.read(4))[0]
+    fp.seek(offset)
+    count = struct.unpack(order + 'H', fp.read(2))[0]
+    tags = {}
+    for _ in range(count):
+        entry = fp.read(12)
+        if len(entry) < 12:
+            break
+        tag, kind = struct.unpack(order + 'HH', entry[:4])
+        if kind == 3:
+            value = struct.unpack(order + 'H', entry[8:10])[0]
+        else:
+            value = struct.unpack(order + 'I', entry[8:12])[0]
+        tags[tag] = value
+    if 256 not in tags or 257 not in tags:
+        return None
+    return tags[256], tags[257], tags.get(277, 1)
+
+
+def _bmp_size(fp) -> Optional[tuple[int, int, int]]:
+    fp.seek(18)
+    header = fp.read(12)
+    if len(header) < 12:
+        return None
+    width, height, _, bits = struct.unpack('<iiHH', header)
+    return width, abs(height), max(bits // 8, 1)
+
+
+def read_dimensions(fp) -> Optional[tuple[int, int, int]]:
+    """read_dimensions.
+
+    (width, height, channels) from the header of an encoded image (a
+    binary file object), None if the format is unknown.
+    """
+    magic = fp.read(4)
+    try:
+        if magic[:2] == b'\xff\xd8':
+            return _jpeg_size(fp)
+        if magic == b'\x89PNG':
+            return _png_size(fp)
+        if magic == b'II*\x00':
+            return _tiff_size(fp, '<')
+        if magic == b'MM\x00*':
+            return _tiff_size(fp, '>')
+        if magic[:2] == b'BM':
+            return _bmp_size(fp)
+    except struct.error:
+        return None
+    return None
+
+
+def image_dimensions(source) -> Optional[tuple[int, int, int]]:
+    """image_dimensions.
+
+    Dimensions of an acta (file, archive member or bytes) reading only
+    its header.
+    """
+    data = getattr(source, 'data', source)
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return read_dimensions(io.BytesIO(data))
+    with open(source, 'rb') as fp:
+        return read_dimensions(fp)
+
+
+def footprint(
+    source,
+    in_memory: bool = True,
+    bytes_per_pixel: float = BYTES_PER_PIXEL
+) -> int:
+    """footprint.
+
+    Estimated peak memory (bytes) of processing an acta.
+    """
+    try:
+        dimensions = image_dimensions(source)
+    except OSError:
+        dimensions = None
+    if dimensions is None:
+        data = getattr(source, 'data', source)
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            size = len(data)
+        else:
+            try:
+                size = os.path.getsize(source)
+            except OSError:
+                return 0
+        return size * ENCODED_FACTOR
+    width, height, _ = dimensions
+    if not in_memory:
+        bytes_per_pixel += WAND_BYTES_PER_PIXEL
+    return int(width * height * bytes_per_pixel)
+
+
+def physical_memory() -> Optional[int]:
+    try:
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def parse_size(value: Union[str, int, None]) -> Optional[int]:
+    """parse_size.
+
+    Bytes of "512M", "8G", "70%" (of the physical memory) or a number;
+    None (no budget) if empty.
+    """
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    value = value.strip().upper()
+    if value.endswith('%'):
+        total = physical_memory()
+        if total is None:
+            return None
+        return int(total * float(value[:-1]) / 100)
+    units = {'K': 2**10, 'M': 2**20, 'G': 2**30, 'T': 2**40}
+    value = value.rstrip('B')
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(float(value))
+
+
+class MemoryBudget:
+    """MemoryBudget.
+
+    Admits actas (from the event loop) while the sum of their footprints
+    fits on the limit, in arrival order (a large acta is not starved by
+    smaller ones). An acta larger than the whole budget runs alone.
+    """
+    def __init__(self, limit: Union[int, str]) -> None:
+        self.limit = parse_size(limit)
+        if not self.limit:
+            raise ValueError(f"Invalid memory budget: {limit!r}")
+        self.used = 0
+        self.peak = 0
+        self.waits = 0
+        self._waiters: deque = deque()
+
+    def __repr__(self) -> str:
+        return (
+            f"<MemoryBudget {self.used / 2**20:.0f}/"
+            f"{self.limit / 2**20:.0f}MB>"
+        )
+
+    def _take(self, nbytes: int) -> None:
+        self.used += nbytes
+        self.peak = max(self.peak, self.used)
+
+    async def acquire(self, nbytes: int) -> int:
+        """acquire.
+
+        Wait until nbytes fit on the budget, returns the bytes taken
+        (to release).
+        """
+        nbytes = min(nbytes, self.limit)
+        if not self._waiters and self.used + nbytes <= self.limit:
+            self._take(nbytes)
+            return nbytes
+        self.waits += 1
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append((nbytes, waiter))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # admitted while being cancelled
+                self.release(nbytes)
+            else:
+                self._wake()
+            raise
+        return nbytes
+
+    def release(self, nbytes: int) -> None:
+        self.used -= nbytes
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters:
+            nbytes, waiter = self._waiters[0]
+            if waiter.done():
+                self._waiters.popleft()
+                continue
+            if self.used + nbytes > self.limit and self.used > 0:
+                break
+            self._waiters.popleft()
+            self._take(nbytes)
+            waiter.set_result(True)
+
+    def stats(self) -> dict:
+        return {
+            'limit': self.limit,
+            'used': self.used,
+            'peak': self.peak,
+            'waits': self.waits
+        }
+
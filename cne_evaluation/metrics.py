@@ -0,0 +1,205 @@
+"""
+Metrics.
+
+Tiempos por etapa, bytes procesados y fallas por motivo, exportables como
+resumen JSON y en formato de texto de Prometheus.
+"""
+from typing import Union
+from collections import Counter
+from contextlib import contextmanager
+import os
+import json
+import time
+import bisect
+import threading
+from pathlib import PurePath, Path
+
+
+# latency histogram buckets (seconds):
+BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+
+class Metrics:
+    """Metrics.
+
+    Thread-safe collector of stage durations (with a latency histogram),
+    byte counts, failures (by reason) and generic counters.
+    Snapshots from other processes can be merged (see BatchProcessor).
+    """
+    def __init__(self, prefix: str = 'cne') -> None:
+        self.prefix = prefix
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._stages: dict[str, dict] = {}
+        self.failures: Counter = Counter()
+        self.counters: Counter = Counter()
+
+    def _stage(self, name: str) -> dict:
+        stage = self._stages.get(name)
+        if stage is None:
+            stage = {
+                'count': 0,
+                'seconds': 0.0,
+                'max': 0.0,
+                'bytes': 0,
+                'buckets': [0] * (len(BUCKETS) + 1)
+            }
+            self._stages[name] = stage
+        return stage
+
+    def observe(self, name: str, seconds: float, nbytes: int = 0) -> None:
+        with self._lock:
+            stage = self._stage(name)
+            stage['count'] += 1
+            stage['seconds'] += seconds
+            stage['max'] = max(stage['max'], seconds)
+            stage['bytes'] += nbytes or 0
+            stage['buckets'][bisect.bisect_left(BUCKETS, seconds)] += 1
+
+    @contextmanager
+    def stage(self, name: str, nbytes: int = 0):
+        """stage.
+
+        Time a block of code as a pipeline stage.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, nbytes)
+
+    def failure(self, reason: str) -> None:
+        with self._lock:
+            self.failures[reason] += 1
+
+    def incr(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self.counters[name] += value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'stages': {
+                    name: {**s, 'buckets': list(s['buckets'])}
+                    for name, s in self._stages.items()
+                },
+                'failures': dict(self.failures),
+                'counters': dict(self.counters)
+            }
+
+    def merge(self, snapshot: dict) -> None:
+        """merge.
+
+        Add a snapshot (ex: from a worker process) to these metrics.
+        """
+        if not snapshot:
+            return
+        with self._lock:
+            for name, other in snapshot.get('stages', {}).items():
+                stage = self._stage(name)
+                stage['count'] += other['count']
+                stage['seconds'] += other['seconds']
+                stage['max'] = max(stage['max'], other['max'])
+                stage['bytes'] += other['bytes']
+                stage['buckets'] = [
+                    a + b for a, b in zip(stage['buckets'], other['buckets'])
+                ]
+            self.failures.update(snapshot.get('failures', {}))
+            self.counters.update(snapshot.get('counters', {}))
+
+    def summary(self) -> dict:
+        """summary.
+
+        Run summary (JSON-serializable).
+        """
+        snapshot = self.snapshot()
+        elapsed = time.time() - self.started
+        stages = {}
+        for name, stage in snapshot['stages'].items():
+            count = stage['count'] or 1
+            stages[name] = {
+                'count': stage['count'],
+                'total_s': stage['seconds'],
+                'mean_ms': stage['seconds'] / count * 1000,
+                'max_ms': stage['max'] * 1000,
+                'bytes': stage['bytes'],
+            }
+        processed = snapshot['counters'].get('actas', 0)
+        return {
+            'started': self.started,
+            'elapsed_s': elapsed,
+            'throughput': processed / elapsed if elapsed else 0.0,
+            'stages': stages,
+            'failures': snapshot['failures'],
+            'counters': snapshot['counters'],
+        }
+
+    def to_json(self, filename: Union[str, PurePath] = None) -> str:
+        data = json.dumps(self.summary(), indent=2)
+        if filename is not None:
+            _write_atomic(filename, data)
+        return data
+
+    def to_prometheus(self, filename: Union[str, PurePath] = None) -> str:
+        """to_prometheus.
+
+        Prometheus text exposition format (usable by the node_exporter
+        textfile collector when written to a file).
+        """
+        snapshot = self.snapshot()
+        p = self.prefix
+        lines = [
+            f"# HELP {p}_stage_seconds Duration of every pipeline stage.",
+            f"# TYPE {p}_stage_seconds histogram",
+        ]
+        for name, stage in sorted(snapshot['stages'].items()):
+            cumulative = 0
+            for bound, value in zip(BUCKETS, stage['buckets']):
+                cumulative += value
+                lines.append(
+                    f'{p}_stage_seconds_bucket{{stage="{name}",le="{bound}"}} '
+                    f'{cumulative}'
+                )
+            lines.append(
+                f'{p}_stage_seconds_bucket{{stage="{name}",le="+Inf"}} '
+                f'{stage["count"]}'
+            )
+            lines.append(
+                f'{p}_stage_seconds_sum{{stage="{name}"}} {stage["seconds"]}'
+            )
+            lines.append(
+                f'{p}_stage_seconds_count{{stage="{name}"}} {stage["count"]}'
+            )
+        lines += [
+            f"# HELP {p}_stage_bytes_total Bytes processed by every stage.",
+            f"# TYPE {p}_stage_bytes_total counter",
+        ]
+        for name, stage in sorted(snapshot['stages'].items()):
+            lines.append(
+                f'{p}_stage_bytes_total{{stage="{name}"}} {stage["bytes"]}'
+            )
+        lines += [
+            f"# HELP {p}_failures_total Failed actas by reason.",
+            f"# TYPE {p}_failures_total counter",
+        ]
+        for reason, value in sorted(snapshot['failures'].items()):
+            lines.append(f'{p}_failures_total{{reason="{reason}"}} {value}')
+        for name, value in sorted(snapshot['counters'].items()):
+            lines += [
+                f"# TYPE {p}_{name}_total counter",
+                f"{p}_{name}_total {value}",
+            ]
+        data = '\n'.join(lines) + '\n'
+        if filename is not None:
+            _write_atomic(filename, data)
+        return data
+
+
+def _write_atomic(filename: Union[str, PurePath], data: str) -> None:
+    filename = Path(filename)
+    tmp = filename.with_name(f".{filename.name}.tmp")
+    with open(tmp, 'w', encoding='utf-8') as fp:
+        fp.write(data)
+    os.replace(tmp, filename)
@@ -0,0 +1,527 @@
+"""
+Enhancement Pipeline.
+
+Pipeline declarativo de mejora de las actas: las etapas (métodos de
+ImageProcessor) se declaran en un perfil y se compilan una sola vez.
+
+A profile is a comma-separated list of stages with optional parameters:
+
+    grayscale, denoise(h=5), morph(size=3), sharpen(amount=1.0), crop
+
+Profiles live in the [enhance] section of etc/cne.ini (or any dict), the
+built-in ones are on PROFILES. Compiling a profile preallocates every
+kernel and fuses compatible stages: consecutive morphology stages share
+one kernel and redundant grayscale conversions are dropped (the output
+does not change).
+
+Consecutive linear filters can also become a single convolution
+(fuse_linear, opt-in): only kernels that can not saturate are fused
+(non-negative, summing to at most 1), the output still differs by the
+8-bit rounding between them and on the borders (extrapolated once).
+"""
+from typing import Union, Optional
+from collections.abc import Callable
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from functools import lru_cache
+import re
+import cv2
+import numpy as np
+
+
+PROFILES = {
+    # the historical behavior: sharpening and black borders removal
+    'default': 'sharpen, crop',
+    'light': 'crop',
+    'clean': 'grayscale, denoise(h=5), morph(size=3), sharpen, crop',
+    'contrast': 'grayscale, contrast, adaptive_sharpen(sigma=3), crop',
+    'dots': 'sharpen, crop, clean_dots(size=2)',
+}
+
+# kernel of ImageProcessor.sharpen_image
+SHARPEN_KERNEL = np.array(
+    [[0, -1, 0], [-1, 5, -1], [0, -1, 0]], dtype=np.float32
+)
+SHARPEN_KERNEL.flags.writeable = False
+
+
+@lru_cache(maxsize=None)
+def morph_kernel(size: int) -> np.ndarray:
+    """morph_kernel.
+
+    Square structuring element (shared and read-only).
+    """
+    kernel = np.ones((size, size), np.uint8)
+    kernel.flags.writeable = False
+    return kernel
+
+
+def _is_gray(image: np.ndarray) -> bool:
+    return len(image.shape) == 2 or image.shape[2] == 1
+
+
+def _to_gray(image: np.ndarray, dst: np.ndarray = None) -> np.ndarray:
+    if _is_gray(image):
+        return image
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=dst)
+
+
+def _scratch(processor, name: str, shape: tuple):
+    if processor is None:
+        return None
+    return processor.buffer(name, shape)
+
+
+@dataclass
+class Stage:
+    """Stage.
+
+    A compiled enhancement stage.
+    name: stage (or fused stages) name.
+    func: callable(image, processor, dst) -> image, dst is a reusable
+    output buffer (None: OpenCV allocates it).
+    metric: ImageProcessor stage where its duration is recorded.
+    gray: the output is always single-channel.
+    buffered: the stage writes a new image (crop returns a view).
+    kernel: correlation kernel of linear stages (can be fused).
+    anchor: (x, y) anchor of the kernel (its center, unless fused).
+    ops: morphology operations (stages sharing a kernel can be fused).
+    processor: the stage calls an ImageProcessor method.
+    """
+    name: str
+    func: Callable = None
+    metric: str = 'enhance'
+    gray: bool = False
+    buffered: bool = True
+    kernel: np.ndarray = None
+    anchor: tuple = None
+    ops: tuple = None
+    size: int = None
+    processor: bool = False
+    params: dict = field(default_factory=dict)
+
+    def __call__(
+        self, image: np.ndarray, processor=None, dst: np.ndarray = None
+    ) -> np.ndarray:
+        return self.func(image, processor, dst)
+
+
+def grayscale_stage() -> Stage:
+    return Stage(
+        'grayscale', lambda image, _, dst: _to_gray(image, dst), gray=True
+    )
+
+
+def contrast_stage() -> Stage:
+    # adjust_contrast (histogram equalization, grayscale only)
+    def contrast(image, processor, dst):
+        gray = _to_gray(image, _scratch(processor, 'contrast', image.shape[:2]))
+        return cv2.equalizeHist(gray, dst=dst)
+    return Stage('contrast', contrast, gray=True)
+
+
+def denoise_stage(h: float = 5) -> Stage:
+    # apply_noise_reduction
+    return Stage(
+        'denoise',
+        lambda image, _, dst: cv2.fastNlMeansDenoising(image, dst=dst, h=h),
+        params={'h': h}
+    )
+
+
+def _linear_stage(
+    name: str,
+    kernel: np.ndarray,
+    params: dict = None,
+    anchor: tuple = None
+) -> Stage:
+    kernel = np.ascontiguousarray(kernel, dtype=np.float32)
+    kernel.flags.writeable = False
+    if anchor is None:
+        # the filter2D default (also for even sizes)
+        anchor = (kernel.shape[1] // 2, kernel.shape[0] // 2)
+    return Stage(
+        name,
+        lambda image, _, dst: cv2.filter2D(
+            image, -1, kernel, dst=dst, anchor=anchor
+        ),
+        kernel=kernel,
+        anchor=anchor,
+        params=params or {}
+    )
+
+
+def sharpen_stage(amount: float = 1.0) -> Stage:
+    # sharpen_image: identity + amount * (negative laplacian)
+    if amount == 1.0:
+        kernel = SHARPEN_KERNEL
+    else:
+        kernel = np.array(
+            [[0, -amount, 0], [-amount, 1 + 4 * amount, -amount], [0, -amount, 0]]
+        )
+    return _linear_stage('sharpen', kernel, {'amount': amount})
+
+
+def filter_stage(kernel: str = '0 0 0; 0 1 0; 0 0 0') -> Stage:
+    # custom correlation kernel, rows separated by ';'
+    matrix = np.array(
+        [[float(v) for v in row.split()] for row in kernel.split(';')]
+    )
+    return _linear_stage('filter', matrix, {'kernel': kernel})
+
+
+def _unsharp(ksize: int, sigma: float, amount: float):
+    ksize = (int(ksize), int(ksize))
+
+    def unsharp(image, processor, dst):
+        blurred = cv2.GaussianBlur(
+            image, ksize, sigma, dst=_scratch(processor, 'blur', image.shape)
+        )
+        return cv2.addWeighted(image, amount, blurred, 1 - amount, 0, dst=dst)
+    return unsharp
+
+
+def adaptive_sharpen_stage(sigma: float = 3, amount: float = 1.5) -> Stage:
+    # apply_adaptive_sharpening
+    return Stage(
+        'adaptive_sharpen',
+        _unsharp(0, sigma, amount),
+        params={'sigma': sigma, 'amount': amount}
+    )
+
+
+def unsharp_stage(
+    ksize: int = 9, sigma: float = 10.0, amount: float = 1.5
+) -> Stage:
+    # unsharp_mask
+    return Stage(
+        'unsharp',
+        _unsharp(ksize, sigma, amount),
+        params={'ksize': ksize, 'sigma': sigma, 'amount': amount}
+    )
+
+
+def _morphology(ops: tuple, kernel: np.ndarray):
+    codes = tuple(MORPH_OPS[op] for op in ops)
+
+    def morphology(image, _, dst):
+        for code in codes:
+            image = cv2.morphologyEx(image, code, kernel, dst=dst)
+        return image
+    return morphology
+
+
+MORPH_OPS = {
+    'open': cv2.MORPH_OPEN,
+    'close': cv2.MORPH_CLOSE,
+    'erode': cv2.MORPH_ERODE,
+    'dilate': cv2.MORPH_DILATE,
+}
+
+
+def morph_stage(size: int = 3, ops: str = 'open close') -> Stage:
+    # apply_morphological_cleaning
+    ops = tuple(ops.replace('+', ' ').split())
+    unknown = [op for op in ops if op not in MORPH_OPS]
+    if unknown:
+        raise ValueError(f"Unknown morphology operations: {', '.join(unknown)}")
+    size = int(size)
+    return Stage(
+        'morph',
+        _morphology(ops, morph_kernel(size)),
+        ops=ops,
+        size=size,
+        params={'size': size, 'ops': ' '.join(ops)}
+    )
+
+
+def median_stage(ksize: int = 5) -> Stage:
+    ksize = int(ksize)
+    return Stage(
+        'median',
+        lambda image, _, dst: cv2.medianBlur(image, ksize, dst=dst),
+        params={'ksize': ksize}
+    )
+
+
+def clean_dots_stage(size: int = 2, threshold: int = 127) -> Stage:
+    # clean_black_dots
+    kernel = morph_kernel(int(size))
+
+    def clean_dots(image, processor, dst):
+        gray = _to_gray(image, _scratch(processor, 'dots_gray', image.shape[:2]))
+        _, binary = cv2.threshold(
+            gray, threshold, 255, cv2.THRESH_BINARY_INV, dst=dst
+        )
+        cv2.morphologyEx(binary, cv2.MORPH_OPEN, kernel, dst=binary)
+        cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel, dst=binary)
+        return cv2.bitwise_not(binary, dst=binary)
+    return Stage(
+        'clean_dots', clean_dots, gray=True,
+        params={'size': size, 'threshold': threshold}
+    )
+
+
+def blue_stage() -> Stage:
+    # remove_blue_artifacts (over a copy of the image)
+    def blue(image, processor, dst):
+        if dst is None:
+            dst = image.copy()
+        else:
+            np.copyto(dst, image)
+        return processor.remove_blue_artifacts(dst)
+    return Stage('blue', blue, processor=True)
+
+
+def binarize_stage(threshold: int = 0) -> Stage:
+    # threshold=0: Otsu
+    flags = cv2.THRESH_BINARY | (cv2.THRESH_OTSU if not threshold else 0)
+
+    def binarize(image, processor, dst):
+        gray = _to_gray(image, _scratch(processor, 'binarize', image.shape[:2]))
+        return cv2.threshold(gray, threshold, 255, flags, dst=dst)[1]
+    return Stage(
+        'binarize', binarize, gray=True, params={'threshold': threshold}
+    )
+
+
+def crop_stage() -> Stage:
+    # crop_black_borders (returns a view, nothing to allocate)
+    return Stage(
+        'crop',
+        lambda image, processor, _: processor.crop_black_borders(image),
+        metric='crop',
+        buffered=False,
+        processor=True
+    )
+
+
+STAGES: dict[str, Callable] = {
+    'grayscale': grayscale_stage,
+    'contrast': contrast_stage,
+    'denoise': denoise_stage,
+    'sharpen': sharpen_stage,
+    'filter': filter_stage,
+    'adaptive_sharpen': adaptive_sharpen_stage,
+    'unsharp': unsharp_stage,
+    'morph': morph_stage,
+    'median': median_stage,
+    'clean_dots': clean_dots_stage,
+    'blue': blue_stage,
+    'binarize': binarize_stage,
+    'crop': crop_stage,
+}
+
+_STAGE = re.compile(r'\s*(\w+)\s*(?:\(([^)]*)\))?\s*(?:,|$)')
+
+
+def _value(value: str):
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    return value.strip('\'"')
+
+
+def parse_profile(spec: str) -> list[tuple[str, dict]]:
+    """parse_profile.
+
+    Parse a profile ("sharpen(amount=1.5), crop") into (stage, params).
+    """
+    stages = []
+    position = 0
+    spec = spec.strip()
+    while position < len(spec):
+        match = _STAGE.match(spec, position)
+        if not match or match.end() == position:
+            raise ValueError(f"Invalid enhancement profile: {spec!r}")
+        name, arguments = match.groups()
+        if name not in STAGES:
+            raise ValueError(f"Unknown enhancement stage: {name}")
+        params = {}
+        for argument in (arguments or '').split(','):
+            if not argument.strip():
+                continue
+            key, _, value = argument.partition('=')
+            params[key.strip()] = _value(value.strip())
+        stages.append((name, params))
+        position = match.end()
+    return stages
+
+
+def _convolve(first: np.ndarray, second: np.ndarray) -> np.ndarray:
+    # applying the correlation kernels first and then second equals a
+    # single correlation with their full convolution (anchored on the sum
+    # of their anchors)
+    rows, cols = second.shape
+    fused = np.zeros(
+        (first.shape[0] + rows - 1, first.shape[1] + cols - 1), np.float32
+    )
+    for (y, x), value in np.ndenumerate(first):
+        fused[y:y + rows, x:x + cols] += value * second
+    return fused
+
+
+def _saturates(kernel: Optional[np.ndarray]) -> bool:
+    # a negative weight (or a gain) can clip the 8-bit output of the
+    # first filter, a single convolution would not
+    return kernel is None or kernel.min() < 0 or kernel.sum() > 1 + 1e-6
+
+
+def fuse_stages(stages: list[Stage], linear: bool = False) -> list[Stage]:
+    """fuse_stages.
+
+    Merge compatible neighbours: morphology with the same kernel,
+    grayscale conversions over single-channel output and, when linear is
+    set, linear filters that can not saturate (a single convolution,
+    without the 8-bit rounding between them).
+    """
+    fused: list[Stage] = []
+    gray = False
+    for stage in stages:
+        previous = fused[-1] if fused else None
+        if stage.name == 'grayscale' and gray:
+            continue
+        if (
+            linear and previous is not None
+            and not _saturates(previous.kernel)
+            and not _saturates(stage.kernel)
+        ):
+            fused[-1] = _linear_stage(
+                f"{previous.name}+{stage.name}",
+                _convolve(previous.kernel, stage.kernel),
+                anchor=(
+                    previous.anchor[0] + stage.anchor[0],
+                    previous.anchor[1] + stage.anchor[1]
+                )
+            )
+            continue
+        if (
+            previous is not None and previous.ops is not None
+            and stage.ops is not None and previous.size == stage.size
+        ):
+            ops = previous.ops + stage.ops
+            fused[-1] = Stage(
+                f"{previous.name}+{stage.name}",
+                _morphology(ops, morph_kernel(stage.size)),
+                ops=ops,
+                size=stage.size
+            )
+            continue
+        fused.append(stage)
+        gray = gray or stage.gray
+    return fused
+
+
+class EnhancementPipeline:
+    """EnhancementPipeline.
+
+    Compiled enhancement profile, callable over an image:
+        pipeline(image, processor)
+    every stage is timed with the ImageProcessor stage hook and, in
+    buffer-pool mode, writes into its own reusable output buffer.
+    Pickled as its profile: a worker process compiles it once (see
+    compile_pipeline) and reuses it for every acta.
+    Stages calling an ImageProcessor method (blue, crop) require the
+    processor.
+    """
+    def __init__(
+        self,
+        spec: str,
+        fuse: bool = True,
+        name: str = None,
+        fuse_linear: bool = False
+    ) -> None:
+        self.spec = spec
+        # profile name (None when declared inline)
+        self.name = name
+        self.fuse = fuse
+        self.fuse_linear = fuse_linear
+        self.declared = [
+            STAGES[stage](**params) for stage, params in parse_profile(spec)
+        ]
+        self.stages = self.declared
+        if fuse:
+            self.stages = fuse_stages(self.declared, linear=fuse_linear)
+        # the first stage drops color: callers can go single-channel early
+        self.grayscale = bool(self.stages) and self.stages[0].name == 'grayscale'
+
+    def __reduce__(self):
+        return (
+            compile_pipeline,
+            (self.spec, self.fuse, self.name, self.fuse_linear)
+        )
+
+    def __repr__(self) -> str:
+        stages = ', '.join(stage.name for stage in self.stages)
+        return f"<EnhancementPipeline {self.name or self.spec}: {stages}>"
+
+    def __call__(self, image: np.ndarray, processor=None) -> np.ndarray:
+        # buffered stages alternate between two page buffers (the rotated
+        # page is on page_a), a stage never writes over its own input
+        pages = ('page_b', 'page_a')
+        buffered = 0
+        if processor is None:
+            required = [stage.name for stage in self.stages if stage.processor]
+            if required:
+                raise ValueError(
+                    f"Enhancement stages {', '.join(required)} require an "
+                    "ImageProcessor"
+                )
+        for stage in self.stages:
+            dst = None
+            if processor is None:
+                context = nullcontext()
+            else:
+                context = processor.stage(stage.metric, image.nbytes)
+                if stage.buffered:
+                    shape = image.shape[:2] if stage.gray else image.shape
+                    dst = processor.buffer(pages[buffered % 2], shape)
+                    buffered += 1
+            with context:
+                image = stage(image, processor, dst)
+        return image
+
+
+@lru_cache(maxsize=32)
+def compile_pipeline(
+    spec: str, fuse: bool = True, name: str = None, fuse_linear: bool = False
+) -> EnhancementPipeline:
+    """compile_pipeline.
+
+    Compile a profile (cached: once per process).
+    """
+    return EnhancementPipeline(
+        spec, fuse=fuse, name=name, fuse_linear=fuse_linear
+    )
+
+
+def resolve_profile(profile: str, profiles: Optional[dict] = None) -> str:
+    """resolve_profile.
+
+    Profile definition from profiles (ex: the [enhance] section of
+    etc/cne.ini), the built-in PROFILES or, otherwise, profile itself.
+    """
+    if profiles and profiles.get(profile):
+        return profiles[profile]
+    return PROFILES.get(profile, profile)
+
+
+def get_pipeline(
+    profile: Union[str, EnhancementPipeline] = 'default',
+    profiles: Optional[dict] = None,
+    fuse: bool = True,
+    fuse_linear: bool = False
+) -> EnhancementPipeline:
+    """get_pipeline.
+
+    Return a compiled EnhancementPipeline from a profile name or a
+    declarative list of stages.
+    """
+    if isinstance(profile, EnhancementPipeline):
+        return profile
+    profile = profile or 'default'
+    spec = resolve_profile(profile, profiles)
+    name = profile if spec != profile else None
+    return compile_pipeline(spec, fuse, name, fuse_linear)
@@ -0,0 +1,258 @@
+"""
+QR Decode Cascade.
+
+Estrategias de pre-procesamiento del QR, de la más económica a la más
+costosa; se detiene en la primera que logra decodificar.
+"""
+from typing import Union, Optional
+from collections import Counter
+from collections.abc import Callable, Iterator
+import threading
+from contextlib import nullcontext
+from dataclasses import dataclass
+import cv2
+import numpy as np
+
+
+@dataclass
+class CascadeResult:
+    """CascadeResult.
+
+    data: decoded payload ('' if every strategy failed).
+    points: QR corners in ROI coordinates.
+    image: image (of the strategy) where the QR was detected.
+    image_points: QR corners in the coordinates of image.
+    strategy: name of the strategy that decoded the QR.
+    detected: a QR was located by some strategy (decoded or not).
+    """
+    data: str = ''
+    points: np.ndarray = None
+    image: np.ndarray = None
+    image_points: np.ndarray = None
+    strategy: str = None
+    detected: bool = False
+
+
+def _stage(processor, name: str, nbytes: int = 0):
+    # ImageProcessor stage hook (if any)
+    if processor is None:
+        return nullcontext()
+    return processor.stage(name, nbytes)
+
+
+IDENTITY = np.array([[1, 0, 0], [0, 1, 0]], dtype=np.float64)
+# blue ink range in HSV (as ImageProcessor.remove_blue_artifacts)
+BLUE_LOWER = np.array([90, 50, 50], dtype=np.uint8)
+BLUE_UPPER = np.array([130, 255, 255], dtype=np.uint8)
+
+
+def _buffer(processor, name: str, shape: tuple):
+    # reusable output of the ImageProcessor buffer pool (if any)
+    if processor is None:
+        return None
+    return processor.buffer(name, shape)
+
+
+def _gray(roi: np.ndarray, processor=None) -> np.ndarray:
+    if len(roi.shape) == 2 or roi.shape[2] == 1:
+        return roi
+    return cv2.cvtColor(
+        roi, cv2.COLOR_BGR2GRAY, dst=_buffer(processor, 'qr_gray', roi.shape[:2])
+    )
+
+
+def _without_blue(roi: np.ndarray, processor=None) -> np.ndarray:
+    # same HSV range as ImageProcessor.remove_blue_artifacts, not in-place
+    if len(roi.shape) == 2:
+        return roi
+    hsv = cv2.cvtColor(
+        roi, cv2.COLOR_BGR2HSV, dst=_buffer(processor, 'qr_hsv', roi.shape)
+    )
+    mask = cv2.inRange(
+        hsv, BLUE_LOWER, BLUE_UPPER,
+        dst=_buffer(processor, 'qr_mask', roi.shape[:2])
+    )
+    gray = _gray(roi, processor)
+    if gray is roi:
+        gray = gray.copy()
+    # blue pixels become white
+    return cv2.max(gray, mask, dst=gray)
+
+
+def _otsu(gray: np.ndarray, processor=None) -> np.ndarray:
+    _, binary = cv2.threshold(
+        gray, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU,
+        dst=_buffer(processor, 'qr_binary', gray.shape[:2])
+    )
+    return binary
+
+
+def gray_strategy(roi, processor=None) -> Iterator[tuple]:
+    yield _gray(roi, processor), IDENTITY
+
+
+def blue_strategy(roi, processor=None) -> Iterator[tuple]:
+    yield _without_blue(roi, processor), IDENTITY
+
+
+def binary_strategy(roi, processor=None) -> Iterator[tuple]:
+    yield _otsu(_without_blue(roi, processor), processor), IDENTITY
+
+
+def legacy_strategy(roi, processor=None) -> Iterator[tuple]:
+    # the original chain: blue removal, dot cleaning, median blur, sharpening
+    if processor is not None:
+        copy = processor.buffer('qr_roi', roi.shape)
+        if copy is None:
+            copy = roi.copy()
+        else:
+            np.copyto(copy, roi)
+        yield processor.preprocess_qr(copy), IDENTITY
+
+
+def denoise_strategy(roi, processor=None) -> Iterator[tuple]:
+    gray = _without_blue(roi, processor)
+    denoised = cv2.fastNlMeansDenoising(
+        gray, dst=_buffer(processor, 'qr_denoise', gray.shape), h=10
+    )
+    yield _otsu(denoised, processor), IDENTITY
+
+
+def upscale_strategy(roi, processor=None, scale: float = 2.0) -> Iterator[tuple]:
+    gray = _without_blue(roi, processor)
+    height, width = gray.shape[:2]
+    size = (int(round(width * scale)), int(round(height * scale)))
+    upscaled = cv2.resize(
+        gray, size,
+        dst=_buffer(processor, 'qr_upscale', (size[1], size[0])),
+        interpolation=cv2.INTER_CUBIC
+    )
+    yield _otsu(upscaled, processor), IDENTITY / scale
+
+
+def rotate_strategy(roi, processor=None) -> Iterator[tuple]:
+    gray = _without_blue(roi, processor)
+    height, width = gray.shape[:2]
+    # (rotation, matrix mapping rotated points back to the ROI)
+    rotations = (
+        (cv2.ROTATE_90_CLOCKWISE, [[0, 1, 0], [-1, 0, height - 1]]),
+        (cv2.ROTATE_180, [[-1, 0, width - 1], [0, -1, height - 1]]),
+        (cv2.ROTATE_90_COUNTERCLOCKWISE, [[0, -1, width - 1], [1, 0, 0]]),
+    )
+    for code, matrix in rotations:
+        shape = (height, width) if code == cv2.ROTATE_180 else (width, height)
+        rotated = cv2.rotate(
+            gray, code, dst=_buffer(processor, 'qr_rotated', shape)
+        )
+        yield rotated, np.array(matrix, dtype=np.float64)
+
+
+STRATEGIES: dict[str, Callable] = {
+    'gray': gray_strategy,
+    'blue': blue_strategy,
+    'binary': binary_strategy,
+    'legacy': legacy_strategy,
+    'denoise': denoise_strategy,
+    'upscale': upscale_strategy,
+    'rotate': rotate_strategy,
+}
+
+DEFAULT_CASCADE = (
+    'gray', 'blue', 'binary', 'legacy', 'upscale', 'rotate', 'denoise'
+)
+
+
+class DecodeCascade:
+    """DecodeCascade.
+
+    Tries every configured strategy (cheapest first) until the QR is
+    decoded, keeping hit statistics per strategy.
+    """
+    def __init__(
+        self,
+        strategies: Union[str, list, tuple] = DEFAULT_CASCADE
+    ) -> None:
+        if isinstance(strategies, str):
+            strategies = [s.strip() for s in strategies.split(',') if s.strip()]
+        unknown = [s for s in strategies if s not in STRATEGIES]
+        if unknown:
+            raise ValueError(
+                f"Unknown QR decode strategies: {', '.join(unknown)}"
+            )
+        self.strategies = tuple(strategies)
+        self.stats: Counter = Counter()
+        self._lock = threading.Lock()
+        # QRCodeDetector instances are not shared between threads
+        self._local = threading.local()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        del state['_local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def detector(self):
+        detector = getattr(self._local, 'detector', None)
+        if detector is None:
+            detector = cv2.QRCodeDetector()
+            self._local.detector = detector
+        return detector
+
+    def decode(self, roi: np.ndarray, processor=None) -> CascadeResult:
+        """decode.
+
+        Run the cascade over a QR region, stops at the first decode.
+        """
+        result = CascadeResult()
+        for name in self.strategies:
+            variants = STRATEGIES[name](roi, processor)
+            while True:
+                with _stage(processor, 'qr_preprocess', roi.nbytes):
+                    variant = next(variants, None)
+                if variant is None:
+                    break
+                image, matrix = variant
+                with _stage(processor, 'decode', image.nbytes):
+                    data, points, _ = self.detector.detectAndDecode(image)
+                result.image = image
+                if points is not None:
+                    result.detected = True
+                if data:
+                    result.data = data
+                    result.strategy = name
+                    if points is not None:
+                        result.image_points = points
+                        result.points = cv2.transform(
+                            points.reshape(-1, 1, 2).astype(np.float64),
+                            matrix
+                        ).reshape(-1, 2)
+                    self.record(name)
+                    return result
+        self.record(None)
+        return result
+
+    def record(self, strategy: Optional[str]) -> None:
+        with self._lock:
+            self.stats['attempts'] += 1
+            if strategy is None:
+                self.stats['misses'] += 1
+            else:
+                self.stats[strategy] += 1
+
+    def hit_rates(self) -> dict:
+        """hit_rates.
+
+        Fraction of the decode attempts solved by every strategy.
+        """
+        with self._lock:
+            attempts = self.stats['attempts'] or 1
+            return {
+                name: self.stats[name] / attempts
+                for name in (*self.strategies, 'misses')
+            }
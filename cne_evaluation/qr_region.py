@@ -0,0 +1,168 @@
+"""
+QR Region Prior.
+
+Aprende la ubicación del QR a partir de las actas decodificadas, para
+buscarlo solo en una región reducida de la página.
+"""
+from typing import Union, Optional
+from collections import deque
+import json
+import threading
+from pathlib import PurePath, Path
+import numpy as np
+from .logs import getLogger
+
+
+class QRRegionPrior:
+    """QRRegionPrior.
+
+    Cache of QR bounding boxes (relative to the page size) learned from
+    successful decodes. Boxes are grouped by template: first by page
+    resolution (bucketed), then clustered by position, so pages of
+    different templates with the same size learn separate regions.
+    """
+    def __init__(
+        self,
+        filename: Union[str, PurePath] = None,
+        margin: float = 0.25,
+        min_samples: int = 3,
+        bucket: int = 50,
+        history: int = 50
+    ) -> None:
+        self.filename = Path(filename) if filename else None
+        # margin around the learned box, relative to the box size
+        self.margin = margin
+        self.min_samples = min_samples
+        self.bucket = bucket
+        self.history = history
+        self._templates: dict[str, list[dict]] = {}
+        self._lock = threading.Lock()
+        self.logger = getLogger(
+            "CNE.QRRegionPrior"
+        )
+        if self.filename is not None and self.filename.exists():
+            self.load()
+
+    def __getstate__(self):
+        # locks can't be pickled (process pools)
+        state = self.__dict__.copy()
+        del state['_lock']
+        del state['logger']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self.logger = getLogger(
+            "CNE.QRRegionPrior"
+        )
+
+    def template_key(self, width: int, height: int) -> str:
+        bucket = self.bucket
+        return (
+            f"{int(round(width / bucket)) * bucket}"
+            f"x{int(round(height / bucket)) * bucket}"
+        )
+
+    def regions(self, width: int, height: int) -> list[tuple]:
+        """regions.
+
+        Return the learned search regions (x0, y0, x1, y1 in pixels) for
+        a page of the given size, most frequent template first.
+        """
+        key = self.template_key(width, height)
+        with self._lock:
+            clusters = [
+                c for c in self._templates.get(key, [])
+                if len(c['boxes']) >= self.min_samples
+            ]
+            clusters.sort(key=lambda c: c['hits'], reverse=True)
+            boxes = [np.median(np.array(c['boxes']), axis=0) for c in clusters]
+        regions = []
+        for x0, y0, x1, y1 in boxes:
+            mx = (x1 - x0) * self.margin
+            my = (y1 - y0) * self.margin
+            regions.append((
+                max(int((x0 - mx) * width), 0),
+                max(int((y0 - my) * height), 0),
+                min(int(np.ceil((x1 + mx) * width)), width),
+                min(int(np.ceil((y1 + my) * height)), height)
+            ))
+        return regions
+
+    def update(self, width: int, height: int, box: tuple) -> None:
+        """update.
+
+        Learn a QR bounding box (x0, y0, x1, y1 in pixels) decoded on a
+        page of the given size.
+        """
+        x0, y0, x1, y1 = box
+        relative = (x0 / width, y0 / height, x1 / width, y1 / height)
+        center = np.array(
+            [(relative[0] + relative[2]) / 2, (relative[1] + relative[3]) / 2]
+        )
+        size = max(relative[2] - relative[0], relative[3] - relative[1])
+        key = self.template_key(width, height)
+        with self._lock:
+            clusters = self._templates.setdefault(key, [])
+            for cluster in clusters:
+                cx0, cy0, cx1, cy1 = cluster['boxes'][-1]
+                other = np.array([(cx0 + cx1) / 2, (cy0 + cy1) / 2])
+                if np.linalg.norm(center - other) <= size:
+                    break
+            else:
+                cluster = {'hits': 0, 'boxes': deque(maxlen=self.history)}
+                clusters.append(cluster)
+            cluster['hits'] += 1
+            cluster['boxes'].append(relative)
+
+    def load(self) -> None:
+        with open(self.filename, 'r', encoding='utf-8') as fp:
+            data = json.load(fp)
+        with self._lock:
+            self._templates = {
+                key: [
+                    {
+                        'hits': c['hits'],
+                        'boxes': deque(
+                            [tuple(b) for b in c['boxes']],
+                            maxlen=self.history
+                        )
+                    } for c in clusters
+                ] for key, clusters in data.items()
+            }
+
+    def save(self, filename: Union[str, PurePath] = None) -> None:
+        filename = Path(filename) if filename else self.filename
+        if filename is None:
+            return
+        with self._lock:
+            data = {
+                key: [
+                    {'hits': c['hits'], 'boxes': list(c['boxes'])}
+                    for c in clusters
+                ] for key, clusters in self._templates.items()
+            }
+        with open(filename, 'w', encoding='utf-8') as fp:
+            json.dump(data, fp)
+        self.logger.debug(f"QR region prior saved to {filename}")
+
+
+def qr_bounding_box(points, offset: tuple = (0, 0)) -> Optional[tuple]:
+    """qr_bounding_box.
+
+    Axis-aligned bounding box (x0, y0, x1, y1) of the points returned by
+    QRCodeDetector, moved by the offset of the region.
+    """
+    if points is None:
+        return None
+    points = np.asarray(points).reshape(-1, 2)
+    x0, y0 = points.min(axis=0)
+    x1, y1 = points.max(axis=0)
+    ox, oy = offset
+    return (
+        max(int(x0), 0) + ox,
+        max(int(y0), 0) + oy,
+        int(np.ceil(x1)) + ox,
+        int(np.ceil(y1)) + oy
+    )
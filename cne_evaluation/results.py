@@ -0,0 +1,383 @@
+"""
+Result Sinks.
+
+Almacenamiento en lote de los resultados (QR decodificados) en SQLite,
+JSONL o Parquet, en lugar de un archivo .txt por acta.
+"""
+from typing import Union, Any
+import os
+import json
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import PurePath, Path
+from .logs import getLogger
+
+
+# pipeline stages timed by the ImageProcessor (see ImageProcessor.stage)
+STAGES = (
+    'read', 'triage', 'deskew', 'rotate', 'enhance', 'crop', 'write',
+    'qr_preprocess', 'decode'
+)
+
+# flat record layout (name, type) shared by every sink:
+FIELDS = (
+    ('path', str),
+    ('estado', str),
+    ('municipio', str),
+    ('parroquia', str),
+    ('data', str),
+    ('strategy', str),
+    ('angle', float),
+    ('qr_x0', int),
+    ('qr_y0', int),
+    ('qr_x1', int),
+    ('qr_y1', int),
+    ('elapsed', float),
+    ('error', str),
+) + tuple((f"time_{stage}", float) for stage in STAGES)
+
+
+def make_record(
+    relative_path: Union[str, PurePath],
+    filename: str,
+    data: str = None,
+    qr_box: tuple = None,
+    angle: float = None,
+    strategy: str = None,
+    elapsed: float = None,
+    error: str = None,
+    timings: dict = None
+) -> dict:
+    """make_record.
+
+    Build a result record; estado/municipio/parroquia come from the
+    relative path given by DirectoryIterator, timings (seconds per
+    stage) from the ImageProcessor.
+    """
+    timings = timings or {}
+    parts = PurePath(relative_path).parts
+    hierarchy = (list(parts[:3]) + [None] * 3)[:3]
+    x0, y0, x1, y1 = qr_box if qr_box else (None, None, None, None)
+    return {
+        'path': PurePath(relative_path).joinpath(filename).as_posix(),
+        'estado': hierarchy[0],
+        'municipio': hierarchy[1],
+        'parroquia': hierarchy[2],
+        'data': data or None,
+        'strategy': strategy,
+        'angle': None if angle is None else float(angle),
+        'qr_x0': x0,
+        'qr_y0': y0,
+        'qr_x1': x1,
+        'qr_y1': y1,
+        'elapsed': elapsed,
+        'error': error,
+        **{f"time_{stage}": timings.get(stage) for stage in STAGES}
+    }
+
+
+def add_columns(conn: sqlite3.Connection, table: str) -> None:
+    """add_columns.
+
+    Add the FIELDS missing on a results table (created by an older
+    version).
+    """
+    types = {str: 'TEXT', int: 'INTEGER', float: 'REAL'}
+    columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    for name, kind in FIELDS:
+        if name not in columns:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {types[kind]}")
+
+
+class ResultSink:
+    """ResultSink.
+
+    Buffers records and writes them in bulk from a background thread,
+    one batch at a time (writes never block the event loop).
+    """
+    suffixes: tuple = ()
+
+    def __init__(
+        self,
+        filename: Union[str, PurePath],
+        batch_size: int = 500
+    ) -> None:
+        self.filename = Path(filename)
+        self.batch_size = batch_size
+        self._buffer: list[dict] = []
+        self._pending: asyncio.Future = None
+        self._executor: ThreadPoolExecutor = None
+        self.written: int = 0
+        self.logger = getLogger(
+            f"CNE.{type(self).__name__}"
+        )
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def start(self):
+        if self.filename.parent.exists() is False:
+            self.filename.parent.mkdir(parents=True, exist_ok=True)
+        self._executor = ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix='cne_sink'
+        )
+        await self._run(self.open)
+
+    async def close(self):
+        await self.sync()
+        await self._run(self.shutdown)
+        self._executor.shutdown(wait=True)
+        self.logger.debug(
+            f"{self.written} records written to {self.filename}"
+        )
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    async def add(self, record: dict) -> None:
+        self._buffer.append(record)
+        if len(self._buffer) >= self.batch_size:
+            await self.flush()
+
+    async def flush(self) -> None:
+        """flush.
+
+        Hand the buffered records to the writer thread; only waits for
+        the previous batch (if still being written).
+        """
+        if not self._buffer:
+            return
+        if self._pending is not None:
+            await self._pending
+        records, self._buffer = self._buffer, []
+        self.written += len(records)
+        self._pending = asyncio.ensure_future(self._run(self.write, records))
+
+    @property
+    def synced(self) -> bool:
+        """synced.
+
+        True if every record added was written.
+        """
+        return not self._buffer and (
+            self._pending is None or self._pending.done()
+        )
+
+    async def sync(self) -> None:
+        """sync.
+
+        Flush and wait until every record is written.
+        """
+        await self.flush()
+        if self._pending is not None:
+            await self._pending
+            self._pending = None
+
+    def open(self) -> None:
+        pass
+
+    def write(self, records: list[dict]) -> None:
+        raise NotImplementedError()
+
+    def shutdown(self) -> None:
+        pass
+
+    @classmethod
+    def load(cls, filename: Union[str, PurePath]) -> list[dict]:
+        raise NotImplementedError()
+
+
+class SQLiteSink(ResultSink):
+    """SQLiteSink.
+
+    Results stored on a ``results`` table.
+    """
+    suffixes: tuple = ('.db', '.sqlite', '.sqlite3')
+    _types: dict = {str: 'TEXT', int: 'INTEGER', float: 'REAL'}
+
+    def open(self) -> None:
+        self._conn = sqlite3.connect(str(self.filename))
+        columns = ', '.join(
+            f"{name} {self._types[kind]}" for name, kind in FIELDS
+        )
+        self._conn.execute(f"CREATE TABLE IF NOT EXISTS results ({columns})")
+        add_columns(self._conn, 'results')
+        self._conn.commit()
+
+    def write(self, records: list[dict]) -> None:
+        names = [name for name, _ in FIELDS]
+        self._conn.executemany(
+            f"INSERT INTO results ({', '.join(names)}) "
+            f"VALUES ({', '.join('?' * len(names))})",
+            [tuple(r.get(n) for n in names) for r in records]
+        )
+        self._conn.commit()
+
+    def shutdown(self) -> None:
+        self._conn.close()
+
+    @classmethod
+    def load(cls, filename: Union[str, PurePath]) -> list[dict]:
+        conn = sqlite3.connect(str(filename))
+        try:
+            cursor = conn.execute("SELECT * FROM results")
+            names = [d[0] for d in cursor.description]
+            return [dict(zip(names, row)) for row in cursor.fetchall()]
+        finally:
+            conn.close()
+
+
+class JSONLSink(ResultSink):
+    """JSONLSink.
+
+    One JSON object per line (appended).
+    """
+    suffixes: tuple = ('.jsonl', '.ndjson')
+
+    def open(self) -> None:
+        self._fp = open(self.filename, 'a', encoding='utf-8')
+
+    def write(self, records: list[dict]) -> None:
+        self._fp.write(
+            ''.join(json.dumps(r, ensure_ascii=False) + '\n' for r in records)
+        )
+        self._fp.flush()
+
+    def shutdown(self) -> None:
+        self._fp.close()
+
+    @classmethod
+    def load(cls, filename: Union[str, PurePath]) -> list[dict]:
+        with open(filename, 'r', encoding='utf-8') as fp:
+            return [json.loads(line) for line in fp if line.strip()]
+
+
+class ParquetSink(ResultSink):
+    """ParquetSink.
+
+    Columnar storage (requires pyarrow), one row group per batch.
+
+    A Parquet file can not be appended: every batch is written to a part
+    file (``<file>.parts/``, complete once written) and the parts are
+    merged with the records of the previous runs when the sink is
+    closed. Parts left by an interrupted run are merged by the next one
+    (and read by load).
+    """
+    suffixes: tuple = ('.parquet',)
+
+    def open(self) -> None:
+        try:
+            import pyarrow as pa  # pylint: disable=C0415
+            import pyarrow.parquet as pq  # pylint: disable=C0415
+        except ImportError as exc:
+            raise ImportError(
+                "ParquetSink requires pyarrow: pip install pyarrow"
+            ) from exc
+        self._pa, self._pq = pa, pq
+        self._schema = self.schema()
+        self._parts = self.parts(self.filename)
+        self._parts.mkdir(exist_ok=True)
+        self._count = len(list(self._parts.glob('*.parquet')))
+
+    @staticmethod
+    def schema():
+        import pyarrow as pa  # pylint: disable=C0415
+        types = {str: pa.string(), int: pa.int32(), float: pa.float64()}
+        return pa.schema([(name, types[kind]) for name, kind in FIELDS])
+
+    @staticmethod
+    def parts(filename: Union[str, PurePath]) -> Path:
+        filename = Path(filename)
+        return filename.with_name(f"{filename.name}.parts")
+
+    def write(self, records: list[dict]) -> None:
+        table = self._pa.Table.from_pylist(records, schema=self._schema)
+        part = self._parts.joinpath(f"{self._count:08d}.parquet")
+        partial = part.with_suffix('.tmp')
+        self._pq.write_table(table, str(partial))
+        os.replace(partial, part)
+        self._count += 1
+
+    def shutdown(self) -> None:
+        parts = sorted(self._parts.glob('*.parquet'))
+        if not parts:
+            self._parts.rmdir()
+            return
+        merged = self.filename.with_name(f"{self.filename.name}.tmp")
+        with self._pq.ParquetWriter(str(merged), self._schema) as writer:
+            for table in self._tables(self.filename, parts):
+                writer.write_table(table)
+        os.replace(merged, self.filename)
+        for part in parts:
+            part.unlink()
+        self._parts.rmdir()
+
+    @classmethod
+    def _tables(cls, filename: Path, parts: list):
+        # row groups of the file (one at a time) and the parts, with the
+        # current schema (columns added since are null)
+        import pyarrow.parquet as pq  # pylint: disable=C0415
+        schema = cls.schema()
+        sources = [filename] if filename.exists() else []
+        for source in sources + list(parts):
+            with pq.ParquetFile(str(source)) as reader:
+                for index in range(reader.num_row_groups):
+                    yield _conform(reader.read_row_group(index), schema)
+
+    @classmethod
+    def load(cls, filename: Union[str, PurePath]) -> list[dict]:
+        import pyarrow as pa  # pylint: disable=C0415
+        filename = Path(filename)
+        parts = cls.parts(filename)
+        parts = sorted(parts.glob('*.parquet')) if parts.exists() else []
+        tables = list(cls._tables(filename, parts))
+        if not tables:
+            return []
+        return pa.concat_tables(tables).to_pylist()
+
+
+def _conform(table, schema):
+    import pyarrow as pa  # pylint: disable=C0415
+    columns = [
+        table.column(field.name).cast(field.type)
+        if field.name in table.column_names
+        else pa.nulls(table.num_rows, field.type)
+        for field in schema
+    ]
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+SINKS = (SQLiteSink, JSONLSink, ParquetSink)
+
+
+def _sink_class(filename: Union[str, PurePath]) -> type:
+    suffix = PurePath(filename).suffix.lower()
+    for sink in SINKS:
+        if suffix in sink.suffixes:
+            return sink
+    raise ValueError(
+        f"No result sink for {filename} (use .db, .jsonl or .parquet)"
+    )
+
+
+def get_sink(filename: Union[str, PurePath], **kwargs: Any) -> ResultSink:
+    """get_sink.
+
+    Return the sink for a file, chosen by its extension.
+    """
+    return _sink_class(filename)(filename, **kwargs)
+
+
+def load_results(filename: Union[str, PurePath]) -> list[dict]:
+    """load_results.
+
+    Load every result record of a sink file in a single bulk read.
+    """
+    return _sink_class(filename).load(filename)
@@ -0,0 +1,181 @@
+"""
+Synthetic Actas.
+
+Generador de actas sintéticas (con QR conocido) para pruebas y benchmarks,
+sin necesidad de actas reales.
+"""
+from typing import Union, Optional
+import json
+from dataclasses import dataclass, asdict, field
+from pathlib import PurePath, Path
+import cv2
+import numpy as np
+
+
+@dataclass
+class ActaSpec:
+    """ActaSpec.
+
+    Parameters of a synthetic acta (and its ground truth).
+    skew: clockwise tilt of the scan, in degrees.
+    blue_ink: number of blue pen strokes (signatures, stamps).
+    speckle: fraction of pixels flipped to black (scanner dust).
+    border: width of the black scanner borders, in inches.
+    """
+    payload: str
+    skew: float = 0.0
+    blue_ink: int = 0
+    speckle: float = 0.0
+    border: float = 0.0
+    dpi: int = 150
+    seed: int = 0
+    filename: str = None
+    extra: dict = field(default_factory=dict)
+
+
+def random_payload(rng: np.random.Generator, candidates: int = 10) -> str:
+    """random_payload.
+
+    QR payload with the layout of the actas: mesa code, votes per
+    candidate and two trailing counters.
+    """
+    mesa = (
+        f"{rng.integers(1, 25):02d}{rng.integers(1, 30):02d}"
+        f"{rng.integers(1, 20):02d}{rng.integers(1, 200):03d}"
+        f".{rng.integers(1, 10):02d}.1.{rng.integers(1, 9999):04d}"
+    )
+    votes = ','.join(str(v) for v in rng.integers(0, 300, size=candidates))
+    return f"{mesa}!{votes}!{rng.integers(0, 10)}!0"
+
+
+def encode_qr(payload: str, module: int) -> np.ndarray:
+    encoder = cv2.QRCodeEncoder.create()
+    qr = encoder.encode(payload)
+    return cv2.resize(
+        qr,
+        (qr.shape[1] * module, qr.shape[0] * module),
+        interpolation=cv2.INTER_NEAREST
+    )
+
+
+def render_acta(spec: ActaSpec) -> np.ndarray:
+    """render_acta.
+
+    Draw a letter-size acta (BGR) following spec: table of candidates,
+    QR in the bottom strip, then scan artifacts (blue ink, skew, speckle,
+    black borders).
+    """
+    rng = np.random.default_rng(spec.seed)
+    dpi = spec.dpi
+    width, height = int(8.5 * dpi), int(11 * dpi)
+    page = np.full((height, width, 3), 255, np.uint8)
+    scale = dpi / 100
+    thickness = max(int(round(scale)), 1)
+    # header:
+    cv2.putText(
+        page, "ACTA DE ESCRUTINIO", (int(width * 0.25), int(0.8 * dpi)),
+        cv2.FONT_HERSHEY_SIMPLEX, 1.2 * scale, (0, 0, 0), 2 * thickness
+    )
+    # table of candidates (horizontal rules help the deskew):
+    top, bottom = int(1.2 * dpi), int(height * 0.8)
+    left, right = int(0.5 * dpi), width - int(0.5 * dpi)
+    rows = 20
+    for idx, y in enumerate(np.linspace(top, bottom, rows + 1).astype(int)):
+        cv2.line(page, (left, y), (right, y), (0, 0, 0), thickness)
+        if idx < rows:
+            cv2.putText(
+                page, f"CANDIDATO {idx + 1:02d}  {rng.integers(0, 999)}",
+                (left + int(0.1 * dpi), y + int(0.28 * dpi)),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.6 * scale, (0, 0, 0), thickness
+            )
+    for x in (left, int(width * 0.6), right):
+        cv2.line(page, (x, top), (x, bottom), (0, 0, 0), thickness)
+    # QR code in the bottom strip (about 1.2 inches wide):
+    qr = encode_qr(spec.payload, 1)
+    module = max(int(1.2 * dpi / qr.shape[0]), 2)
+    qr = encode_qr(spec.payload, module)
+    qh, qw = qr.shape[:2]
+    qy = height - int(0.15 * dpi) - qh
+    qx = int(0.8 * dpi)
+    page[qy:qy + qh, qx:qx + qw] = qr[:, :, None]
+    # blue ink (signatures):
+    for _ in range(spec.blue_ink):
+        points = rng.integers(
+            (0, int(height * 0.6)), (width, height), size=(6, 2)
+        ).astype(np.int32)
+        cv2.polylines(
+            page, [points], False, (200, 60, 20), 2 * thickness
+        )
+    # skew (clockwise, white background as a flatbed scanner):
+    if spec.skew:
+        matrix = cv2.getRotationMatrix2D((width / 2, height / 2), -spec.skew, 1)
+        page = cv2.warpAffine(
+            page, matrix, (width, height), borderValue=(255, 255, 255)
+        )
+    # speckle noise:
+    if spec.speckle > 0:
+        mask = rng.random((height, width)) < spec.speckle
+        page[mask] = 0
+    # black borders:
+    if spec.border > 0:
+        border = int(spec.border * dpi)
+        page = cv2.copyMakeBorder(
+            page, border, border, border, border,
+            cv2.BORDER_CONSTANT, value=(0, 0, 0)
+        )
+    return page
+
+
+def generate_actas(
+    directory: Union[str, PurePath],
+    count: int = 20,
+    seed: int = 0,
+    dpi: Union[int, tuple] = 150,
+    max_skew: float = 3.0,
+    blue_ink: int = 3,
+    speckle: float = 0.001,
+    border: float = 0.1,
+    hierarchy: tuple = ('ESTADO SINTETICO', 'MP. PRUEBA', 'PQ. BENCHMARK'),
+    extension: str = '.jpg'
+) -> list[ActaSpec]:
+    """generate_actas.
+
+    Write count synthetic actas under directory/estado/municipio/parroquia
+    and a ground truth file (manifest.json) next to them.
+    """
+    rng = np.random.default_rng(seed)
+    directory = Path(directory)
+    target = directory.joinpath(*hierarchy)
+    target.mkdir(parents=True, exist_ok=True)
+    specs = []
+    for idx in range(count):
+        resolution = dpi
+        if isinstance(dpi, (tuple, list)):
+            resolution = int(dpi[idx % len(dpi)])
+        spec = ActaSpec(
+            payload=random_payload(rng),
+            skew=round(float(rng.uniform(-max_skew, max_skew)), 2),
+            blue_ink=int(rng.integers(0, blue_ink + 1)),
+            speckle=speckle,
+            border=border * float(rng.random()),
+            dpi=resolution,
+            seed=int(rng.integers(0, 2**31)),
+            filename=PurePath(*hierarchy, f"acta_{idx:05d}{extension}").as_posix()
+        )
+        cv2.imwrite(str(directory.joinpath(spec.filename)), render_acta(spec))
+        specs.append(spec)
+    with open(directory.joinpath('manifest.json'), 'w', encoding='utf-8') as fp:
+        json.dump([asdict(s) for s in specs], fp, indent=2)
+    return specs
+
+
+def load_specs(directory: Union[str, PurePath]) -> Optional[list[ActaSpec]]:
+    """load_specs.
+
+    Ground truth of a directory created by generate_actas.
+    """
+    filename = Path(directory).joinpath('manifest.json')
+    if not filename.exists():
+        return None
+    with open(filename, 'r', encoding='utf-8') as fp:
+        return [ActaSpec(**s) for s in json.load(fp)]
@@ -0,0 +1,255 @@
+"""
+Triage.
+
+Clasificación rápida de la calidad de cada acta para enviarla al nivel de
+procesamiento adecuado (rápido, estándar o restauración).
+
+Cheap metrics are computed on a subsampled copy of the scan, or of its
+reduced JPEG decode (blur and noise on the full resolution QR strip):
+    blur: variance of the Laplacian (low: out of focus).
+    contrast: spread between the dark (1%) and light (99%) levels.
+    noise: standard deviation of the noise (median of the Immerkaer
+    residual).
+    border: fraction of the outer frame that is black (scanner borders).
+    blue: fraction of pixels with blue ink (signatures, stamps).
+
+A blurred, faded or noisy acta goes to the heavy tier (ex: the "clean"
+profile, with fastNlMeansDenoising), an acta with scanner borders or
+blue ink to the standard tier (the configured profile) and a clean acta
+to the fast tier (ex: the "light" profile and the fast deskew preset).
+"""
+from typing import Union, Optional
+from dataclasses import dataclass, asdict, field
+import cv2
+import numpy as np
+from .qr_cascade import BLUE_LOWER, BLUE_UPPER
+from .pipeline import EnhancementPipeline, get_pipeline
+
+
+FAST = 'fast'
+STANDARD = 'standard'
+HEAVY = 'heavy'
+TIERS = (FAST, STANDARD, HEAVY)
+
+# enhancement profile and deskew preset of every tier ("profile:deskew",
+# empty: the profile and preset of the batch)
+DEFAULT_TIERS = 'fast=light:fast, standard=, heavy=clean:accurate'
+
+# blur, contrast: minimum (heavy below), noise: maximum (heavy above),
+# border, blue: maximum (standard above)
+DEFAULT_THRESHOLDS = {
+    'blur': 100.0,
+    'contrast': 80.0,
+    'noise': 3.0,
+    'border': 0.05,
+    'blue': 0.002,
+}
+
+# Immerkaer noise estimation kernel
+NOISE_KERNEL = np.array(
+    [[1, -2, 1], [-2, 4, -2], [1, -2, 1]], dtype=np.float32
+)
+NOISE_KERNEL.flags.writeable = False
+
+
+@dataclass
+class Quality:
+    """Quality.
+
+    Quality metrics of an acta (see module docstring).
+    """
+    blur: float
+    contrast: float
+    noise: float
+    border: float
+    blue: float
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def _is_gray(image: np.ndarray) -> bool:
+    return len(image.shape) == 2 or image.shape[2] == 1
+
+
+def measure(
+    image: np.ndarray,
+    max_side: int = 512,
+    area: float = 0.15,
+    reduced: np.ndarray = None
+) -> Quality:
+    """measure.
+
+    Quality metrics of a scan (BGR or grayscale). Contrast, border and
+    blue come from a copy subsampled to about max_side pixels (of
+    reduced, a reduced decode of the scan, if given); blur and noise
+    need the real resolution, they come from the bottom strip (area,
+    where the QR is).
+    """
+    height = image.shape[0]
+    strip = image[height - max(int(height * area), 3):]
+    if not _is_gray(strip):
+        strip = cv2.cvtColor(strip, cv2.COLOR_BGR2GRAY)
+    source = image if reduced is None else reduced
+    rows, cols = source.shape[:2]
+    step = max(-(-max(rows, cols) // max_side), 1)
+    # nearest neighbour: a subsample, not an average (fast)
+    small = cv2.resize(
+        source,
+        (max(cols // step, 1), max(rows // step, 1)),
+        interpolation=cv2.INTER_NEAREST
+    )
+    if _is_gray(small):
+        gray, blue = small, 0.0
+    else:
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+        blue = cv2.countNonZero(
+            cv2.inRange(hsv, BLUE_LOWER, BLUE_UPPER)
+        ) / gray.size
+    _, deviation = cv2.meanStdDev(cv2.Laplacian(strip, cv2.CV_16S))
+    blur = deviation[0, 0] ** 2
+    # noise: median of the residual (robust to the edges of the text)
+    residual = cv2.filter2D(strip, cv2.CV_16S, NOISE_KERNEL)[1:-1:2, 1:-1:2]
+    noise = 1.4826 * np.median(np.abs(residual)) / 6
+    # dark (ink) and light (paper) levels, from the histogram
+    histogram = np.cumsum(cv2.calcHist([gray], [0], None, [256], [0, 256]))
+    dark, light = np.searchsorted(histogram, (0.01 * gray.size, 0.99 * gray.size))
+    # outer frame (5% of every side)
+    rows, cols = gray.shape[:2]
+    bx, by = max(cols // 20, 1), max(rows // 20, 1)
+    frame = np.ones(gray.shape[:2], dtype=bool)
+    frame[by:-by, bx:-bx] = False
+    border = np.count_nonzero(gray[frame] < 50) / np.count_nonzero(frame)
+    return Quality(
+        blur=float(blur),
+        contrast=float(light - dark),
+        noise=float(noise),
+        border=float(border),
+        blue=float(blue)
+    )
+
+
+@dataclass
+class Tier:
+    """Tier.
+
+    Processing of a tier: enhancement profile and deskew preset (None:
+    the ones of the batch), enhance is the compiled profile.
+    """
+    name: str
+    profile: str = None
+    deskew: str = None
+    enhance: EnhancementPipeline = None
+
+
+def parse_tiers(spec: str) -> dict[str, Tier]:
+    """parse_tiers.
+
+    Parse "fast=light:fast, standard=, heavy=clean:accurate" (profiles
+    are names, see pipeline.PROFILES and the [enhance] section).
+    """
+    tiers = {name: Tier(name) for name in TIERS}
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        name, _, value = item.partition('=')
+        name = name.strip()
+        if name not in TIERS:
+            raise ValueError(f"Unknown triage tier: {name}")
+        profile, _, deskew = value.strip().partition(':')
+        tiers[name] = Tier(name, profile.strip() or None, deskew.strip() or None)
+    return tiers
+
+
+def parse_thresholds(spec: Union[str, dict, None]) -> dict[str, float]:
+    """parse_thresholds.
+
+    Thresholds over the defaults, ex: "blur=100, noise=8".
+    """
+    thresholds = dict(DEFAULT_THRESHOLDS)
+    if isinstance(spec, dict):
+        items = spec.items()
+    else:
+        items = [
+            item.partition('=')[::2] for item in (spec or '').split(',')
+            if item.strip()
+        ]
+    for name, value in items:
+        name = name.strip()
+        if name not in thresholds:
+            raise ValueError(f"Unknown triage metric: {name}")
+        thresholds[name] = float(value)
+    return thresholds
+
+
+@dataclass
+class TriagePolicy:
+    """TriagePolicy.
+
+    Routes every acta to a tier from its quality metrics.
+    """
+    tiers: dict[str, Tier] = field(
+        default_factory=lambda: parse_tiers(DEFAULT_TIERS)
+    )
+    thresholds: dict[str, float] = field(
+        default_factory=lambda: dict(DEFAULT_THRESHOLDS)
+    )
+    max_side: int = 512
+
+    @classmethod
+    def from_spec(
+        cls,
+        tiers: str = DEFAULT_TIERS,
+        thresholds: Union[str, dict] = None,
+        max_side: int = 512
+    ) -> 'TriagePolicy':
+        return cls(parse_tiers(tiers), parse_thresholds(thresholds), max_side)
+
+    def compile(self, profiles: Optional[dict] = None) -> 'TriagePolicy':
+        """compile.
+
+        Compile the profile of every tier (profiles: the [enhance]
+        section), before the policy is sent to the workers.
+        """
+        for tier in self.tiers.values():
+            if tier.profile:
+                tier.enhance = get_pipeline(tier.profile, profiles)
+        return self
+
+    def reasons(self, quality: Quality) -> tuple[str, list[str]]:
+        """reasons.
+
+        Tier of an acta and the metrics out of their thresholds.
+        """
+        limits = self.thresholds
+        heavy = [
+            name for name, bad in (
+                ('blur', quality.blur < limits['blur']),
+                ('contrast', quality.contrast < limits['contrast']),
+                ('noise', quality.noise > limits['noise']),
+            ) if bad
+        ]
+        if heavy:
+            return HEAVY, heavy
+        standard = [
+            name for name, bad in (
+                ('border', quality.border > limits['border']),
+                ('blue', quality.blue > limits['blue']),
+            ) if bad
+        ]
+        if standard:
+            return STANDARD, standard
+        return FAST, []
+
+    def route(
+        self, image: np.ndarray, area: float = 0.15, reduced: np.ndarray = None
+    ) -> tuple[Tier, Quality]:
+        """route.
+
+        Measure a scan (and its reduced decode, if any) and return its
+        tier.
+        """
+        quality = measure(image, self.max_side, area, reduced)
+        name, _ = self.reasons(quality)
+        return self.tiers[name], quality
@@ -0,0 +1,447 @@
+"""
+Watch.
+
+Procesar las actas a medida que llegan al directorio (modo demonio), con
+los workers siempre iniciados.
+
+The tree is watched with inotify (Linux, through libc) and rescanned
+periodically (network filesystems do not notify remote writes); without
+inotify it is polled. A new file is processed once its size and mtime
+did not change for ``settle`` seconds (partially written or still being
+copied actas are never read). The latency (first seen to decoded) of
+every acta is recorded as the ``latency`` stage of the metrics.
+"""
+from typing import Union, Optional
+from collections.abc import AsyncIterator
+import os
+import time
+import struct
+import signal
+import asyncio
+import ctypes
+import ctypes.util
+from pathlib import PurePath, Path
+from .logs import getLogger
+from .batch import BatchProcessor, BatchResult
+from .manifest import Manifest
+
+
+# inotify(7) event masks:
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF
+_EVENT = struct.Struct('iIII')
+
+
+class Inotify:
+    """Inotify.
+
+    Minimal inotify(7) binding (ctypes), non-blocking file descriptor.
+    """
+    def __init__(self) -> None:
+        libc = ctypes.CDLL(
+            ctypes.util.find_library('c') or 'libc.so.6', use_errno=True
+        )
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.watches: dict[int, str] = {}
+
+    def add_watch(self, path: str, mask: int = WATCH_MASK) -> int:
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        self.watches[wd] = path
+        return wd
+
+    def read(self) -> list[tuple[str, int]]:
+        """read.
+
+        Pending events as (path, mask).
+        """
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            directory = self.watches.get(wd)
+            if directory is None and not mask & IN_Q_OVERFLOW:
+                continue
+            path = os.path.join(directory, os.fsdecode(name)) if name else directory
+            events.append((path, mask))
+        return events
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def _inotify() -> Optional[Inotify]:
+    try:
+        return Inotify()
+    except (OSError, AttributeError) as exc:
+        # not Linux, or out of inotify instances
+        getLogger("CNE.TreeWatcher").warning(
+            f"inotify not available ({exc}), polling"
+        )
+        return None
+
+
+class TreeWatcher:
+    """TreeWatcher.
+
+    Candidate actas of a directory tree (new or modified files), from
+    inotify events and periodic scans.
+    interval: seconds between scans when polling.
+    rescan: seconds between safety scans when inotify is used.
+    """
+    def __init__(
+        self,
+        directory: Union[str, PurePath],
+        extensions: list = None,
+        use_inotify: bool = True,
+        interval: float = 2.0,
+        rescan: float = 300.0
+    ) -> None:
+        self.directory = Path(directory).resolve()
+        if extensions is None:
+            extensions = ('.jpg', '.jpeg', '.png')
+        self.ext = tuple(e.lower() for e in extensions)
+        self.interval = interval
+        self.rescan = rescan
+        self._inotify = _inotify() if use_inotify else None
+        self._queue: asyncio.Queue = None
+        self._snapshot: dict[str, tuple] = {}
+        self._scanner: asyncio.Task = None
+        # scans started by events (a reference keeps them alive)
+        self._tasks: set[asyncio.Task] = set()
+        self.logger = getLogger(
+            "CNE.TreeWatcher"
+        )
+
+    @property
+    def mode(self) -> str:
+        return 'inotify' if self._inotify is not None else 'polling'
+
+    async def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        if self._inotify is not None:
+            await loop.run_in_executor(None, self._watch_tree, str(self.directory))
+            loop.add_reader(self._inotify.fd, self._on_events)
+        self._scanner = asyncio.ensure_future(self._scan_loop())
+        self.logger.notice(
+            f"Watching {self.directory} ({self.mode})"
+        )
+
+    def close(self) -> None:
+        if self._scanner is not None:
+            self._scanner.cancel()
+        for task in self._tasks:
+            task.cancel()
+        if self._inotify is not None:
+            asyncio.get_running_loop().remove_reader(self._inotify.fd)
+            self._inotify.close()
+
+    async def get(self) -> str:
+        """get.
+
+        Wait for the next candidate file.
+        """
+        return await self._queue.get()
+
+    def _is_acta(self, path: str) -> bool:
+        name = os.path.basename(path)
+        # hidden names are temporary files of uploads (ex: rsync)
+        return not name.startswith('.') and name.lower().endswith(self.ext)
+
+    def _watch_tree(self, path: str) -> list[str]:
+        # watch path and its subdirectories, files already there are
+        # returned (they may have landed before the watch)
+        files = []
+        pending = [path]
+        while pending:
+            current = pending.pop()
+            try:
+                self._inotify.add_watch(current)
+                with os.scandir(current) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(entry.path)
+                        elif self._is_acta(entry.path):
+                            files.append(entry.path)
+            except OSError as exc:
+                self.logger.warning(f"Unable to watch {current}: {exc}")
+        return files
+
+    def _on_events(self) -> None:
+        for path, mask in self._inotify.read():
+            if mask & IN_Q_OVERFLOW:
+                self.logger.warning("inotify queue overflow, rescanning")
+                self._background(self.scan())
+            elif mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # a new (or moved-in) directory of actas, walked on a
+                    # thread (a large tree never blocks the events)
+                    self._background(self._watch_new(path))
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO) and self._is_acta(path):
+                self._queue.put_nowait(path)
+
+    def _background(self, coro) -> None:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _watch_new(self, path: str) -> None:
+        loop = asyncio.get_running_loop()
+        for filename in await loop.run_in_executor(None, self._watch_tree, path):
+            self._queue.put_nowait(filename)
+
+    async def _scan_loop(self) -> None:
+        interval = self.interval if self._inotify is None else self.rescan
+        while True:
+            await self.scan()
+            await asyncio.sleep(interval)
+
+    async def scan(self) -> None:
+        """scan.
+
+        Walk the tree, new or modified files are candidates.
+        """
+        loop = asyncio.get_running_loop()
+        snapshot = await loop.run_in_executor(None, self._walk)
+        for path, state in snapshot.items():
+            if self._snapshot.get(path) != state:
+                self._queue.put_nowait(path)
+        self._snapshot = snapshot
+
+    def _walk(self) -> dict[str, tuple]:
+        snapshot = {}
+        pending = [str(self.directory)]
+        while pending:
+            try:
+                with os.scandir(pending.pop()) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(entry.path)
+                        elif self._is_acta(entry.path):
+                            stat = entry.stat()
+                            snapshot[entry.path] = (
+                                stat.st_size, stat.st_mtime_ns
+                            )
+            except OSError as exc:
+                self.logger.warning(f"Unable to scan: {exc}")
+        return snapshot
+
+
+class WatchDaemon:
+    """WatchDaemon.
+
+    Long-running processing of the actas landing on directory: a warm
+    BatchProcessor (its pool is started once) is fed with every acta as
+    soon as its file is complete (stable for settle seconds).
+    """
+    def __init__(
+        self,
+        directory: Union[str, PurePath],
+        destination: Union[str, PurePath],
+        batch: BatchProcessor,
+        extensions: list = None,
+        manifest: Manifest = None,
+        settle: float = 1.0,
+        use_inotify: bool = True,
+        interval: float = 2.0,
+        rescan: float = 300.0,
+        metrics_every: float = 30.0,
+        metrics_json: Union[str, PurePath] = None,
+        metrics_prometheus: Union[str, PurePath] = None
+    ) -> None:
+        self.directory = Path(directory).resolve()
+        self.destination = Path(destination).resolve()
+        self.batch = batch
+        self.extensions = extensions
+        self.manifest = manifest
+        self.settle = settle
+        self.use_inotify = use_inotify
+        self.interval = interval
+        self.rescan = rescan
+        self.metrics_every = metrics_every
+        self.metrics_json = metrics_json
+        self.metrics_prometheus = metrics_prometheus
+        self.watcher: TreeWatcher = None
+        # debounce: path -> (size, mtime_ns, first seen, last change)
+        self._pending: dict[str, tuple] = {}
+        # submitted actas (size, mtime_ns), a new event with the same
+        # state is not processed again; with a manifest only the actas
+        # in-flight are kept (the manifest has the processed ones)
+        self._submitted: dict[str, tuple] = {}
+        self._arrivals: dict[str, float] = {}
+        self._ready: asyncio.Queue = None
+        self._stop: asyncio.Event = None
+        self.logger = getLogger(
+            "CNE.WatchDaemon"
+        )
+
+    def stop(self) -> None:
+        if self._stop is not None:
+            self._stop.set()
+
+    async def run(self) -> AsyncIterator[BatchResult]:
+        """run.
+
+        Process actas until stop() (or SIGINT/SIGTERM), yielding results.
+        """
+        loop = asyncio.get_running_loop()
+        self._ready = asyncio.Queue()
+        self._stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except (NotImplementedError, RuntimeError):
+                pass
+        await loop.run_in_executor(None, self.batch.warm)
+        self.watcher = TreeWatcher(
+            self.directory,
+            self.extensions,
+            use_inotify=self.use_inotify,
+            interval=self.interval,
+            rescan=self.rescan
+        )
+        await self.watcher.start()
+        tasks = [
+            asyncio.ensure_future(self._collect()),
+            asyncio.ensure_future(self._debounce()),
+            asyncio.ensure_future(self._export())
+        ]
+        try:
+            async for result in self.batch.run(self._items()):
+                self._done(result)
+                if self.manifest is not None:
+                    self.manifest.commit()
+                yield result
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.watcher.close()
+            self.export()
+
+    async def _collect(self) -> None:
+        while True:
+            path = await self.watcher.get()
+            if path not in self._pending:
+                self._pending[path] = (None, None, time.time(), time.monotonic())
+
+    async def _debounce(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(min(self.settle / 2, 0.5) or 0.1)
+            if not self._pending:
+                continue
+            states = await loop.run_in_executor(
+                None, _stat_all, list(self._pending)
+            )
+            now = time.monotonic()
+            for path, state in states.items():
+                size, mtime_ns, seen, changed = self._pending[path]
+                if state is None:
+                    # removed (or renamed) before being complete
+                    del self._pending[path]
+                elif state != (size, mtime_ns):
+                    self._pending[path] = (*state, seen, now)
+                elif now - changed >= self.settle and state[0] > 0:
+                    del self._pending[path]
+                    self._submit(path, state, seen)
+
+    def _submit(self, path: str, state: tuple, seen: float) -> None:
+        if self._submitted.get(path) == state:
+            return
+        image_path = Path(path)
+        relative_path = image_path.parent.relative_to(self.directory)
+        if self.manifest is not None and self._recorded(
+            Manifest.key(relative_path, image_path.name), image_path, state
+        ):
+            return
+        self._submitted[path] = state
+        self._arrivals[path] = seen
+        self._ready.put_nowait((
+            relative_path,
+            self.destination.joinpath(relative_path, image_path.name),
+            image_path
+        ))
+
+    def _recorded(self, key: str, image_path: Path, state: tuple) -> bool:
+        # decoded, or failed with the same file (failed actas are retried
+        # from the failure queue, not on every rescan)
+        if self.manifest.is_processed(key, image_path):
+            return True
+        row = self.manifest.get(key)
+        return row is not None and row['status'] == Manifest.FAILED and (
+            row['size'], row['mtime_ns']
+        ) == state
+
+    async def _items(self) -> AsyncIterator[tuple]:
+        while not self._stop.is_set():
+            getter = asyncio.ensure_future(self._ready.get())
+            stopper = asyncio.ensure_future(self._stop.wait())
+            done, _ = await asyncio.wait(
+                {getter, stopper}, return_when=asyncio.FIRST_COMPLETED
+            )
+            stopper.cancel()
+            if getter in done:
+                yield getter.result()
+            else:
+                getter.cancel()
+
+    def _done(self, result: BatchResult) -> None:
+        if self.manifest is not None:
+            # recorded on the manifest by the BatchProcessor
+            self._submitted.pop(str(result.source), None)
+        seen = self._arrivals.pop(str(result.source), None)
+        if seen is not None:
+            # from the first event of the file to its result
+            self.batch.metrics.observe('latency', time.time() - seen)
+
+    async def _export(self) -> None:
+        while True:
+            await asyncio.sleep(self.metrics_every)
+            self.export()
+
+    def export(self) -> None:
+        """export.
+
+        Write the metrics (JSON summary and Prometheus textfile).
+        """
+        if self.metrics_json:
+            self.batch.metrics.to_json(self.metrics_json)
+        if self.metrics_prometheus:
+            self.batch.metrics.to_prometheus(self.metrics_prometheus)
+
+
+def _stat_all(paths: list[str]) -> dict[str, Optional[tuple]]:
+    states = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            states[path] = (stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            states[path] = None
+    return states
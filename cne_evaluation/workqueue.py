@@ -0,0 +1,749 @@
+"""
+Work Queue.
+
+Cola de trabajo (SQLite en almacenamiento compartido) para procesar un
+árbol de actas con varios procesos o equipos, sin un broker externo.
+
+The coordinator splits the actas tree in shards (the estado/municipio
+directories, or single actas) and workers take time-limited leases on
+them: a lease is renewed while the shard is processed, expired leases
+(a worker that died) are re-queued, results of every worker are stored
+on the queue (one row per acta) and merged at the end.
+
+Usage:
+    cne queue coordinator queue.db /actas --depth 2
+    cne queue worker queue.db /actas /procesadas
+    cne queue local queue.db /actas /procesadas --nodes 4 \
+        --manifest Log/manifest.db --failures Log/failures.db
+    cne queue status queue.db
+"""
+from typing import Union, Optional
+from collections.abc import AsyncIterator, Iterable
+from dataclasses import dataclass
+from contextlib import contextmanager
+import os
+import time
+import uuid
+import socket
+import asyncio
+import sqlite3
+import threading
+import multiprocessing
+from pathlib import PurePath, Path
+from .logs import getLogger
+from .batch import BatchProcessor
+from .directories import DirectoryIterator
+from .manifest import Manifest
+from .results import FIELDS, ResultSink, add_columns, get_sink
+
+
+EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# kind of shard: a directory tree, the actas of a single directory (not
+# its subdirectories) or a single acta.
+TREE = 'tree'
+FILES = 'files'
+ACTA = 'acta'
+
+
+def find_shards(
+    directory: Union[str, PurePath],
+    depth: int = 2,
+    extensions: tuple = EXTENSIONS
+) -> list[tuple[str, str]]:
+    """find_shards.
+
+    (shard, kind) of an actas tree: the directories ``depth`` levels
+    below directory (ex: 2 = estado/municipio), and the actas found
+    above that level. depth=0 makes a shard of every acta.
+    """
+    directory = Path(directory)
+    extensions = tuple(e.lower() for e in extensions)
+    shards = []
+
+    def scan(path: Path, level: int):
+        subdirs, files = [], False
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.name.lower().endswith(extensions):
+                    files = True
+                    if depth == 0:
+                        shards.append((
+                            Path(entry.path).relative_to(directory).as_posix(),
+                            ACTA
+                        ))
+        relative = path.relative_to(directory).as_posix()
+        if depth and files:
+            shards.append((relative, FILES))
+        for subdir in sorted(subdirs):
+            if depth and level + 1 >= depth:
+                shards.append(
+                    (Path(subdir).relative_to(directory).as_posix(), TREE)
+                )
+            else:
+                scan(Path(subdir), level + 1)
+
+    scan(directory, 0)
+    return sorted(shards)
+
+
+@dataclass
+class Lease:
+    """Lease.
+
+    A shard taken by a worker until expires (unless renewed).
+    """
+    shard: str
+    kind: str
+    token: str
+    attempts: int
+    expires: float
+
+
+class WorkQueue:
+    """WorkQueue.
+
+    Shards and results on a SQLite file. Every operation is a short
+    transaction (BEGIN IMMEDIATE), so several processes or hosts can
+    share the file; the rollback journal is used instead of WAL (WAL
+    needs shared memory, not available across hosts).
+    """
+    PENDING: str = 'pending'
+    LEASED: str = 'leased'
+    DONE: str = 'done'
+    FAILED: str = 'failed'
+    _types: dict = {str: 'TEXT', int: 'INTEGER', float: 'REAL'}
+
+    def __init__(
+        self,
+        filename: Union[str, PurePath],
+        lease: float = 300.0,
+        max_attempts: int = 3,
+        timeout: float = 60.0
+    ) -> None:
+        self.filename = Path(filename)
+        if self.filename.parent.exists() is False:
+            self.filename.parent.mkdir(parents=True, exist_ok=True)
+        # seconds a shard is held without a renewal
+        self.lease = lease
+        # leases of a shard before it is marked as failed
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self.logger = getLogger(
+            "CNE.WorkQueue"
+        )
+        # autocommit: transactions are explicit (see _transaction)
+        self._conn = sqlite3.connect(
+            str(self.filename),
+            timeout=timeout,
+            isolation_level=None,
+            check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=DELETE")
+        columns = ', '.join(
+            f"{name} {self._types[kind]}" for name, kind in FIELDS
+            if name != 'path'
+        )
+        with self._transaction() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS shards (
+                    shard TEXT PRIMARY KEY,
+                    kind TEXT,
+                    status TEXT,
+                    owner TEXT,
+                    token TEXT,
+                    lease_until REAL,
+                    attempts INTEGER DEFAULT 0,
+                    actas INTEGER DEFAULT 0,
+                    decoded INTEGER DEFAULT 0,
+                    error TEXT,
+                    updated_at REAL
+                )"""
+            )
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS results "
+                f"(path TEXT PRIMARY KEY, {columns}, worker TEXT)"
+            )
+            add_columns(conn, 'results')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def enqueue(self, shards: Iterable[tuple[str, str]]) -> int:
+        """enqueue.
+
+        Add (shard, kind) items, shards already known keep their status
+        (a coordinator can be restarted).
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO shards "
+                "(shard, kind, status, updated_at) VALUES (?, ?, ?, ?)",
+                [(shard, kind, self.PENDING, now) for shard, kind in shards]
+            )
+            return conn.total_changes - before
+
+    def claim(self, worker: str) -> Optional[Lease]:
+        """claim.
+
+        Lease the next pending shard (or one whose lease expired).
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            self._expire(conn, now)
+            row = conn.execute(
+                "SELECT shard, kind, attempts FROM shards WHERE status = ? "
+                "ORDER BY attempts, shard LIMIT 1",
+                (self.PENDING,)
+            ).fetchone()
+            if row is None:
+                return None
+            shard, kind, attempts = row
+            lease = Lease(
+                shard=shard,
+                kind=kind,
+                token=uuid.uuid4().hex,
+                attempts=attempts + 1,
+                expires=now + self.lease
+            )
+            conn.execute(
+                "UPDATE shards SET status = ?, owner = ?, token = ?, "
+                "lease_until = ?, attempts = ?, updated_at = ? "
+                "WHERE shard = ?",
+                (
+                    self.LEASED, worker, lease.token, lease.expires,
+                    lease.attempts, now, shard
+                )
+            )
+        return lease
+
+    def renew(self, lease: Lease) -> bool:
+        """renew.
+
+        Extend the lease, False if it was lost (expired and re-queued).
+        """
+        now = time.time()
+        expires = now + self.lease
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE shards SET lease_until = ?, updated_at = ? "
+                "WHERE shard = ? AND token = ? AND status = ?",
+                (expires, now, lease.shard, lease.token, self.LEASED)
+            )
+        if cursor.rowcount == 1:
+            lease.expires = expires
+            return True
+        return False
+
+    def complete(self, lease: Lease, actas: int = 0, decoded: int = 0) -> bool:
+        """complete.
+
+        Mark the shard as done (only by the current lease holder).
+        """
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE shards SET status = ?, token = NULL, "
+                "lease_until = NULL, actas = ?, decoded = ?, error = NULL, "
+                "updated_at = ? WHERE shard = ? AND token = ? AND status = ?",
+                (
+                    self.DONE, actas, decoded, time.time(),
+                    lease.shard, lease.token, self.LEASED
+                )
+            )
+        return cursor.rowcount == 1
+
+    def fail(self, lease: Lease, error: str) -> None:
+        """fail.
+
+        Give the shard back (re-queued until max_attempts).
+        """
+        status = self.FAILED if lease.attempts >= self.max_attempts else self.PENDING
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE shards SET status = ?, token = NULL, "
+                "lease_until = NULL, error = ?, updated_at = ? "
+                "WHERE shard = ? AND token = ?",
+                (status, error, time.time(), lease.shard, lease.token)
+            )
+
+    def release(self, lease: Lease) -> None:
+        """release.
+
+        Give the shard back untouched (ex: the worker is stopping).
+        """
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE shards SET status = ?, token = NULL, "
+                "lease_until = NULL, attempts = attempts - 1, updated_at = ? "
+                "WHERE shard = ? AND token = ?",
+                (self.PENDING, time.time(), lease.shard, lease.token)
+            )
+
+    def requeue_expired(self) -> int:
+        """requeue_expired.
+
+        Re-queue the shards whose lease expired, returns their number.
+        """
+        with self._transaction() as conn:
+            return self._expire(conn, time.time())
+
+    def _expire(self, conn: sqlite3.Connection, now: float) -> int:
+        expired = conn.execute(
+            "SELECT shard, owner, attempts FROM shards "
+            "WHERE status = ? AND lease_until < ?",
+            (self.LEASED, now)
+        ).fetchall()
+        for shard, owner, attempts in expired:
+            status = self.FAILED if attempts >= self.max_attempts else self.PENDING
+            self.logger.warning(
+                f"Lease of {shard} by {owner} expired, shard {status}"
+            )
+            conn.execute(
+                "UPDATE shards SET status = ?, token = NULL, "
+                "lease_until = NULL, error = ?, updated_at = ? "
+                "WHERE shard = ?",
+                (status, f"Lease expired ({owner})", now, shard)
+            )
+        return len(expired)
+
+    def add_results(self, records: list[dict], worker: str = None) -> None:
+        """add_results.
+
+        Store result records (one row per acta: a shard processed again
+        replaces its previous results).
+        """
+        names = [name for name, _ in FIELDS]
+        updates = ', '.join(
+            f"{name} = excluded.{name}" for name in names[1:] + ['worker']
+        )
+        with self._transaction() as conn:
+            conn.executemany(
+                f"INSERT INTO results ({', '.join(names)}, worker) "
+                f"VALUES ({', '.join('?' * (len(names) + 1))}) "
+                f"ON CONFLICT(path) DO UPDATE SET {updates}",
+                [tuple(r.get(n) for n in names) + (worker,) for r in records]
+            )
+
+    def decoded(self, shard: str) -> set[str]:
+        """decoded.
+
+        Paths of the actas of shard already decoded (a re-leased shard
+        resumes from there).
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT path FROM results WHERE data IS NOT NULL "
+                "AND (path = ? OR path LIKE ? ESCAPE '\\')",
+                (shard, _like_prefix(shard))
+            )
+            return {row[0] for row in cursor.fetchall()}
+
+    def results(self) -> Iterable[dict]:
+        """results.
+
+        Every result record (merged from all the workers).
+        """
+        names = [name for name, _ in FIELDS]
+        with self._lock:
+            cursor = self._conn.execute(
+                f"SELECT {', '.join(names)} FROM results ORDER BY path"
+            )
+            rows = cursor.fetchall()
+        for row in rows:
+            yield dict(zip(names, row))
+
+    async def merge(self, sink: ResultSink) -> int:
+        """merge.
+
+        Write every result record to sink, returns the number of records.
+        """
+        count = 0
+        for record in self.results():
+            await sink.add(record)
+            count += 1
+        return count
+
+    def stats(self) -> dict:
+        """stats.
+
+        Number of shards by status, actas and decoded actas.
+        """
+        with self._lock:
+            stats = dict(self._conn.execute(
+                "SELECT status, COUNT(*) FROM shards GROUP BY status"
+            ).fetchall())
+            actas, decoded = self._conn.execute(
+                "SELECT COUNT(*), COUNT(data) FROM results"
+            ).fetchone()
+        stats['actas'] = actas
+        stats['decoded'] = decoded
+        return stats
+
+    def active(self) -> bool:
+        """active.
+
+        True while shards are pending or leased.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM shards WHERE status IN (?, ?)",
+                (self.PENDING, self.LEASED)
+            ).fetchone()
+        return row[0] > 0
+
+
+def _like_prefix(shard: str) -> str:
+    if shard in ('', '.'):
+        return '%'
+    escaped = shard.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"{escaped}/%"
+
+
+class QueueSink(ResultSink):
+    """QueueSink.
+
+    Result sink of a worker: records go to the WorkQueue.
+    """
+    def __init__(self, queue: WorkQueue, worker: str, batch_size: int = 100):
+        super().__init__(queue.filename, batch_size=batch_size)
+        self.queue = queue
+        self.worker = worker
+
+    def write(self, records: list[dict]) -> None:
+        self.queue.add_results(records, self.worker)
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class QueueWorker:
+    """QueueWorker.
+
+    Takes shards from the queue until none is left and processes them
+    with a BatchProcessor (its pool stays warm across shards).
+    """
+    def __init__(
+        self,
+        queue: WorkQueue,
+        directory: Union[str, PurePath],
+        destination: Union[str, PurePath],
+        extensions: tuple = EXTENSIONS,
+        worker: str = None,
+        poll: float = 5.0,
+        manifest: Manifest = None,
+        **options
+    ) -> None:
+        self.queue = queue
+        self.directory = Path(directory)
+        self.destination = Path(destination)
+        self.extensions = tuple(e.lower() for e in extensions)
+        self.worker = worker or worker_id()
+        # wait for leases of other workers (they may expire)
+        self.poll = poll
+        # actas already decoded (on any run) are skipped
+        self.manifest = manifest
+        # BatchProcessor options (executor, max_workers, in_memory...)
+        self.options = options
+        self.shards: int = 0
+        self.logger = getLogger(
+            "CNE.QueueWorker"
+        )
+
+    async def run(self, max_shards: int = None) -> int:
+        """run.
+
+        Process shards until the queue is done (or max_shards), returns
+        the number of shards completed.
+        """
+        sink = QueueSink(self.queue, self.worker)
+        async with sink, BatchProcessor(
+            sink=sink, manifest=self.manifest, **self.options
+        ) as batch:
+            while max_shards is None or self.shards < max_shards:
+                lease = await self._run(self.queue.claim, self.worker)
+                if lease is None:
+                    if not await self._run(self.queue.active):
+                        break
+                    await asyncio.sleep(self.poll)
+                    continue
+                await self.process(lease, batch, sink)
+        return self.shards
+
+    async def process(
+        self,
+        lease: Lease,
+        batch: BatchProcessor,
+        sink: QueueSink
+    ) -> None:
+        self.logger.info(
+            f"{self.worker}: shard {lease.shard} (attempt {lease.attempts})"
+        )
+        lost = asyncio.Event()
+        heartbeat = asyncio.ensure_future(self._heartbeat(lease, lost))
+        actas = decoded = 0
+        try:
+            async for result in batch.run(self.items(lease, lost)):
+                actas += 1
+                decoded += int(result.ok)
+            await sink.sync()
+        except Exception as exc:  # pylint: disable=W0718
+            self.logger.error(f"Shard {lease.shard} failed: {exc}")
+            await self._run(self.queue.fail, lease, f"{type(exc).__name__}: {exc}")
+            return
+        finally:
+            heartbeat.cancel()
+        if lost.is_set():
+            self.logger.warning(f"Lease of {lease.shard} lost, shard dropped")
+        elif await self._run(self.queue.complete, lease, actas, decoded):
+            self.shards += 1
+
+    async def items(self, lease: Lease, lost: asyncio.Event) -> AsyncIterator:
+        """items.
+
+        ``(relative_path, destination_path, image_path)`` of a shard,
+        relative to the actas tree (as the DirectoryIterator of the
+        whole tree would give them); stops if the lease is lost. Actas
+        decoded on the queue or on the manifest are skipped.
+        """
+        done = await self._run(self.queue.decoded, lease.shard)
+        shard = PurePath(lease.shard)
+        if lease.kind == TREE:
+            source = DirectoryIterator(
+                self.directory.joinpath(shard),
+                self.destination.joinpath(shard),
+                self.extensions
+            )
+            prefix = shard
+        else:
+            source = _aiter(self._files(shard, lease.kind))
+            prefix = PurePath()
+        async for relative_path, destination_path, image_path in source:
+            if lost.is_set():
+                break
+            relative_path = Path(prefix, relative_path)
+            key = relative_path.joinpath(image_path.name).as_posix()
+            if key in done:
+                continue
+            if self.manifest is not None and await self._run(
+                self.manifest.is_processed, key, image_path
+            ):
+                continue
+            yield relative_path, destination_path, image_path
+
+    def _files(self, shard: PurePath, kind: str) -> list[tuple]:
+        if kind == ACTA:
+            paths = [self.directory.joinpath(shard)]
+            relative_path = Path(shard.parent)
+        else:
+            relative_path = Path(shard)
+            paths = sorted(
+                path for path in self.directory.joinpath(shard).iterdir()
+                if path.name.lower().endswith(self.extensions)
+                and path.is_file()
+            )
+        destination = self.destination.joinpath(relative_path)
+        return [
+            (relative_path, destination.joinpath(path.name), path)
+            for path in paths
+        ]
+
+    async def _heartbeat(self, lease: Lease, lost: asyncio.Event) -> None:
+        while True:
+            await asyncio.sleep(self.queue.lease / 3)
+            if not await self._run(self.queue.renew, lease):
+                lost.set()
+                return
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, fn, *args)
+
+
+async def _aiter(iterable: Iterable):
+    for item in iterable:
+        yield item
+
+
+async def coordinate(
+    queue: WorkQueue,
+    directory: Union[str, PurePath],
+    depth: int = 2,
+    extensions: tuple = EXTENSIONS,
+    results: Union[str, PurePath] = None,
+    interval: float = 10.0,
+    enqueue: bool = True,
+    nodes: list = None
+) -> dict:
+    """coordinate.
+
+    Enqueue the shards of directory (unless already enqueued), re-queue
+    expired leases until every shard is done (or failed) and merge the
+    results on a sink. With the worker processes of this host (nodes),
+    stops if all of them exited.
+    """
+    logger = getLogger("CNE.Coordinator")
+    loop = asyncio.get_running_loop()
+    if enqueue:
+        await loop.run_in_executor(
+            None, enqueue_tree, queue, directory, depth, extensions
+        )
+    while await loop.run_in_executor(None, queue.active):
+        if nodes is not None and not any(node.is_alive() for node in nodes):
+            logger.error("Every worker exited, shards left on the queue")
+            break
+        await asyncio.sleep(interval)
+        await loop.run_in_executor(None, queue.requeue_expired)
+        logger.info(f"Queue: {queue.stats()}")
+    if results is not None:
+        async with get_sink(results) as sink:
+            count = await queue.merge(sink)
+        logger.notice(f"{count} results merged on {results}")
+    return queue.stats()
+
+
+def enqueue_tree(
+    queue: WorkQueue,
+    directory: Union[str, PurePath],
+    depth: int = 2,
+    extensions: tuple = EXTENSIONS
+) -> int:
+    """enqueue_tree.
+
+    Walk directory once and enqueue its shards, returns the new ones.
+    """
+    shards = find_shards(directory, depth, extensions)
+    added = queue.enqueue(shards)
+    getLogger("CNE.Coordinator").notice(
+        f"{len(shards)} shards ({added} new) on {queue.filename}"
+    )
+    return added
+
+
+def _worker_process(queue_file, directory, destination, extensions, options):
+    # the manifest and the failure queue are shared by every worker (as
+    # the queue: rollback journal), a write transaction per acta (none is
+    # held across actas)
+    manifest, use_hash = options.pop('manifest'), options.pop('use_hash')
+    if manifest is not None:
+        manifest = Manifest(
+            manifest, use_hash=use_hash, commit_every=1,
+            journal_mode='DELETE', timeout=60.0
+        )
+    failures = options.pop('failures')
+    if failures is not None:
+        from .failures import FailureQueue  # pylint: disable=C0415
+        failures = FailureQueue(
+            failures, commit_every=1, journal_mode='DELETE', timeout=60.0
+        )
+    artifacts, encoders = options.pop('artifacts'), options.pop('encoders')
+    if artifacts is not None or encoders is not None:
+        from .artifacts import ArtifactPolicy  # pylint: disable=C0415
+        artifacts = ArtifactPolicy(artifacts or 'all', encoders)
+
+    async def run():
+        with WorkQueue(queue_file, lease=options.pop('lease')) as queue:
+            worker = QueueWorker(
+                queue, directory, destination, extensions,
+                manifest=manifest,
+                failures=failures,
+                artifacts=artifacts,
+                **options
+            )
+            return await worker.run()
+    try:
+        return asyncio.run(run())
+    finally:
+        if failures is not None:
+            failures.close()
+        if manifest is not None:
+            manifest.close()
+
+
+def run(options) -> int:
+    """run.
+
+    Sharded processing of an actas tree (cne queue): coordinator,
+    worker, local (both on this host) or status of the queue.
+    """
+    queue = WorkQueue(options.queue, lease=options.lease)
+    if options.action == 'status':
+        print(queue.stats())
+        return 0
+    extensions = tuple(
+        options.extensions.split(',')
+    ) if options.extensions else EXTENSIONS
+    if options.action == 'coordinator':
+        stats = asyncio.run(coordinate(
+            queue, options.directory, options.depth, extensions,
+            options.results, options.interval
+        ))
+        print(stats)
+        return 0 if not stats.get(WorkQueue.FAILED) else 1
+    batch = {
+        'executor': options.executor,
+        'max_workers': options.max_workers,
+        'in_memory': options.in_memory,
+        'enhance': options.enhance,
+        'manifest': options.manifest,
+        'use_hash': options.use_hash,
+        'failures': options.failures,
+        'artifacts': options.artifacts,
+        'encoders': options.encoders,
+        'lease': options.lease,
+        'logdir': Path(options.logdir) if options.logdir else None
+    }
+    if options.action == 'worker':
+        shards = _worker_process(
+            options.queue, options.directory, options.destination,
+            extensions, batch
+        )
+        print(f"{shards} shards processed")
+        return 0
+    # local: shards are enqueued (a single walk) before the workers start
+    enqueue_tree(queue, options.directory, options.depth, extensions)
+    nodes = [
+        multiprocessing.Process(
+            target=_worker_process,
+            args=(
+                options.queue, options.directory, options.destination,
+                extensions, dict(batch)
+            )
+        )
+        for _ in range(options.nodes)
+    ]
+    for node in nodes:
+        node.start()
+    stats = asyncio.run(coordinate(
+        queue, options.directory, options.depth, extensions,
+        options.results, min(options.interval, options.lease / 3),
+        enqueue=False, nodes=nodes
+    ))
+    for node in nodes:
+        node.join()
+    print(stats)
+    return 0 if not stats.get(WorkQueue.FAILED) else 1
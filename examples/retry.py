@@ -0,0 +1,82 @@
+"""
+Reintentar sólo las actas que fallaron (FAILURES_FILE), con parámetros
+más costosos (RETRY_PROFILE).
+"""
+import asyncio
+from pathlib import Path
+from navconfig.conf import (
+    DIRECTORIO_LOG,
+    BATCH_EXECUTOR,
+    BATCH_WORKERS,
+    BATCH_MAX_PENDING,
+    BATCH_TIMEOUT,
+    PROCESS_IN_MEMORY,
+    PROCESS_BUFFER_POOL,
+    MEMORY_BUDGET,
+    ENHANCE_PROFILES,
+    MANIFEST_FILE,
+    MANIFEST_USE_HASH,
+    QR_REGION_FILE,
+    FAILURES_FILE,
+    RETRY_PROFILE,
+    RETRY_REASONS,
+    RETRY_MAX_ATTEMPTS,
+    RESULTS_FILE,
+    TOTALS_FILE,
+    ARTIFACT_POLICY,
+    ARTIFACT_ENCODERS,
+    ARTIFACT_BACKGROUND
+)
+from cne_evaluation.batch import BatchProcessor
+from cne_evaluation.manifest import Manifest
+from cne_evaluation.failures import FailureQueue, retry_options
+from cne_evaluation.qr_region import QRRegionPrior
+from cne_evaluation.results import get_sink
+from cne_evaluation.aggregate import VoteTable
+from cne_evaluation.artifacts import ArtifactPolicy
+
+async def retry_failures():
+    """Procesa de nuevo las actas fallidas (las decodificadas salen de la cola).
+    """
+    manifest = Manifest(MANIFEST_FILE, use_hash=MANIFEST_USE_HASH)
+    failures = FailureQueue(FAILURES_FILE)
+    print(f"Fallidas por causa: {failures.stats()}")
+    # parámetros del reintento (accurate, clean, toda la cascada):
+    settings = retry_options(RETRY_PROFILE)
+    decoded = failed = 0
+    async with get_sink(RESULTS_FILE) as sink, BatchProcessor(
+        executor=BATCH_EXECUTOR,
+        max_workers=BATCH_WORKERS,
+        max_pending=BATCH_MAX_PENDING,
+        timeout=BATCH_TIMEOUT * 2 if BATCH_TIMEOUT else None,
+        in_memory=PROCESS_IN_MEMORY,
+        buffers=PROCESS_BUFFER_POOL,
+        memory_budget=MEMORY_BUDGET,
+        profiles=ENHANCE_PROFILES,
+        manifest=manifest,
+        prior=QRRegionPrior(QR_REGION_FILE),
+        artifacts=ArtifactPolicy(
+            ARTIFACT_POLICY, ARTIFACT_ENCODERS, background=ARTIFACT_BACKGROUND
+        ),
+        sink=sink,
+        failures=failures,
+        logdir=Path(DIRECTORIO_LOG),
+        **settings
+    ) as batch:
+        items = failures.items(RETRY_REASONS, RETRY_MAX_ATTEMPTS)
+        async for result in batch.run(items):
+            if result.ok:
+                decoded += 1
+                print(result.data)
+            else:
+                failed += 1
+                print(f"{result.source}: {result.reason} ({result.error})")
+    print(f"Recuperadas: {decoded}, siguen fallando: {failed}")
+    # los totales se recalculan con los resultados recuperados:
+    VoteTable.from_results(RESULTS_FILE).save(TOTALS_FILE)
+    print(f"Fallidas por causa: {failures.stats()}")
+    failures.close()
+    manifest.close()
+
+if __name__ == "__main__":
+    asyncio.run(retry_failures())
@@ -7,35 +7,152 @@ from navconfig.conf import (
     DIRECTORIO_ACTAS,
     DIRECTORIO_ACTAS_PROCESADAS,
     EXTENSION_ACTAS,
-    DIRECTORIO_LOG
+    ARCHIVO_STRIP_COMPONENTS,
+    DIRECTORIO_LOG,
+    BATCH_EXECUTOR,
+    BATCH_WORKERS,
+    BATCH_MAX_PENDING,
+    BATCH_TIMEOUT,
+    PROCESS_IN_MEMORY,
+    PROCESS_BUFFER_POOL,
+    MEMORY_BUDGET,
+    PROCESS_REDUCED_ANALYSIS,
+    DESKEW_PRESET,
+    ENHANCE_PROFILE,
+    ENHANCE_PROFILES,
+    TUNED_PROFILE,
+    TRIAGE_ACTAS,
+    TRIAGE_TIERS,
+    TRIAGE_THRESHOLDS,
+    MANIFEST_FILE,
+    MANIFEST_USE_HASH,
+    DEDUP_ACTAS,
+    DEDUP_FILE,
+    DEDUP_DISTANCE,
+    DEDUP_REPORT,
+    QR_REGION_FILE,
+    FAILURES_FILE,
+    QR_CASCADE,
+    RESULTS_FILE,
+    TOTALS_FILE,
+    ARTIFACT_POLICY,
+    ARTIFACT_ENCODERS,
+    ARTIFACT_BACKGROUND,
+    METRICS_JSON,
+    METRICS_PROMETHEUS
 )
 from cne_evaluation.directories import DirectoryIterator
-from cne_evaluation.images import ImageProcessor
+from cne_evaluation.archives import ArchiveIterator, is_archive
+from cne_evaluation.batch import BatchProcessor, source_name
+from cne_evaluation.manifest import Manifest
+from cne_evaluation.failures import FailureQueue
+from cne_evaluation.qr_region import QRRegionPrior
+from cne_evaluation.results import get_sink
+from cne_evaluation.aggregate import VoteTable
+from cne_evaluation.artifacts import ArtifactPolicy
+from cne_evaluation.triage import TriagePolicy
+from cne_evaluation.autotune import load_tuned
+from cne_evaluation.dedup import DedupIndex
 
 async def process_images(directory, destination, extensions):
     """_summary_
 
     Args:
-        directory (str): directory where images resides.
+        directory (str): directory (or .zip/.tar archive) where images resides.
         extensions (list): List of available extensions.
     """
-    dir_iterator = DirectoryIterator(directory, destination, extensions)
-    async for _, destination_path, image_path in dir_iterator:
-        # 1.- crear directorio (si no existe)
-        dir_iterator.make_dir(destination_path)
-        # 2.- Invocar al procesador de imágenes:
-        async with ImageProcessor(
-            image_path,
-            destination_path,
-            logdir=Path(DIRECTORIO_LOG)
-        ) as img:
-            # Procesar la imagen y optimizarla
-            img.process_image()
-            # 3.- extraer la información del QR
-            # ahora, extraer el QR como imagen y el dato del QR en texto
-            #    QR Code:
-            data, qr_code = await img.extract_qr()
-            print(data)
+    # las actas ya decodificadas (y sin cambios) se omiten:
+    manifest = Manifest(MANIFEST_FILE, use_hash=MANIFEST_USE_HASH)
+    # actas fallidas y su causa (se reintentan con examples/retry.py):
+    failures = FailureQueue(FAILURES_FILE)
+    if is_archive(directory):
+        # las actas se leen directamente del .zip/.tar(.gz)
+        dir_iterator = ArchiveIterator(
+            directory, destination, extensions, manifest=manifest,
+            strip_components=ARCHIVO_STRIP_COMPONENTS
+        )
+    else:
+        dir_iterator = DirectoryIterator(
+            directory, destination, extensions, manifest=manifest
+        )
+    # parámetros ajustados para el lote (ver cne_evaluation.autotune):
+    tuned = load_tuned(TUNED_PROFILE) if TUNED_PROFILE else {}
+    # copias de una misma acta y mesas con QR distintos:
+    dedup = DedupIndex(DEDUP_FILE, DEDUP_DISTANCE) if DEDUP_ACTAS else None
+    # totales de votos (por estado, municipio y parroquia), parten de los
+    # resultados ya guardados (las actas omitidas por el manifest):
+    votes = VoteTable.from_results(RESULTS_FILE) if Path(
+        RESULTS_FILE
+    ).exists() else VoteTable()
+    total = await dir_iterator.count()
+    print(f"Actas por procesar: {total}")
+    # 1.- Crear el pool de procesamiento (procesos o hilos)
+    #     los resultados se guardan en lote (SQLite, JSONL o Parquet)
+    async with get_sink(RESULTS_FILE) as sink, BatchProcessor(
+        executor=BATCH_EXECUTOR,
+        max_workers=BATCH_WORKERS,
+        max_pending=BATCH_MAX_PENDING,
+        timeout=BATCH_TIMEOUT,
+        in_memory=PROCESS_IN_MEMORY,
+        buffers=PROCESS_BUFFER_POOL,
+        memory_budget=MEMORY_BUDGET,
+        reduced_analysis=PROCESS_REDUCED_ANALYSIS,
+        deskew=tuned.get('deskew', DESKEW_PRESET),
+        enhance=tuned.get('enhance', ENHANCE_PROFILE),
+        tolerance=tuned.get('tolerance', 0.4),
+        area=tuned.get('area', 0.15),
+        profiles=ENHANCE_PROFILES,
+        triage=TriagePolicy.from_spec(
+            TRIAGE_TIERS, TRIAGE_THRESHOLDS
+        ) if TRIAGE_ACTAS else None,
+        manifest=manifest,
+        prior=QRRegionPrior(QR_REGION_FILE),
+        cascade=tuned.get('cascade', QR_CASCADE),
+        artifacts=ArtifactPolicy(
+            ARTIFACT_POLICY, ARTIFACT_ENCODERS, background=ARTIFACT_BACKGROUND
+        ),
+        sink=sink,
+        failures=failures,
+        dedup=dedup,
+        logdir=Path(DIRECTORIO_LOG)
+    ) as batch:
+        # 2.- Cada acta se rota, optimiza y se extrae su QR en un worker:
+        async for result in batch.run(dir_iterator):
+            if result.error:
+                print(f"{result.source}: {result.error}")
+            else:
+                print(result.data)
+                votes.add(
+                    result.relative_path, result.data, source_name(result.source)
+                )
+    votes.save(TOTALS_FILE)
+    print(f"Mesas totalizadas: {len(votes)}, votos: {votes.national.tolist()}")
+    print(
+        f"Omitidas: {dir_iterator.skipped}, Estado: {manifest.stats()}, "
+        f"Estrategias QR: {dict(batch.stats)}"
+    )
+    if TRIAGE_ACTAS:
+        tiers = {
+            name[5:]: count for name, count in batch.metrics.counters.items()
+            if name.startswith('tier_')
+        }
+        print(f"Niveles de procesamiento: {tiers}")
+    if batch.memory is not None:
+        print(f"Memoria: {batch.memory.stats()}")
+    print(f"Fallidas por causa: {failures.stats()}")
+    # 3.- Métricas por etapa (JSON y Prometheus)
+    batch.metrics.to_json(METRICS_JSON)
+    batch.metrics.to_prometheus(METRICS_PROMETHEUS)
+    if dedup is not None:
+        report = dedup.report(DEDUP_REPORT)
+        print(
+            f"Duplicadas: {len(report['exact_duplicates'])}, "
+            f"similares: {len(report['near_duplicates'])}, "
+            f"mesas en conflicto: {len(report['conflicts'])}"
+        )
+        dedup.close()
+    failures.close()
+    manifest.close()
 
 if __name__ == "__main__":
     asyncio.run(
@@ -0,0 +1,136 @@
+"""
+Procesar las actas a medida que llegan a DIRECTORIO_ACTAS (modo demonio).
+"""
+import time
+import asyncio
+from pathlib import Path
+from navconfig.conf import (
+    DIRECTORIO_ACTAS,
+    DIRECTORIO_ACTAS_PROCESADAS,
+    EXTENSION_ACTAS,
+    DIRECTORIO_LOG,
+    BATCH_EXECUTOR,
+    BATCH_WORKERS,
+    BATCH_MAX_PENDING,
+    BATCH_TIMEOUT,
+    PROCESS_IN_MEMORY,
+    PROCESS_BUFFER_POOL,
+    MEMORY_BUDGET,
+    PROCESS_REDUCED_ANALYSIS,
+    DESKEW_PRESET,
+    ENHANCE_PROFILE,
+    ENHANCE_PROFILES,
+    TUNED_PROFILE,
+    TRIAGE_ACTAS,
+    TRIAGE_TIERS,
+    TRIAGE_THRESHOLDS,
+    MANIFEST_FILE,
+    MANIFEST_USE_HASH,
+    QR_REGION_FILE,
+    FAILURES_FILE,
+    QR_CASCADE,
+    RESULTS_FILE,
+    TOTALS_FILE,
+    ARTIFACT_POLICY,
+    ARTIFACT_ENCODERS,
+    ARTIFACT_BACKGROUND,
+    WATCH_SETTLE,
+    WATCH_INOTIFY,
+    WATCH_INTERVAL,
+    WATCH_RESCAN,
+    METRICS_JSON,
+    METRICS_PROMETHEUS
+)
+from cne_evaluation.batch import BatchProcessor, source_name
+from cne_evaluation.manifest import Manifest
+from cne_evaluation.failures import FailureQueue
+from cne_evaluation.qr_region import QRRegionPrior
+from cne_evaluation.results import get_sink
+from cne_evaluation.aggregate import VoteTable
+from cne_evaluation.artifacts import ArtifactPolicy
+from cne_evaluation.triage import TriagePolicy
+from cne_evaluation.autotune import load_tuned
+from cne_evaluation.watch import WatchDaemon
+
+async def watch_images(directory, destination, extensions):
+    """Procesa cada acta nueva de directory (hasta Ctrl+C / SIGTERM).
+
+    Args:
+        directory (str): directory where images arrive.
+        extensions (list): List of available extensions.
+    """
+    manifest = Manifest(MANIFEST_FILE, use_hash=MANIFEST_USE_HASH)
+    # actas fallidas y su causa (se reintentan con examples/retry.py):
+    failures = FailureQueue(FAILURES_FILE)
+    # parámetros ajustados para el lote (ver cne_evaluation.autotune):
+    tuned = load_tuned(TUNED_PROFILE) if TUNED_PROFILE else {}
+    # los totales parten de los resultados ya guardados:
+    votes = VoteTable.from_results(RESULTS_FILE) if Path(
+        RESULTS_FILE
+    ).exists() else VoteTable()
+    saved = 0
+    # el pool de workers se inicia una sola vez (queda en memoria):
+    async with get_sink(RESULTS_FILE) as sink, BatchProcessor(
+        executor=BATCH_EXECUTOR,
+        max_workers=BATCH_WORKERS,
+        max_pending=BATCH_MAX_PENDING,
+        timeout=BATCH_TIMEOUT,
+        in_memory=PROCESS_IN_MEMORY,
+        buffers=PROCESS_BUFFER_POOL,
+        memory_budget=MEMORY_BUDGET,
+        reduced_analysis=PROCESS_REDUCED_ANALYSIS,
+        deskew=tuned.get('deskew', DESKEW_PRESET),
+        enhance=tuned.get('enhance', ENHANCE_PROFILE),
+        tolerance=tuned.get('tolerance', 0.4),
+        area=tuned.get('area', 0.15),
+        profiles=ENHANCE_PROFILES,
+        triage=TriagePolicy.from_spec(
+            TRIAGE_TIERS, TRIAGE_THRESHOLDS
+        ) if TRIAGE_ACTAS else None,
+        manifest=manifest,
+        prior=QRRegionPrior(QR_REGION_FILE),
+        cascade=tuned.get('cascade', QR_CASCADE),
+        artifacts=ArtifactPolicy(
+            ARTIFACT_POLICY, ARTIFACT_ENCODERS, background=ARTIFACT_BACKGROUND
+        ),
+        sink=sink,
+        failures=failures,
+        logdir=Path(DIRECTORIO_LOG)
+    ) as batch:
+        daemon = WatchDaemon(
+            directory,
+            destination,
+            batch,
+            extensions=extensions,
+            manifest=manifest,
+            settle=WATCH_SETTLE,
+            use_inotify=WATCH_INOTIFY,
+            interval=WATCH_INTERVAL,
+            rescan=WATCH_RESCAN,
+            metrics_json=METRICS_JSON,
+            metrics_prometheus=METRICS_PROMETHEUS
+        )
+        # las métricas incluyen la latencia (llegada -> QR decodificado)
+        async for result in daemon.run():
+            if result.error:
+                print(f"{result.source}: {result.error}")
+            else:
+                print(result.data)
+                votes.add(
+                    result.relative_path, result.data, source_name(result.source)
+                )
+                if time.monotonic() - saved > WATCH_INTERVAL:
+                    votes.save(TOTALS_FILE)
+                    saved = time.monotonic()
+    votes.save(TOTALS_FILE)
+    failures.close()
+    manifest.close()
+
+if __name__ == "__main__":
+    asyncio.run(
+        watch_images(
+            DIRECTORIO_ACTAS,
+            DIRECTORIO_ACTAS_PROCESADAS,
+            EXTENSION_ACTAS
+        )
+    )
@@ -4,6 +4,7 @@ Settings Configuration for CNE
 Basic Configuration.
 """
 import sys
+from pathlib import Path
 from navconfig.logging import logging
 from navconfig import config, BASE_DIR
 
@@ -21,3 +22,113 @@ DIRECTORIO_LOG = config.get(
 )
 EXTENSION_ACTAS = config.get('EXTENSION_ACTAS')
 EXTENSION_ACTAS = EXTENSION_ACTAS.split(',')
+# DIRECTORIO_ACTAS puede ser un archivo .zip/.tar(.gz): las actas se leen
+# sin extraerlas, omitiendo los primeros directorios de cada ruta:
+ARCHIVO_STRIP_COMPONENTS = config.getint('ARCHIVO_STRIP_COMPONENTS', fallback=0)
+
+# procesamiento en lote (batch):
+BATCH_EXECUTOR = config.get('BATCH_EXECUTOR', fallback='process')
+BATCH_WORKERS = config.getint('BATCH_WORKERS', fallback=None)
+BATCH_MAX_PENDING = config.getint('BATCH_MAX_PENDING', fallback=None)
+BATCH_TIMEOUT = config.getint('BATCH_TIMEOUT', fallback=None)
+# decodificar una sola vez y rotar en memoria (sin Wand):
+PROCESS_IN_MEMORY = config.getboolean('PROCESS_IN_MEMORY', fallback=False)
+# reutilizar los arreglos de trabajo entre actas (menos memoria por worker):
+PROCESS_BUFFER_POOL = config.getboolean('PROCESS_BUFFER_POOL', fallback=False)
+# memoria máxima de las actas en proceso (ej: 8G, 512M o 70% de la RAM),
+# cada acta se admite según su tamaño (vacío: sin límite):
+MEMORY_BUDGET = config.get('MEMORY_BUDGET', fallback='')
+# estimar la inclinación sobre una decodificación reducida del JPEG (1/4 o
+# 1/8), sin decodificar el acta completa antes de rotarla con Wand:
+PROCESS_REDUCED_ANALYSIS = config.getboolean(
+    'PROCESS_REDUCED_ANALYSIS', fallback=False
+)
+# estimador de inclinación: fast, balanced, accurate (o hough, hough_p, projection)
+DESKEW_PRESET = config.get('DESKEW_PRESET', fallback='balanced')
+# perfil de mejora de las actas (nombre o lista de etapas), los perfiles
+# se declaran en la sección [enhance] de etc/cne.ini:
+ENHANCE_PROFILE = config.get('ENHANCE_PROFILE', fallback='default')
+ENHANCE_PROFILES = config.section('enhance')
+# parámetros ajustados por lote de escáner (python -m cne_evaluation.autotune),
+# reemplazan DESKEW_PRESET, ENHANCE_PROFILE y QR_CASCADE:
+TUNED_PROFILE = config.get('TUNED_PROFILE', fallback='')
+# clasificación de calidad de cada acta (nitidez, contraste, ruido, bordes
+# y tinta azul): nivel rápido, estándar o de restauración, con su perfil
+# de mejora y estimador de inclinación (perfil:estimador):
+TRIAGE_ACTAS = config.getboolean('TRIAGE_ACTAS', fallback=False)
+TRIAGE_TIERS = config.get(
+    'TRIAGE_TIERS',
+    fallback='fast=light:fast, standard=, heavy=clean:accurate'
+)
+# umbrales, ej: blur=100, contrast=80, noise=3, border=0.05, blue=0.002
+TRIAGE_THRESHOLDS = config.get('TRIAGE_THRESHOLDS', fallback='')
+# índice de actas procesadas (reanudar corridas):
+MANIFEST_FILE = config.get('MANIFEST_FILE') or Path(
+    DIRECTORIO_LOG
+).joinpath('manifest.db')
+MANIFEST_USE_HASH = config.getboolean('MANIFEST_USE_HASH', fallback=False)
+# actas duplicadas: las copias exactas no se procesan de nuevo, las
+# similares (distancia de Hamming del hash perceptual) se reportan, igual
+# que las mesas con QR distintos:
+DEDUP_ACTAS = config.getboolean('DEDUP_ACTAS', fallback=False)
+DEDUP_FILE = config.get('DEDUP_FILE') or Path(
+    DIRECTORIO_LOG
+).joinpath('dedup.db')
+DEDUP_DISTANCE = config.getint('DEDUP_DISTANCE', fallback=4)
+DEDUP_REPORT = config.get('DEDUP_REPORT') or Path(
+    DIRECTORIO_LOG
+).joinpath('duplicates.json')
+# actas que fallaron, con su causa (read_error, no_lines, qr_not_found,
+# qr_undecodable, timeout, error), para reintentarlas (examples/retry.py):
+FAILURES_FILE = config.get('FAILURES_FILE') or Path(
+    DIRECTORIO_LOG
+).joinpath('failures.db')
+# parámetros del reintento (perfil ajustado, ver TUNED_PROFILE), vacío:
+# estimador accurate, perfil clean, área del QR mayor y toda la cascada
+RETRY_PROFILE = config.get('RETRY_PROFILE', fallback='')
+# causas que se reintentan (vacío: todas) y número máximo de intentos:
+RETRY_REASONS = [
+    reason.strip() for reason in
+    config.get('RETRY_REASONS', fallback='').split(',') if reason.strip()
+]
+RETRY_MAX_ATTEMPTS = config.getint('RETRY_MAX_ATTEMPTS', fallback=3)
+# región aprendida del QR (se busca primero alrededor de ella):
+QR_REGION_FILE = config.get('QR_REGION_FILE') or Path(
+    DIRECTORIO_LOG
+).joinpath('qr_region.json')
+# estrategias de decodificación del QR (de la más económica a la más costosa):
+QR_CASCADE = config.get(
+    'QR_CASCADE',
+    fallback='gray,blue,binary,legacy,upscale,rotate,denoise'
+)
+# almacenamiento de resultados (.db, .jsonl o .parquet):
+RESULTS_FILE = config.get('RESULTS_FILE') or Path(
+    DIRECTORIO_LOG
+).joinpath('results.db')
+# totales de votos por estado, municipio y parroquia (se actualizan con
+# cada acta decodificada):
+TOTALS_FILE = config.get('TOTALS_FILE') or Path(
+    DIRECTORIO_LOG
+).joinpath('totals.json')
+# archivos de salida por acta: all, failures, minimal (o por artefacto,
+# ej: image=failure, bottom=never, qr_code=always, data=always)
+ARTIFACT_POLICY = config.get('ARTIFACT_POLICY', fallback='all')
+# formato de cada imagen, ej: image=jpg:85, bottom=webp:80, qr_code=png:bilevel
+ARTIFACT_ENCODERS = config.get('ARTIFACT_ENCODERS', fallback='')
+# codificar y escribir las imágenes en segundo plano (un error de escritura
+# sólo se registra en el log, el acta queda como procesada):
+ARTIFACT_BACKGROUND = config.getboolean('ARTIFACT_BACKGROUND', fallback=False)
+# modo demonio (examples/watch.py): segundos sin cambios para considerar
+# completa un acta, inotify (o sondeo cada WATCH_INTERVAL segundos) y
+# revisión completa del árbol cada WATCH_RESCAN segundos:
+WATCH_SETTLE = float(config.get('WATCH_SETTLE', fallback=1.0))
+WATCH_INOTIFY = config.getboolean('WATCH_INOTIFY', fallback=True)
+WATCH_INTERVAL = float(config.get('WATCH_INTERVAL', fallback=2.0))
+WATCH_RESCAN = float(config.get('WATCH_RESCAN', fallback=300.0))
+# métricas de la corrida (resumen JSON y formato Prometheus):
+METRICS_JSON = config.get('METRICS_JSON') or Path(
+    DIRECTORIO_LOG
+).joinpath('metrics.json')
+METRICS_PROMETHEUS = config.get('METRICS_PROMETHEUS') or Path(
+    DIRECTORIO_LOG
+).joinpath('metrics.prom')
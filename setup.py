@@ -81,6 +81,11 @@ setup(
         "opencv-python==4.10.0.84",
         "navconfig[default]>=1.7.1",
     ],
+    entry_points={
+        'console_scripts': [
+            'cne = cne_evaluation.cli:main',
+        ],
+    },
     tests_requires=[
         'pytest>=5.4.0'
     ],
@@ -0,0 +1,96 @@
+"""Vote totals per estado, municipio and parroquia."""
+import json
+import asyncio
+import numpy as np
+import pytest
+from cne_evaluation.aggregate import VoteTable, parse_payload
+from cne_evaluation.results import get_sink, make_record
+
+
+def test_parse_payload():
+    mesa, votes = parse_payload('0101.01.1.0001!5,10,20!0!0\n')
+    assert mesa == '0101.01.1.0001'
+    assert votes.tolist() == [5, 10, 20]
+    for invalid in ('', 'mesa', '!1,2', 'mesa!1,x', 'mesa!1,-2'):
+        with pytest.raises(ValueError):
+            parse_payload(invalid)
+
+
+def test_totals_per_level():
+    table = VoteTable()
+    assert table.add('EDO1/MP1/PQ1', 'm1!1,2!0!0', 'a.jpg')
+    assert table.add('EDO1/MP1/PQ2', 'm2!10,20,30!0!0', 'b.jpg')
+    assert table.add('EDO2/MP1/PQ1', 'm3!100,0!0!0', 'c.jpg')
+    assert len(table) == 3
+    assert table.national.tolist() == [111, 22, 30]
+    assert table.totals('estado') == {
+        'EDO1': [11, 22, 30], 'EDO2': [100, 0, 0]
+    }
+    assert table.totals('parroquia')['EDO1/MP1/PQ2'] == [10, 20, 30]
+    assert table.mesas('municipio') == {'EDO1/MP1': 2, 'EDO2/MP1': 1}
+    # the incremental totals equal a full group-by
+    for index, level in enumerate(('estado', 'municipio', 'parroquia')):
+        assert np.array_equal(table.groupby(level), table._totals[index])
+
+
+def test_mesa_counted_once():
+    table = VoteTable()
+    table.add('EDO/MP/PQ', 'm1!1,2!0!0', 'a.jpg')
+    # the same acta decoded again replaces its votes
+    assert table.add('EDO/MP/PQ', 'm1!3,4!0!0', 'a.jpg')
+    assert table.national.tolist() == [3, 4]
+    # another scan of the mesa: same votes ignored, other votes a conflict
+    assert not table.add('EDO/MP/PQ', 'm1!3,4!0!0', 'copy.jpg')
+    assert not table.conflicts
+    assert not table.add('EDO/MP/PQ', 'm1!9,9!0!0', 'other.jpg')
+    assert table.conflicts == {
+        'm1': {'EDO/MP/PQ/a.jpg': [3, 4], 'EDO/MP/PQ/other.jpg': [9, 9]}
+    }
+    assert not table.add('EDO/MP/PQ', 'garbage', 'bad.jpg')
+    assert table.errors == 1
+    assert len(table) == 1 and table.national.tolist() == [3, 4]
+
+
+def test_rebuild_matches_incremental():
+    table = VoteTable(capacity=2)
+    for i in range(10):
+        table.add(f"EDO{i % 3}/MP{i % 2}/PQ", f"m{i}!{i},{2 * i}!0!0", 'a.jpg')
+    national = table.national.copy()
+    totals = table.totals('municipio')
+    table.rebuild()
+    assert table.national.tolist() == national.tolist()
+    assert table.totals('municipio') == totals
+
+
+def _results(filename):
+    async def write():
+        async with get_sink(filename) as sink:
+            await sink.add(make_record('EDO/MP/PQ', 'a.jpg', data='m1!1,2!0!0'))
+            await sink.add(make_record('EDO/MP/PQ', 'b.jpg', error='QR'))
+            await sink.add(make_record('EDO/MP/PQ', 'c.jpg', data='m2!3,4!0!0'))
+    asyncio.run(write())
+    return filename
+
+
+def test_from_results(tmp_path):
+    filename = _results(tmp_path / 'results.jsonl')
+    table = VoteTable.from_results(filename)
+    assert len(table) == 2
+    assert table.national.tolist() == [4, 6]
+    table.save(tmp_path / 'totals.json')
+    with open(tmp_path / 'totals.json', 'r', encoding='utf-8') as fp:
+        summary = json.load(fp)
+    assert summary['mesas'] == 2
+    assert summary['estado']['EDO'] == {'mesas': 2, 'votes': [4, 6]}
+
+
+def test_totals_command(tmp_path, capsys):
+    from cne_evaluation.cli import main
+    filename = _results(tmp_path / 'results.jsonl')
+    output = tmp_path / 'totals.json'
+    assert main([
+        'totals', str(filename), '--level', 'estado', '--output', str(output)
+    ]) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[1:] == ['EDO\t2\t4,6', 'national\t2\t4,6']
+    assert output.exists()
@@ -0,0 +1,89 @@
+"""Archives: actas read from .zip/.tar(.gz) files without extracting them."""
+import io
+import asyncio
+import tarfile
+import zipfile
+from pathlib import Path
+from cne_evaluation.archives import ArchiveIterator, ArchiveMember
+from cne_evaluation.manifest import Manifest
+
+
+MEMBERS = {
+    'actas/EDO/MP/PQ/a.jpg': b'\xff\xd8acta a\xff\xd9',
+    'actas/EDO/MP/PQ/b.jpg': b'\xff\xd8acta b\xff\xd9',
+    'actas/EDO/notas.txt': b'not an acta',
+}
+
+
+def _zip(path, date_time=(2024, 7, 29, 10, 0, 0)):
+    with zipfile.ZipFile(path, 'w') as zf:
+        for name, data in MEMBERS.items():
+            zf.writestr(zipfile.ZipInfo(name, date_time), data)
+    return path
+
+
+def _tar(path):
+    with tarfile.open(path, 'w:gz') as tf:
+        for name, data in MEMBERS.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = 1722247200
+            tf.addfile(info, io.BytesIO(data))
+    return path
+
+
+def _items(archives, tmp_path, manifest=None):
+    iterator = ArchiveIterator(
+        archives, tmp_path / 'out', manifest=manifest, strip_components=1
+    )
+
+    async def read():
+        return [item async for item in iterator]
+    return asyncio.run(read()), iterator
+
+
+def test_zip_and_tar_members(tmp_path):
+    for archive in (_zip(tmp_path / 'a.zip'), _tar(tmp_path / 'a.tar.gz')):
+        items, iterator = _items(archive, tmp_path)
+        assert [(str(r), a.name, a.data) for r, _, a in items] == [
+            ('EDO/MP/PQ', 'a.jpg', MEMBERS['actas/EDO/MP/PQ/a.jpg']),
+            ('EDO/MP/PQ', 'b.jpg', MEMBERS['actas/EDO/MP/PQ/b.jpg']),
+        ]
+        assert items[0][1] == tmp_path / 'out' / 'EDO/MP/PQ/a.jpg'
+        assert iterator.errors == 0
+
+
+def test_manifest_hash_of_members(tmp_path):
+    with Manifest(tmp_path / 'manifest.db', use_hash=True) as manifest:
+        items, _ = _items(_zip(tmp_path / 'a.zip'), tmp_path)
+        for relative_path, _, acta in items:
+            manifest.record(
+                Manifest.key(relative_path, acta.name), acta, data='m!1!0!0'
+            )
+        # downloaded again: same content, other dates
+        archive = _zip(tmp_path / 'a.zip', date_time=(2024, 7, 30, 8, 0, 0))
+        items, iterator = _items(archive, tmp_path, manifest)
+        assert items == []
+        assert iterator.skipped == 2
+        assert iterator.errors == 0
+
+
+def test_member_load():
+    reads = []
+    member = ArchiveMember(
+        Path('a.zip'), 'EDO/a.jpg', None, reader=lambda: reads.append(1) or b'x'
+    )
+    assert member.load() == member.load() == b'x'
+    assert reads == [1]
+    # a loaded member can be sent to a worker process
+    assert member.reader is None
+
+
+def test_corrupt_archive_does_not_stop_the_others(tmp_path):
+    broken = tmp_path / 'broken.tar.gz'
+    broken.write_bytes(b'\x1f\x8b' + b'not a tar' * 10)
+    items, iterator = _items(
+        [broken, _zip(tmp_path / 'a.zip')], tmp_path
+    )
+    assert [acta.name for _, _, acta in items] == ['a.jpg', 'b.jpg']
+    assert iterator.errors == 1
@@ -0,0 +1,171 @@
+"""Batch processing: the worker pool, its results and bookkeeping."""
+import asyncio
+import hashlib
+import threading
+import pytest
+
+pytest.importorskip('cv2')
+from cne_evaluation.batch import BatchProcessor  # noqa: E402  pylint: disable=C0413
+from cne_evaluation.failures import (  # noqa: E402  pylint: disable=C0413
+    FailureQueue,
+    READ_ERROR,
+    TIMEOUT
+)
+from cne_evaluation.manifest import Manifest  # noqa: E402  pylint: disable=C0413
+from cne_evaluation.memory import MemoryBudget  # noqa: E402  pylint: disable=C0413
+from cne_evaluation.results import get_sink, load_results  # noqa: E402  pylint: disable=C0413
+from cne_evaluation.synthetic import generate_actas  # noqa: E402  pylint: disable=C0413
+
+
+def _actas(tmp_path, count=4):
+    actas = tmp_path / 'actas'
+    specs = generate_actas(
+        actas, count=count, seed=1, max_skew=0, blue_ink=0, speckle=0,
+        border=0, hierarchy=('EDO', 'MP', 'PQ')
+    )
+    items = [
+        (
+            actas.joinpath(spec.filename).parent.relative_to(actas),
+            tmp_path / 'out' / spec.filename,
+            actas / spec.filename
+        )
+        for spec in specs
+    ]
+    return specs, items
+
+
+def _run(batch, items):
+    async def run():
+        async with batch:
+            return [result async for result in batch.run(items)]
+    return asyncio.run(run())
+
+
+def test_ordered_results(tmp_path):
+    specs, items = _actas(tmp_path)
+    sink = get_sink(tmp_path / 'results.jsonl')
+    batch = BatchProcessor(
+        executor='thread', max_workers=2, ordered=True, in_memory=True,
+        sink=sink, logdir=tmp_path / 'Log'
+    )
+
+    async def run():
+        async with sink, batch:
+            return [result async for result in batch.run(items)]
+    results = asyncio.run(run())
+    assert [r.source for r in results] == [item[2] for item in items]
+    assert [r.data for r in results] == [spec.payload for spec in specs]
+    assert batch.metrics.counters['decoded'] == 4
+    # with a sink no .txt is written next to the acta
+    assert not list(tmp_path.joinpath('out').rglob('*.txt'))
+    records = load_results(tmp_path / 'results.jsonl')
+    assert {r['path'] for r in records} == {s.filename for s in specs}
+    assert all(r['time_decode'] is not None for r in records)
+
+
+def test_a_bad_acta_does_not_stop_the_batch(tmp_path):
+    _, items = _actas(tmp_path, count=2)
+    corrupt = tmp_path / 'actas' / 'EDO' / 'corrupt.jpg'
+    corrupt.write_bytes(b'\xff\xd8 not a jpeg')
+    items.insert(1, (corrupt.parent.relative_to(tmp_path / 'actas'),
+                     tmp_path / 'out' / 'EDO' / 'corrupt.jpg', corrupt))
+    manifest = Manifest(tmp_path / 'manifest.db')
+    failures = FailureQueue(tmp_path / 'failures.db')
+    results = _run(BatchProcessor(
+        executor='thread', max_workers=2, in_memory=True, manifest=manifest,
+        failures=failures, logdir=tmp_path / 'Log'
+    ), items)
+    assert sum(r.ok for r in results) == 2
+    failed, = [r for r in results if not r.ok]
+    assert failed.reason == READ_ERROR
+    assert failures.stats() == {READ_ERROR: 1}
+    assert manifest.get('EDO/corrupt.jpg')['status'] == Manifest.FAILED
+    assert manifest.is_processed(
+        Manifest.key(items[0][0], items[0][2].name), items[0][2]
+    )
+    log = tmp_path / 'Log' / 'non_processed.log'
+    assert log.read_text().splitlines() == [str(items[1][1])]
+    manifest.close()
+    failures.close()
+
+
+@pytest.fixture
+def inflight(monkeypatch):
+    # [actas on the pool now, most at once]
+    counts = [0, 0]
+    submit = BatchProcessor.submit
+
+    def done(_):
+        counts[0] -= 1
+
+    def spy(self, image_path, destination_path):
+        future = submit(self, image_path, destination_path)
+        counts[0] += 1
+        counts[1] = max(counts[1], counts[0])
+        future.add_done_callback(done)
+        return future
+    monkeypatch.setattr(BatchProcessor, 'submit', spy)
+    return counts
+
+
+def test_backpressure(tmp_path, inflight):
+    _, items = _actas(tmp_path, count=6)
+    results = _run(BatchProcessor(
+        executor='thread', max_workers=4, max_pending=2, in_memory=True,
+        logdir=tmp_path / 'Log'
+    ), items)
+    assert len(results) == 6 and all(r.ok for r in results)
+    assert inflight[1] <= 2
+
+
+def test_memory_budget(tmp_path, inflight):
+    _, items = _actas(tmp_path, count=4)
+    budget = MemoryBudget('1M')
+    results = _run(BatchProcessor(
+        executor='thread', max_workers=4, in_memory=True,
+        memory_budget=budget, logdir=tmp_path / 'Log'
+    ), items)
+    assert all(r.ok for r in results)
+    # every acta is larger than the budget: they run alone
+    assert inflight[1] == 1
+    assert budget.peak == budget.limit and budget.used == 0
+
+
+def test_timeout(tmp_path):
+    _, items = _actas(tmp_path, count=1)
+    results = _run(BatchProcessor(
+        executor='thread', max_workers=1, timeout=0.001, in_memory=True,
+        logdir=tmp_path / 'Log'
+    ), items)
+    assert results[0].timed_out and results[0].reason == TIMEOUT
+    assert not results[0].ok
+
+
+def test_bookkeeping_off_the_event_loop(tmp_path, monkeypatch):
+    from cne_evaluation.dedup import DedupIndex
+    _, items = _actas(tmp_path, count=2)
+    threads, hashed = set(), []
+    record = Manifest.record
+
+    def spy(self, *args, **kwargs):
+        threads.add(threading.current_thread().name)
+        return record(self, *args, **kwargs)
+    monkeypatch.setattr(Manifest, 'record', spy)
+    monkeypatch.setattr(
+        Manifest, 'content_hash', staticmethod(lambda f: hashed.append(f))
+    )
+    manifest = Manifest(tmp_path / 'manifest.db', use_hash=True)
+    dedup = DedupIndex()
+    _run(BatchProcessor(
+        executor='thread', max_workers=2, in_memory=True, manifest=manifest,
+        dedup=dedup, logdir=tmp_path / 'Log'
+    ), items)
+    assert all(name.startswith('cne_bookkeeper') for name in threads)
+    # the fingerprint is the content hash: the actas are not read again
+    assert hashed == []
+    for relative_path, _, image_path in items:
+        key = Manifest.key(relative_path, image_path.name)
+        assert manifest.get(key)['hash'] == hashlib.blake2b(
+            image_path.read_bytes(), digest_size=16
+        ).hexdigest()
+    manifest.close()
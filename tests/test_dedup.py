@@ -0,0 +1,117 @@
+"""Duplicate actas: fingerprints and the dedup index."""
+import asyncio
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+from cne_evaluation.archives import MemoryFile  # noqa: E402  pylint: disable=C0413
+from cne_evaluation.dedup import (  # noqa: E402  pylint: disable=C0413
+    DedupIndex,
+    Fingerprint,
+    fingerprint,
+    mesa_code
+)
+
+
+def _scan(path, seed=0, quality=95):
+    rng = np.random.default_rng(seed)
+    image = cv2.resize(
+        rng.integers(0, 255, (12, 16), dtype=np.uint8), (320, 240),
+        interpolation=cv2.INTER_NEAREST
+    )
+    cv2.imwrite(str(path), image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return path
+
+
+def test_fingerprint(tmp_path):
+    acta = _scan(tmp_path / 'acta.jpg')
+    fp = fingerprint(acta)
+    # read once by the worker: same fingerprint from memory
+    assert fingerprint(MemoryFile.read(acta)) == fp
+    recompressed = fingerprint(_scan(tmp_path / 'copy.jpg', quality=60))
+    assert recompressed.sha != fp.sha
+    assert bin(recompressed.phash ^ fp.phash).count('1') <= 4
+    other = fingerprint(_scan(tmp_path / 'other.jpg', seed=1))
+    assert bin(other.phash ^ fp.phash).count('1') > 4
+
+
+def test_exact_and_near_duplicates():
+    index = DedupIndex(distance=4)
+    original = Fingerprint('a' * 32, 0b1111)
+    assert index.add('EDO/a.jpg', original) == []
+    assert index.exact('EDO/a.jpg', original) is None
+    assert index.exact('EDO/copy.jpg', original) == 'EDO/a.jpg'
+    index.add('EDO/copy.jpg', original, duplicate_of='EDO/a.jpg')
+    assert index.add('EDO/near.jpg', Fingerprint('b' * 32, 0b0111)) == [
+        'EDO/a.jpg'
+    ]
+    assert index.resolve('EDO/a.jpg', 'm1!1,2!0!0') is None
+    assert index.resolve('EDO/near.jpg', 'm1!1,2!0!0') is None
+    report = index.report()
+    assert report['exact_duplicates'] == {'EDO/copy.jpg': 'EDO/a.jpg'}
+    assert report['near_duplicates'] == {'EDO/near.jpg': 'EDO/a.jpg'}
+
+
+def test_payload_conflicts():
+    index = DedupIndex()
+    index.add('a.jpg', Fingerprint('a', 0))
+    index.add('b.jpg', Fingerprint('b', 2**64 - 1))
+    index.resolve('a.jpg', 'm1!1,2!0!0')
+    conflict = index.resolve('b.jpg', 'm1!9,9!0!0')
+    assert conflict['mesa'] == mesa_code('m1!9,9!0!0') == 'm1'
+    assert set(index.conflicts()['m1']) == {'m1!1,2!0!0', 'm1!9,9!0!0'}
+
+
+def test_changed_content_updates_index(tmp_path):
+    filename = tmp_path / 'dedup.db'
+    index = DedupIndex(filename)
+    index.add('a.jpg', Fingerprint('old', 0))
+    # the acta was replaced by another scan
+    index.add('a.jpg', Fingerprint('new', 2**64 - 1))
+    index.close()
+    index = DedupIndex(filename)
+    assert index.exact('b.jpg', Fingerprint('old', 0)) is None
+    assert index.exact('b.jpg', Fingerprint('new', 2**64 - 1)) == 'a.jpg'
+    assert index.near(Fingerprint('x', 0)) == []
+    assert index.near(Fingerprint('x', 2**64 - 1)) == ['a.jpg']
+    index.close()
+
+
+def test_exact_copies_are_not_processed(tmp_path, monkeypatch):
+    from cne_evaluation.batch import BatchProcessor
+    from cne_evaluation.synthetic import generate_actas
+    actas = tmp_path / 'actas'
+    spec, = generate_actas(
+        actas, count=1, seed=1, max_skew=0, blue_ink=0, speckle=0, border=0
+    )
+    original = actas / spec.filename
+    copies = [original.with_name('copia.jpg'), actas / 'otra' / 'acta.jpg']
+    for copy in copies:
+        copy.parent.mkdir(exist_ok=True)
+        copy.write_bytes(original.read_bytes())
+    submitted = []
+    submit = BatchProcessor.submit
+
+    def spy(self, image_path, destination_path):
+        submitted.append(image_path)
+        return submit(self, image_path, destination_path)
+    monkeypatch.setattr(BatchProcessor, 'submit', spy)
+    items = [
+        (path.parent.relative_to(actas), tmp_path / 'out' / path.name, path)
+        for path in [original] + copies
+    ]
+
+    async def run():
+        batch = BatchProcessor(
+            executor='thread', max_workers=2, in_memory=True,
+            dedup=DedupIndex(), logdir=tmp_path / 'Log'
+        )
+        async with batch:
+            return [result async for result in batch.run(items)], batch
+    results, batch = asyncio.run(run())
+    # the first one read is decoded, the copies take its payload
+    assert len(submitted) == 1
+    assert all(result.data == spec.payload for result in results)
+    assert sum(1 for result in results if result.duplicate_of) == 2
+    assert batch.stats['duplicate'] == 2
+    assert batch.metrics.snapshot()['counters']['duplicates'] == 2
@@ -0,0 +1,64 @@
+"""Skew estimators over synthetic scans."""
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+from cne_evaluation.synthetic import ActaSpec, render_acta  # noqa: E402  pylint: disable=C0413
+from cne_evaluation.deskew import (  # noqa: E402  pylint: disable=C0413
+    DeskewEstimator,
+    HoughDeskew,
+    ProjectionProfileDeskew,
+    get_estimator,
+    pyramid_level,
+    weighted_median
+)
+
+
+def _gray(skew: float) -> np.ndarray:
+    page = render_acta(ActaSpec(payload='1!15!60!120!0', skew=skew, seed=3))
+    return cv2.cvtColor(page, cv2.COLOR_BGR2GRAY)
+
+
+@pytest.mark.parametrize('method', ['hough', 'hough_p', 'projection'])
+@pytest.mark.parametrize('skew', [-2.5, 0.0, 1.5])
+def test_estimators_correct_the_skew(method, skew):
+    estimate = get_estimator(method)(_gray(skew))
+    assert estimate.method == method
+    # the correction is the opposite of the tilt
+    assert estimate.angle == pytest.approx(-skew, abs=0.15)
+    assert estimate.confidence > 0.9
+
+
+def test_blank_page_has_no_confidence():
+    blank = np.full((800, 600), 255, np.uint8)
+    for method in ('hough', 'hough_p', 'projection'):
+        estimate = get_estimator(method)(blank)
+        assert estimate.angle == 0.0 and estimate.confidence == 0.0
+
+
+def test_consensus():
+    estimator = DeskewEstimator(agreement=0.5)
+    # an outlier line (ex: a signature) does not move the result
+    estimate = estimator.consensus(
+        np.array([1.0, 1.2, 0.9, 8.0]), np.array([3.0, 2.0, 2.0, 1.0])
+    )
+    assert estimate.angle == -1.0
+    assert estimate.confidence == pytest.approx(7 / 8)
+    assert estimator.consensus(np.array([])).confidence == 0.0
+    assert weighted_median(np.array([5.0, 1.0, 3.0]), np.ones(3)) == 3.0
+
+
+def test_pyramid_level():
+    level = pyramid_level(np.zeros((3000, 2000), np.uint8), 1000)
+    assert level.shape == (750, 500)
+
+
+def test_get_estimator():
+    fast = get_estimator('fast')
+    assert isinstance(fast, HoughDeskew) and fast.max_side == 600
+    accurate = get_estimator('accurate', max_side=800)
+    assert isinstance(accurate, ProjectionProfileDeskew)
+    assert accurate.max_side == 800 and accurate.fine_step == 0.05
+    assert get_estimator(fast) is fast
+    with pytest.raises(ValueError):
+        get_estimator('radon')
@@ -0,0 +1,77 @@
+"""Failure reasons and the failure queue."""
+import json
+import asyncio
+from pathlib import Path
+from cne_evaluation.failures import (
+    ActaError,
+    FailureQueue,
+    classify,
+    retry_options,
+    HEAVY,
+    ERROR,
+    READ_ERROR,
+    QR_NOT_FOUND,
+    QR_UNDECODABLE,
+    TIMEOUT
+)
+
+
+def test_classify():
+    assert classify(ActaError('no QR', QR_UNDECODABLE)) == QR_UNDECODABLE
+    assert classify(ActaError('unknown')) == ERROR
+    assert classify(asyncio.TimeoutError()) == TIMEOUT
+    assert classify(TimeoutError()) == TIMEOUT
+    assert classify(FileNotFoundError('acta.jpg')) == READ_ERROR
+    assert classify(RuntimeError('boom')) == ERROR
+
+
+def test_retry_options_defaults():
+    options = retry_options()
+    assert options == HEAVY
+    # a copy, the defaults are never changed
+    options['area'] = 1.0
+    assert HEAVY['area'] != 1.0
+
+
+def test_queue_add_resolve(tmp_path):
+    with FailureQueue(tmp_path / 'failures.db') as queue:
+        queue.add('EDO/a.jpg', '/actas/EDO/a.jpg', 'EDO', '/out/EDO/a.jpg',
+                  QR_NOT_FOUND, 'QR code not found')
+        queue.add('EDO/b.jpg', '/actas/EDO/b.jpg', 'EDO', '/out/EDO/b.jpg',
+                  READ_ERROR)
+        # failed again: one row, two attempts
+        queue.add('EDO/a.jpg', '/actas/EDO/a.jpg', 'EDO', '/out/EDO/a.jpg',
+                  QR_UNDECODABLE)
+        assert queue.stats() == {QR_UNDECODABLE: 1, READ_ERROR: 1}
+        pending = queue.pending([QR_UNDECODABLE])
+        assert [row['path'] for row in pending] == ['EDO/a.jpg']
+        assert pending[0]['attempts'] == 2
+        assert queue.pending(max_attempts=2)[0]['path'] == 'EDO/b.jpg'
+        items = list(queue.items([READ_ERROR]))
+        assert items == [
+            (Path('EDO'), Path('/out/EDO/b.jpg'), '/actas/EDO/b.jpg')
+        ]
+        queue.resolve('EDO/a.jpg')
+        # decoded actas that never failed are ignored
+        queue.resolve('EDO/c.jpg')
+        assert queue.stats() == {READ_ERROR: 1}
+    with FailureQueue(tmp_path / 'failures.db') as queue:
+        assert queue.stats() == {READ_ERROR: 1}
+
+
+def test_failures_command(tmp_path, capsys):
+    from cne_evaluation.cli import main
+    filename = tmp_path / 'failures.db'
+    with FailureQueue(filename) as queue:
+        queue.add('EDO/a.jpg', '/actas/EDO/a.jpg', 'EDO', '/out/EDO/a.jpg',
+                  QR_NOT_FOUND, 'QR code not found')
+        queue.add('EDO/b.jpg', '/actas/EDO/b.jpg', 'EDO', '/out/EDO/b.jpg',
+                  READ_ERROR)
+    assert main(['failures', str(filename), 'stats']) == 0
+    assert json.loads(capsys.readouterr().out) == {
+        QR_NOT_FOUND: 1, READ_ERROR: 1
+    }
+    main(['failures', str(filename), 'list', '--reason', READ_ERROR])
+    assert capsys.readouterr().out.split('\t')[:3] == [
+        'EDO/b.jpg', READ_ERROR, '1'
+    ]
@@ -0,0 +1,93 @@
+"""Manifest: resumed runs skip the actas already decoded."""
+import os
+import asyncio
+from cne_evaluation.manifest import Manifest
+from cne_evaluation.directories import DirectoryIterator
+
+
+def _acta(path, content=b'\xff\xd8acta\xff\xd9'):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(content)
+    return path
+
+
+def test_is_processed(tmp_path):
+    acta = _acta(tmp_path / 'actas' / 'acta.jpg')
+    with Manifest(tmp_path / 'manifest.db') as manifest:
+        key = Manifest.key('EDO/MP/PQ', 'acta.jpg')
+        assert key == 'EDO/MP/PQ/acta.jpg'
+        assert not manifest.is_processed(key, acta)
+        manifest.record(key, acta, data='m!1!0!0')
+        assert manifest.is_processed(key, acta)
+        assert manifest.stats() == {Manifest.DONE: 1}
+
+
+def test_failed_actas_are_not_processed(tmp_path):
+    acta = _acta(tmp_path / 'acta.jpg')
+    with Manifest(tmp_path / 'manifest.db') as manifest:
+        manifest.record('acta.jpg', acta, error='QR code not found')
+        assert not manifest.is_processed('acta.jpg', acta)
+        # decoded on a retry
+        manifest.record('acta.jpg', acta, data='m!1!0!0')
+        assert manifest.is_processed('acta.jpg', acta)
+        assert manifest.get('acta.jpg')['attempts'] == 2
+
+
+def test_changed_acta_is_processed_again(tmp_path):
+    acta = _acta(tmp_path / 'acta.jpg')
+    with Manifest(tmp_path / 'manifest.db') as manifest:
+        manifest.record('acta.jpg', acta, data='m!1!0!0')
+        _acta(acta, b'\xff\xd8another scan\xff\xd9')
+        assert not manifest.is_processed('acta.jpg', acta)
+
+
+def test_touched_acta_with_hash(tmp_path):
+    acta = _acta(tmp_path / 'acta.jpg')
+    with Manifest(tmp_path / 'manifest.db', use_hash=True) as manifest:
+        manifest.record('acta.jpg', acta, data='m!1!0!0')
+        # copied again: same content, new mtime
+        stat = acta.stat()
+        os.utime(acta, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        assert manifest.is_processed('acta.jpg', acta)
+    with Manifest(tmp_path / 'manifest.db') as manifest:
+        assert not manifest.is_processed('acta.jpg', acta)
+
+
+def test_new_version_processes_again(tmp_path):
+    acta = _acta(tmp_path / 'acta.jpg')
+    with Manifest(tmp_path / 'manifest.db', version='1.0') as manifest:
+        manifest.record('acta.jpg', acta, data='m!1!0!0')
+    with Manifest(tmp_path / 'manifest.db', version='2.0') as manifest:
+        assert not manifest.is_processed('acta.jpg', acta)
+
+
+def test_resumed_iteration_skips_decoded(tmp_path):
+    directory = tmp_path / 'actas'
+    for name in ('a.jpg', 'b.jpg', 'c.jpg'):
+        _acta(directory / 'EDO' / 'MP' / 'PQ' / name)
+
+    async def walk(manifest):
+        iterator = DirectoryIterator(
+            str(directory), str(tmp_path / 'out'), ['.jpg'], manifest=manifest
+        )
+        items = [item async for item in iterator]
+        iterator.close()
+        return items, iterator.skipped
+
+    with Manifest(tmp_path / 'manifest.db') as manifest:
+        items, skipped = asyncio.run(walk(manifest))
+        assert len(items) == 3 and skipped == 0
+        # interrupted run: a decoded, b failed
+        relative_path, _, image_path = items[0]
+        manifest.record(
+            Manifest.key(relative_path, image_path.name), image_path,
+            data='m!1!0!0'
+        )
+        relative_path, _, image_path = items[1]
+        manifest.record(
+            Manifest.key(relative_path, image_path.name), image_path,
+            error='QR code not found'
+        )
+        items, skipped = asyncio.run(walk(manifest))
+    assert skipped == 1
+    assert [image_path.name for _, _, image_path in items] == ['b.jpg', 'c.jpg']
@@ -0,0 +1,134 @@
+"""Memory budget: acta footprints from their headers."""
+import io
+import struct
+import asyncio
+import pytest
+from cne_evaluation.memory import (
+    MemoryBudget,
+    footprint,
+    parse_size,
+    read_dimensions,
+    BYTES_PER_PIXEL,
+    ENCODED_FACTOR,
+    WAND_BYTES_PER_PIXEL
+)
+
+
+def _jpeg(width, height, channels=3):
+    # SOI, an APP0 segment (skipped), SOF0
+    app0 = b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\x00' + b'\x00' * 9
+    sof = b'\xff\xc0' + struct.pack('>HBHHB', 8 + 3 * channels, 8, height,
+                                    width, channels)
+    return b'\xff\xd8' + app0 + sof + b'\x00' * 3 * channels + b'\xff\xd9'
+
+
+def _png(width, height, color=2):
+    ihdr = struct.pack('>IIBBBBB', width, height, 8, color, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR' + ihdr
+
+
+def _bmp(width, height, bits=24):
+    return b'BM' + b'\x00' * 16 + struct.pack('<iiHH', width, -height, 1, bits)
+
+
+def _tiff(width, height, order='<'):
+    magic = b'II*\x00' if order == '<' else b'MM\x00*'
+    entries = [(256, 3, width), (257, 4, height), (277, 3, 1)]
+    ifd = struct.pack(order + 'H', len(entries))
+    for tag, kind, value in entries:
+        packed = struct.pack(order + ('HI' if kind == 3 else 'I'), *(
+            (value, 0) if kind == 3 else (value,)
+        ))
+        ifd += struct.pack(order + 'HHI', tag, kind, 1) + packed[:4]
+    return magic + struct.pack(order + 'I', 8) + ifd
+
+
+@pytest.mark.parametrize('data, expected', [
+    (_jpeg(2480, 3508), (2480, 3508, 3)),
+    (_jpeg(1240, 1754, channels=1), (1240, 1754, 1)),
+    (_png(1700, 2200), (1700, 2200, 3)),
+    (_png(1700, 2200, color=0), (1700, 2200, 1)),
+    (_bmp(800, 600), (800, 600, 3)),
+    (_tiff(1000, 1400), (1000, 1400, 1)),
+    (_tiff(1000, 1400, order='>'), (1000, 1400, 1)),
+])
+def test_read_dimensions(data, expected):
+    assert read_dimensions(io.BytesIO(data)) == expected
+
+
+def test_read_dimensions_of_unknown_or_truncated():
+    assert read_dimensions(io.BytesIO(b'GIF89a....')) is None
+    assert read_dimensions(io.BytesIO(_jpeg(100, 100)[:28])) is None
+    assert read_dimensions(io.BytesIO(b'\xff\xd8\xff\xd9')) is None
+
+
+def test_footprint(tmp_path):
+    acta = tmp_path / 'acta.jpg'
+    acta.write_bytes(_jpeg(1000, 2000))
+    assert footprint(acta) == int(1000 * 2000 * BYTES_PER_PIXEL)
+    # the Wand rotation keeps its own copy
+    assert footprint(acta, in_memory=False) == int(
+        1000 * 2000 * (BYTES_PER_PIXEL + WAND_BYTES_PER_PIXEL)
+    )
+    # bytes (ex: an archive member) and unknown formats
+    assert footprint(_png(10, 10)) == int(100 * BYTES_PER_PIXEL)
+    assert footprint(b'GIF89a' * 10) == 60 * ENCODED_FACTOR
+    assert footprint(tmp_path / 'missing.jpg') == 0
+
+
+def test_parse_size():
+    assert parse_size('512M') == 512 * 2**20
+    assert parse_size('1.5GB') == int(1.5 * 2**30)
+    assert parse_size('4096') == 4096
+    assert parse_size(1024) == 1024
+    assert parse_size('') is None and parse_size(None) is None
+    total = parse_size('100%')
+    if total is not None:
+        assert parse_size('50%') == total // 2
+
+
+def test_budget_admits_in_arrival_order():
+    async def run():
+        budget = MemoryBudget(100)
+        admitted = []
+
+        async def acta(name, nbytes, hold):
+            taken = await budget.acquire(nbytes)
+            admitted.append(name)
+            await asyncio.sleep(hold)
+            budget.release(taken)
+        tasks = [
+            asyncio.ensure_future(acta('a', 60, 0.05)),
+            asyncio.ensure_future(acta('large', 80, 0.01)),
+            # fits now, but the large acta arrived first
+            asyncio.ensure_future(acta('small', 10, 0.01)),
+        ]
+        await asyncio.gather(*tasks)
+        return budget, admitted
+    budget, admitted = asyncio.run(run())
+    assert admitted == ['a', 'large', 'small']
+    assert budget.used == 0 and budget.peak == 90
+    assert budget.waits == 2
+
+
+def test_budget_larger_acta_runs_alone():
+    async def run():
+        budget = MemoryBudget('1K')
+        taken = await budget.acquire(10 * 2**10)
+        assert taken == budget.limit
+        waiter = asyncio.ensure_future(budget.acquire(1))
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        budget.release(taken)
+        assert await waiter == 1
+        # a cancelled waiter does not keep the others waiting
+        cancelled = asyncio.ensure_future(budget.acquire(2**10))
+        following = asyncio.ensure_future(budget.acquire(1))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        assert await asyncio.wait_for(following, 1) == 1
+        return budget
+    budget = asyncio.run(run())
+    assert budget.used == 2
+    with pytest.raises(ValueError):
+        MemoryBudget('0')
@@ -0,0 +1,145 @@
+"""Enhancement pipelines, artifact policies and tuned profiles."""
+import json
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+from cne_evaluation.pipeline import (  # noqa: E402  pylint: disable=C0413
+    compile_pipeline,
+    filter_stage,
+    fuse_stages,
+    parse_profile,
+    sharpen_stage
+)
+from cne_evaluation.synthetic import ActaSpec, render_acta  # noqa: E402  pylint: disable=C0413
+from cne_evaluation.artifacts import ArtifactPolicy, Encoder  # noqa: E402  pylint: disable=C0413
+from cne_evaluation.autotune import cascades, load_tuned  # noqa: E402  pylint: disable=C0413
+from cne_evaluation.deskew import DeskewEstimator  # noqa: E402  pylint: disable=C0413
+
+
+def test_parse_profile():
+    assert parse_profile('grayscale, denoise(h=5), morph(size=3), crop') == [
+        ('grayscale', {}), ('denoise', {'h': 5}), ('morph', {'size': 3}),
+        ('crop', {})
+    ]
+    with pytest.raises(ValueError):
+        parse_profile('sharpen, unknown')
+
+
+def _acta_crop() -> np.ndarray:
+    # bottom half of a synthetic acta (QR, blue ink and scanner dust)
+    page = render_acta(ActaSpec(
+        payload='1!15!60!120!0', skew=1.5, blue_ink=3, speckle=0.001,
+        border=0.1, seed=1
+    ))
+    return np.ascontiguousarray(page[page.shape[0] // 2:])
+
+
+@pytest.mark.parametrize('first, second', [
+    ('0 0 0; 0 1 0; 0 0 0', '0.1 0.1 0.1; 0.1 0.2 0.1; 0.1 0.1 0.1'),
+    ('0 0.5; 0 0.5', '0.25 0.25; 0.25 0.25'),
+    ('0.25 0.5 0.25', '0.5; 0.5'),
+])
+def test_fused_filters_equal_sequential(first, second):
+    image = _acta_crop()
+    stages = [filter_stage(first), filter_stage(second)]
+    expected = stages[1](stages[0](image))
+    fused = fuse_stages(stages, linear=True)
+    assert len(fused) == 1
+    # the 8-bit rounding between the filters and the extrapolated
+    # borders differ
+    difference = np.abs(
+        fused[0](image).astype(np.int16) - expected.astype(np.int16)
+    )[4:-4, 4:-4]
+    assert difference.max() <= 1
+
+
+def test_saturating_filters_are_not_fused():
+    stages = [sharpen_stage(), filter_stage('0.5 0.5; 0.5 0.5')]
+    assert len(fuse_stages(stages, linear=True)) == 2
+    assert len(fuse_stages([filter_stage('0.5'), filter_stage('0.5')])) == 2
+
+
+def test_fuse_stages():
+    pipeline = compile_pipeline('grayscale, grayscale, morph(size=3), sharpen')
+    assert [stage.name for stage in pipeline.stages] == [
+        'grayscale', 'morph', 'sharpen'
+    ]
+    assert len(compile_pipeline('sharpen, sharpen').stages) == 2
+    blur = 'filter(kernel="0.5 0.5"), filter(kernel="0.5; 0.5")'
+    assert len(compile_pipeline(blur).stages) == 2
+    assert len(compile_pipeline(blur, fuse_linear=True).stages) == 1
+
+
+def test_fused_pipeline_output_on_acta():
+    image = _acta_crop()
+    spec = (
+        'grayscale, grayscale, morph(size=3), morph(size=3, ops=erode), '
+        'sharpen, sharpen'
+    )
+    fused = compile_pipeline(spec)
+    assert len(fused.stages) < len(fused.declared)
+    sequential = compile_pipeline(spec, fuse=False)
+    np.testing.assert_array_equal(fused(image), sequential(image))
+
+
+def test_processor_stages_require_a_processor():
+    with pytest.raises(ValueError, match='crop'):
+        compile_pipeline('sharpen, crop')(_acta_crop())
+
+
+def test_artifact_policy():
+    policy = ArtifactPolicy('failures')
+    assert policy.emits('qr_code') and policy.emits('data', True)
+    assert policy.emits('image', False) and not policy.emits('image', True)
+    # unknown outcome: deferred until the QR is decoded
+    assert not policy.emits('image') and policy.deferred('image')
+    custom = ArtifactPolicy(
+        'image=never, bottom=success', 'image=jpg:85, qr_code=png:bilevel'
+    )
+    assert not custom.emits('image', True)
+    assert custom.emits('bottom', True) and not custom.emits('bottom', False)
+    # not given: always
+    assert custom.emits('qr_code')
+    assert custom.filename('/out/acta.jpg', 'qr_code').name == 'acta_qr_code.png'
+    assert custom.filename('/out/acta.jpg', 'bottom').name == 'acta_bottom.jpg'
+    assert custom.filename('/out/acta.jpg', 'data').name == 'acta.txt'
+    for spec in ('photo=always', 'image=sometimes'):
+        with pytest.raises(ValueError):
+            ArtifactPolicy(spec)
+
+
+def test_encoder_from_spec():
+    assert Encoder.from_spec('jpg:85').params == [cv2.IMWRITE_JPEG_QUALITY, 85]
+    assert Encoder.from_spec('webp:lossless').params[1] == 101
+    assert Encoder.from_spec('png:bilevel').bilevel
+    assert Encoder.from_spec('source').suffix is None
+    for spec in ('gif', 'tiff:jbig'):
+        with pytest.raises(ValueError):
+            Encoder.from_spec(spec)
+
+
+def test_cascades():
+    assert cascades(['gray']) == ['gray']
+    assert cascades(['gray', 'blue', 'binary']) == [
+        'gray,blue,binary', 'blue,binary', 'gray,binary', 'gray,blue'
+    ]
+
+
+def test_load_tuned(tmp_path):
+    filename = tmp_path / 'tuned.json'
+    with open(filename, 'w', encoding='utf-8') as fp:
+        json.dump({
+            'version': '0',
+            'params': {
+                'tolerance': 0.2,
+                'area': 0.25,
+                'deskew': 'fast',
+                'cascade': 'gray,binary',
+                'unknown': 1
+            }
+        }, fp)
+    options = load_tuned(filename)
+    assert set(options) == {'tolerance', 'area', 'deskew', 'cascade'}
+    assert options['area'] == 0.25
+    assert isinstance(options['deskew'], DeskewEstimator)
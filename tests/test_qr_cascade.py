@@ -0,0 +1,66 @@
+"""QR decode cascade: strategies, points and statistics."""
+import pickle
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+from cne_evaluation.synthetic import encode_qr  # noqa: E402  pylint: disable=C0413
+from cne_evaluation.qr_cascade import (  # noqa: E402  pylint: disable=C0413
+    DecodeCascade,
+    blue_strategy
+)
+
+PAYLOAD = '0101.01.1.0001!15,60,120!0!0'
+
+
+def _roi(shape=(400, 300), origin=(60, 40)):
+    qr = encode_qr(PAYLOAD, 4)
+    roi = np.full((*shape, 3), 255, np.uint8)
+    y, x = origin
+    roi[y:y + qr.shape[0], x:x + qr.shape[1]] = qr[..., None]
+    return roi
+
+
+def test_decode_stops_at_the_first_strategy():
+    cascade = DecodeCascade('gray, binary')
+    result = cascade.decode(_roi())
+    assert result.data == PAYLOAD and result.strategy == 'gray'
+    assert result.detected
+    x0, y0 = result.points.min(axis=0)
+    assert (x0, y0) == pytest.approx((40 + 8, 60 + 8), abs=2)
+    assert cascade.stats == {'attempts': 1, 'gray': 1}
+
+
+def test_rotated_points_are_on_the_roi():
+    expected = DecodeCascade('gray').decode(_roi()).points
+    result = DecodeCascade('rotate').decode(_roi())
+    assert result.strategy == 'rotate'
+    # decoded on the rotated image, mapped back to the ROI
+    assert result.image.shape == (300, 400)
+    assert sorted(map(tuple, result.points.round())) == sorted(
+        map(tuple, expected.round())
+    )
+
+
+def test_blue_ink_becomes_white():
+    roi = _roi()
+    cv2.line(roi, (0, 0), (299, 399), (255, 0, 0), 9)
+    image, _ = next(blue_strategy(roi))
+    assert image.ndim == 2
+    assert image[200, 150] == 255
+    # the QR modules are kept
+    assert (image == 0).any()
+
+
+def test_misses_and_hit_rates():
+    cascade = DecodeCascade(['gray', 'binary'])
+    result = cascade.decode(np.full((100, 100, 3), 255, np.uint8))
+    assert result.data == '' and not result.detected
+    cascade.decode(_roi())
+    assert cascade.hit_rates() == {'gray': 0.5, 'binary': 0.0, 'misses': 0.5}
+    # sent to the worker processes without its lock and detectors
+    copy = pickle.loads(pickle.dumps(cascade))
+    assert copy.stats == cascade.stats
+    assert copy.decode(_roi()).data == PAYLOAD
+    with pytest.raises(ValueError):
+        DecodeCascade('gray, sharpen')
@@ -0,0 +1,159 @@
+"""Result sinks: records are appended across runs (resumed or retry runs)."""
+import asyncio
+import sqlite3
+from pathlib import Path
+import pytest
+from cne_evaluation.results import (
+    get_sink,
+    load_results,
+    make_record,
+    SQLiteSink,
+    JSONLSink,
+    ParquetSink,
+    STAGES
+)
+
+
+def _run(filename, names, batch_size=2):
+    async def write():
+        async with get_sink(filename, batch_size=batch_size) as sink:
+            for name in names:
+                await sink.add(
+                    make_record('EDO/MP/PQ', name, data=f"{name}!1,2!0!0")
+                )
+    asyncio.run(write())
+
+
+def test_make_record_hierarchy():
+    record = make_record(
+        'EDO/MP/PQ', 'acta.jpg', data='m!1!0!0', qr_box=(1, 2, 3, 4), angle=1
+    )
+    assert record['path'] == 'EDO/MP/PQ/acta.jpg'
+    assert (record['estado'], record['municipio'], record['parroquia']) == (
+        'EDO', 'MP', 'PQ'
+    )
+    assert (record['qr_x0'], record['qr_y1']) == (1, 4)
+    assert record['angle'] == 1.0
+    shallow = make_record('EDO', 'acta.jpg')
+    assert shallow['municipio'] is None and shallow['data'] is None
+    assert shallow['time_deskew'] is None
+
+
+def test_record_timings():
+    record = make_record(
+        'EDO', 'acta.jpg', timings={'deskew': 0.25, 'decode': 0.5}
+    )
+    assert (record['time_deskew'], record['time_decode']) == (0.25, 0.5)
+    assert record['time_read'] is None
+    assert {f"time_{stage}" for stage in STAGES} <= set(record)
+
+
+@pytest.mark.parametrize('suffix, sink', [
+    ('.db', SQLiteSink),
+    ('.jsonl', JSONLSink),
+    ('.parquet', ParquetSink),
+])
+def test_get_sink_by_suffix(tmp_path, suffix, sink):
+    assert isinstance(get_sink(tmp_path / f"results{suffix}"), sink)
+
+
+def test_get_sink_unknown_suffix(tmp_path):
+    with pytest.raises(ValueError):
+        get_sink(tmp_path / 'results.txt')
+
+
+@pytest.mark.parametrize('suffix', ['.db', '.jsonl', '.parquet'])
+def test_sink_appends_across_runs(tmp_path, suffix):
+    if suffix == '.parquet':
+        pytest.importorskip('pyarrow')
+    filename = tmp_path / f"results{suffix}"
+    _run(filename, ['a.jpg', 'b.jpg', 'c.jpg'])
+    # a resumed run only writes the actas not skipped
+    _run(filename, ['d.jpg', 'e.jpg'])
+    records = load_results(filename)
+    assert [r['path'] for r in records] == [
+        f"EDO/MP/PQ/{name}"
+        for name in ('a.jpg', 'b.jpg', 'c.jpg', 'd.jpg', 'e.jpg')
+    ]
+    assert records[3]['data'] == 'd.jpg!1,2!0!0'
+    if suffix == '.parquet':
+        # the parts were merged on the file
+        assert not ParquetSink.parts(filename).exists()
+
+
+def test_sink_flushes_partial_batch(tmp_path):
+    filename = tmp_path / 'results.jsonl'
+    _run(filename, ['a.jpg'], batch_size=100)
+    assert len(load_results(filename)) == 1
+
+
+def test_sqlite_sink_adds_new_columns(tmp_path):
+    filename = tmp_path / 'results.db'
+    conn = sqlite3.connect(str(filename))
+    # a results file of an older version (no stage timings)
+    conn.execute("CREATE TABLE results (path TEXT, data TEXT)")
+    conn.execute("INSERT INTO results VALUES ('EDO/old.jpg', 'm!1!0!0')")
+    conn.commit()
+    conn.close()
+    _run(filename, ['a.jpg'])
+    records = load_results(filename)
+    assert [r['path'] for r in records] == ['EDO/old.jpg', 'EDO/MP/PQ/a.jpg']
+    assert records[0]['time_decode'] is None
+
+
+def test_parquet_parts_survive_a_crash(tmp_path):
+    pytest.importorskip('pyarrow')
+    filename = tmp_path / 'results.parquet'
+    _run(filename, ['a.jpg'])
+
+    async def interrupted():
+        sink = get_sink(filename, batch_size=1)
+        await sink.start()
+        for name in ('b.jpg', 'c.jpg'):
+            await sink.add(make_record('EDO/MP/PQ', name))
+        await sink.sync()
+        # never closed: the parts were written
+    asyncio.run(interrupted())
+    assert [r['path'][-5:] for r in load_results(filename)] == [
+        'a.jpg', 'b.jpg', 'c.jpg'
+    ]
+    # merged by the next run
+    _run(filename, ['d.jpg'])
+    assert not ParquetSink.parts(filename).exists()
+    assert len(load_results(filename)) == 4
+
+
+def test_manifest_commits_after_the_results(tmp_path):
+    pytest.importorskip('cv2')
+    from cne_evaluation.batch import BatchProcessor
+    from cne_evaluation.manifest import Manifest
+    results = tmp_path / 'results.jsonl'
+    committed = []
+
+    class Checked(Manifest):
+        def record(self, key, filename, **kwargs):
+            super().record(key, filename, **kwargs)
+            if self._uncommitted == 0:
+                committed.append(len(load_results(results)))
+    actas = []
+    for idx in range(5):
+        acta = tmp_path / 'actas' / f"acta_{idx}.jpg"
+        acta.parent.mkdir(exist_ok=True)
+        acta.write_bytes(b'not an image')
+        actas.append((Path('EDO'), tmp_path / 'out' / acta.name, acta))
+
+    async def run():
+        manifest = Checked(tmp_path / 'manifest.db', commit_every=2)
+        async with get_sink(results, batch_size=100) as sink:
+            batch = BatchProcessor(
+                executor='thread', max_workers=2, in_memory=True,
+                manifest=manifest, sink=sink, logdir=tmp_path / 'Log'
+            )
+            async with batch:
+                async for _ in batch.run(actas):
+                    pass
+        manifest.close()
+    asyncio.run(run())
+    # every manifest commit found the results of its actas written
+    assert len(committed) == 2
+    assert committed[0] >= 2 and committed[1] >= 4
@@ -0,0 +1,59 @@
+"""Quality triage, also over a reduced decode of the acta."""
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+from cne_evaluation.images import ImageProcessor  # noqa: E402  pylint: disable=C0413
+from cne_evaluation.synthetic import generate_actas  # noqa: E402  pylint: disable=C0413
+from cne_evaluation.triage import TriagePolicy, measure  # noqa: E402  pylint: disable=C0413
+
+
+@pytest.fixture(scope='module')
+def acta(tmp_path_factory):
+    # 300 dpi: large enough for a 1/4 decode (fast deskew)
+    actas = tmp_path_factory.mktemp('actas')
+    spec, = generate_actas(
+        actas, count=1, seed=1, dpi=300, max_skew=2, blue_ink=2,
+        speckle=0, border=0
+    )
+    return actas / spec.filename, spec
+
+
+def test_measure_on_a_reduced_decode(acta):
+    filename, _ = acta
+    image = cv2.imread(str(filename))
+    reduced = cv2.imread(str(filename), cv2.IMREAD_REDUCED_COLOR_4)
+    full, fast = measure(image), measure(image, reduced=reduced)
+    # blur and noise always on the full resolution strip
+    assert (fast.blur, fast.noise) == (full.blur, full.noise)
+    assert fast.contrast == pytest.approx(full.contrast, abs=2)
+    assert fast.border == pytest.approx(full.border, abs=0.01)
+    assert fast.blue == pytest.approx(full.blue, rel=0.2)
+
+
+def _process(filename, destination, reduced_analysis):
+    processor = ImageProcessor(
+        filename, destination, logdir=destination.parent, in_memory=True,
+        triage=TriagePolicy.from_spec('fast=light, standard=, heavy=clean'),
+        reduced_analysis=reduced_analysis
+    )
+    processor.process_image(deskew='fast')
+    return processor
+
+
+def test_reduced_analysis_with_triage(acta, tmp_path, monkeypatch):
+    filename, spec = acta
+    full = _process(filename, tmp_path / 'full.jpg', False)
+    reads = []
+    read_reduced = ImageProcessor.read_reduced
+
+    def spy(self, shape, max_side, color=False):
+        reduced = read_reduced(self, shape, max_side, color)
+        reads.append((max_side, color, reduced.shape))
+        return reduced
+    monkeypatch.setattr(ImageProcessor, 'read_reduced', spy)
+    processor = _process(filename, tmp_path / 'reduced.jpg', True)
+    # the fast preset needs 600 pixels: a 1/4 color decode
+    height, width = cv2.imread(str(filename)).shape[:2]
+    assert reads == [(600, True, (-(-height // 4), -(-width // 4), 3))]
+    assert processor.tier.name == full.tier.name
+    assert processor.skew.angle == pytest.approx(-spec.skew, abs=0.2)
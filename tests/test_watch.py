@@ -0,0 +1,107 @@
+"""Watch mode: actas processed as they land on the tree."""
+import asyncio
+import pytest
+
+pytest.importorskip('cv2')
+from cne_evaluation.watch import TreeWatcher, WatchDaemon  # noqa: E402  pylint: disable=C0413
+from cne_evaluation.batch import BatchProcessor  # noqa: E402  pylint: disable=C0413
+from cne_evaluation.manifest import Manifest  # noqa: E402  pylint: disable=C0413
+from cne_evaluation.synthetic import generate_actas  # noqa: E402  pylint: disable=C0413
+
+
+async def _drain(watcher, timeout=0.5):
+    paths = set()
+    try:
+        while True:
+            paths.add(await asyncio.wait_for(watcher.get(), timeout))
+    except asyncio.TimeoutError:
+        return paths
+
+
+def test_polling_scan(tmp_path):
+    async def run():
+        watcher = TreeWatcher(tmp_path, use_inotify=False, interval=0.05)
+        await watcher.start()
+        acta = tmp_path / 'EDO' / 'a.jpg'
+        acta.parent.mkdir()
+        acta.write_bytes(b'acta')
+        # hidden names are uploads in progress, not actas
+        (tmp_path / 'EDO' / '.b.jpg').write_bytes(b'acta')
+        (tmp_path / 'EDO' / 'notas.txt').write_bytes(b'text')
+        first = await _drain(watcher, 0.3)
+        acta.write_bytes(b'acta, modified')
+        second = await _drain(watcher, 0.3)
+        watcher.close()
+        return watcher, first, second, str(acta)
+    watcher, first, second, acta = asyncio.run(run())
+    assert watcher.mode == 'polling'
+    assert first == {acta} and second == {acta}
+
+
+def test_inotify_events(tmp_path):
+    async def run():
+        watcher = TreeWatcher(tmp_path, rescan=3600)
+        if watcher.mode != 'inotify':
+            pytest.skip('inotify not available')
+        await watcher.start()
+        (tmp_path / 'a.jpg').write_bytes(b'acta')
+        # a directory copied with its actas
+        (tmp_path / 'EDO.tmp' / 'MP').mkdir(parents=True)
+        (tmp_path / 'EDO.tmp' / 'MP' / 'b.jpg').write_bytes(b'acta')
+        (tmp_path / 'EDO.tmp').rename(tmp_path / 'EDO')
+        paths = await _drain(watcher)
+        (tmp_path / 'EDO' / 'MP' / 'c.jpg').write_bytes(b'acta')
+        paths |= await _drain(watcher)
+        watcher.close()
+        return paths
+    assert asyncio.run(run()) == {
+        str(tmp_path / 'a.jpg'), str(tmp_path / 'EDO/MP/b.jpg'),
+        str(tmp_path / 'EDO/MP/c.jpg')
+    }
+
+
+def test_daemon_processes_arriving_actas(tmp_path):
+    incoming, staging = tmp_path / 'incoming', tmp_path / 'staging'
+    incoming.mkdir()
+    specs = generate_actas(
+        staging, count=2, seed=1, max_skew=0, blue_ink=0, speckle=0,
+        border=0, hierarchy=('EDO', 'MP', 'PQ')
+    )
+    manifest = Manifest(tmp_path / 'manifest.db', commit_every=1)
+
+    async def run(expected):
+        batch = BatchProcessor(
+            executor='thread', max_workers=1, in_memory=True,
+            manifest=manifest, logdir=tmp_path / 'Log'
+        )
+        daemon = WatchDaemon(
+            incoming, tmp_path / 'out', batch, manifest=manifest,
+            settle=0.2, use_inotify=False, interval=0.1
+        )
+        results = []
+
+        async def land():
+            await asyncio.sleep(0.3)
+            for spec in specs:
+                target = incoming / spec.filename
+                if not target.exists():
+                    target.parent.mkdir(parents=True, exist_ok=True)
+                    target.write_bytes((staging / spec.filename).read_bytes())
+            await asyncio.sleep(2.0)
+            daemon.stop()
+        lander = asyncio.ensure_future(land())
+        async with batch:
+            async for result in daemon.run():
+                results.append(result)
+                if len(results) == expected:
+                    daemon.stop()
+        lander.cancel()
+        return results, batch
+    results, batch = asyncio.run(run(len(specs)))
+    assert sorted(r.data for r in results) == sorted(s.payload for s in specs)
+    assert all(str(r.relative_path) == 'EDO/MP/PQ' for r in results)
+    assert batch.metrics.snapshot()['stages']['latency']['count'] == 2
+    # restarted over the same files: the manifest has every acta
+    results, _ = asyncio.run(run(0))
+    assert results == []
+    manifest.close()
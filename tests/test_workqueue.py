@@ -0,0 +1,133 @@
+"""Work queue: shards leased by several workers."""
+import time
+import sqlite3
+import pytest
+
+# the workers run the acta pipeline (OpenCV)
+pytest.importorskip('cv2')
+from cne_evaluation.workqueue import (  # noqa: E402  pylint: disable=C0413
+    WorkQueue,
+    find_shards,
+    TREE,
+    FILES,
+    ACTA
+)
+from cne_evaluation.failures import FailureQueue, QR_NOT_FOUND  # noqa: E402  pylint: disable=C0413
+from cne_evaluation.results import load_results  # noqa: E402  pylint: disable=C0413
+from cne_evaluation.cli import main  # noqa: E402  pylint: disable=C0413
+
+
+def _tree(root):
+    for path in ('EDO/MP1/PQ/a.jpg', 'EDO/MP2/PQ/b.jpg', 'EDO/c.jpg'):
+        root.joinpath(path).parent.mkdir(parents=True, exist_ok=True)
+        root.joinpath(path).write_bytes(b'\xff\xd8acta\xff\xd9')
+    return root
+
+
+def test_find_shards(tmp_path):
+    root = _tree(tmp_path / 'actas')
+    assert find_shards(root, depth=2) == [
+        ('EDO', FILES), ('EDO/MP1', TREE), ('EDO/MP2', TREE)
+    ]
+    assert find_shards(root, depth=0) == [
+        ('EDO/MP1/PQ/a.jpg', ACTA), ('EDO/MP2/PQ/b.jpg', ACTA),
+        ('EDO/c.jpg', ACTA)
+    ]
+
+
+def test_lease_and_complete(tmp_path):
+    with WorkQueue(tmp_path / 'queue.db') as queue:
+        assert queue.enqueue([('EDO/MP1', TREE), ('EDO/MP2', TREE)]) == 2
+        # a restarted coordinator adds nothing
+        assert queue.enqueue([('EDO/MP1', TREE)]) == 0
+        first, second = queue.claim('w1'), queue.claim('w2')
+        assert {first.shard, second.shard} == {'EDO/MP1', 'EDO/MP2'}
+        assert queue.claim('w3') is None
+        assert queue.renew(first)
+        assert queue.complete(first, actas=3, decoded=2)
+        queue.release(second)
+        again = queue.claim('w3')
+        assert again.shard == second.shard and again.attempts == 1
+        assert queue.complete(again)
+        assert not queue.active()
+        assert queue.stats()[WorkQueue.DONE] == 2
+
+
+def test_expired_lease_is_reclaimed(tmp_path):
+    with WorkQueue(tmp_path / 'queue.db', lease=0.05, max_attempts=2) as queue:
+        queue.enqueue([('EDO/MP1', TREE)])
+        lost = queue.claim('w1')
+        time.sleep(0.1)
+        # the worker died: another one takes the shard
+        reclaimed = queue.claim('w2')
+        assert reclaimed.shard == lost.shard and reclaimed.attempts == 2
+        # the first lease can no longer renew or complete it
+        assert not queue.renew(lost)
+        assert not queue.complete(lost)
+        time.sleep(0.1)
+        # expired on its last attempt: failed
+        assert queue.requeue_expired() == 1
+        assert queue.stats() == {WorkQueue.FAILED: 1, 'actas': 0, 'decoded': 0}
+        assert not queue.active()
+
+
+def test_results_by_shard(tmp_path):
+    with WorkQueue(tmp_path / 'queue.db') as queue:
+        queue.add_results([
+            {'path': 'EDO/MP1/PQ/a.jpg', 'data': 'm!1!0!0'},
+            {'path': 'EDO/MP1/PQ/b.jpg', 'error': 'QR code not found'},
+            {'path': 'EDO/MP10/PQ/c.jpg', 'data': 'm!2!0!0'},
+        ], worker='w1')
+        # a re-leased shard resumes from its decoded actas
+        assert queue.decoded('EDO/MP1') == {'EDO/MP1/PQ/a.jpg'}
+        assert len(list(queue.results())) == 3
+
+
+def test_shared_failure_queue(tmp_path):
+    filename = tmp_path / 'failures.db'
+    first = FailureQueue(filename, commit_every=1, journal_mode='DELETE')
+    second = FailureQueue(filename, commit_every=1, journal_mode='DELETE')
+    # failed on a worker, decoded on another one
+    first.add('EDO/a.jpg', '/actas/EDO/a.jpg', 'EDO', '/out/a.jpg',
+              QR_NOT_FOUND)
+    second.resolve('EDO/a.jpg')
+    assert first.stats() == {}
+    first.close()
+    second.close()
+    conn = sqlite3.connect(str(filename))
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == 'delete'
+    conn.close()
+
+
+def test_local_run_with_two_workers(tmp_path):
+    from cne_evaluation.synthetic import generate_actas
+    actas = tmp_path / 'actas'
+    for seed, municipio in enumerate(('MP1', 'MP2')):
+        generate_actas(
+            actas, count=2, seed=seed + 1, max_skew=0, blue_ink=0,
+            speckle=0, border=0, hierarchy=('EDO', municipio, 'PQ')
+        )
+    manifest = tmp_path / 'Log' / 'manifest.db'
+    args = [
+        'queue', 'local', str(tmp_path / 'queue.db'), str(actas), str(tmp_path / 'out'),
+        '--nodes', '2', '--executor', 'thread', '--max-workers', '1',
+        '--interval', '0.1', '--logdir', str(tmp_path / 'Log'),
+        '--manifest', str(manifest),
+        '--failures', str(tmp_path / 'Log' / 'failures.db'),
+        '--results', str(tmp_path / 'results.jsonl')
+    ]
+    main(args)
+    with WorkQueue(tmp_path / 'queue.db') as queue:
+        stats = queue.stats()
+    assert stats[WorkQueue.DONE] == 2 and stats['actas'] == 4
+    # merged from both workers
+    assert len(load_results(tmp_path / 'results.jsonl')) == 4
+    conn = sqlite3.connect(str(manifest))
+    assert conn.execute("SELECT COUNT(*) FROM actas").fetchone()[0] == 4
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == 'delete'
+    conn.close()
+    # another queue over the same tree: the manifest skips every acta
+    args[2] = str(tmp_path / 'queue2.db')
+    main(args)
+    with WorkQueue(tmp_path / 'queue2.db') as queue:
+        assert queue.stats()['actas'] == 0